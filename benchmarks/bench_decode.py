@@ -0,0 +1,199 @@
+"""
+compare the compiled reply decoders with the former walk over the reply parameters
+
+python benchmarks/bench_decode.py [-f wolfprot.json] [-n blocks]
+"""
+import argparse
+import os
+import timeit
+
+from wolfprot import wolfdoc
+
+TEST_DOC = os.path.join(os.path.dirname(__file__), '..', 'tests', 'wolfprot_test.json')
+
+
+def legacy_get_elements(doc, direction, section=None, attr=None):
+    """
+    Wolfdoc.get_elements before the indexes, copies every element of the document
+    """
+    if section is None:
+        sections = doc.root[direction]['categories']
+    else:
+        sections = {section: ""}
+
+    result = dict()
+    for i in sections:
+        elements = doc.root[direction]['categories'][i]
+        element = dict()
+        for key in elements:
+            values = [(j, elements[key][j]) for j in elements[key] if attr is None or j in attr]
+            val = dict()
+            for j in values:
+                val[j[0]] = j[1]
+            element[key] = val
+        result[i] = element
+
+    return result
+
+
+def legacy_get_element_by_cmd(doc, direction, cmd, attr=None):
+    """
+    Wolfdoc.get_element_by_cmd before the indexes, a linear scan over all elements
+    """
+    if attr:
+        attr.append('command')
+    elements = legacy_get_elements(doc, direction, None, attr)
+    res = [{i: {j: elements[i][j]}} for i in elements for j in elements[i]
+           if elements[i][j]['command'] == cmd.upper()]
+    if len(res) == 0:
+        return None
+    return res[0]
+
+
+def legacy_get_param_list(doc, value=None):
+    """
+    Wolfdoc.get_param_list before the indexes, a linear scan returning the entry itself
+    """
+    attr = 'idx' if type(value) is int else 'name'
+    for i in doc.param_list:
+        if i[attr] == value:
+            i['comment'] = i['name']
+            return i
+    return None
+
+
+def legacy_get_response(doc, raw_package, variant=0):
+    """
+    Wolfdoc.generate_get_response before the decoders were compiled, with the lookups of that version
+    """
+    c = legacy_get_element_by_cmd(doc, raw_package['type'], raw_package['cmd'].hex().upper())
+    if c is None:
+        return None
+
+    res = [(i, j, c[i][j]) for i in c for j in c[i]]
+    category = res[0][0]
+    sub = res[0][1]
+    c = res[0][2]
+
+    var = c['variations']
+    cmd = c['command']
+
+    raw = raw_package['data']
+    pkg = list()
+    blk_len_check = None
+    optional_param = None
+
+    if len(var) <= variant:
+        raise ValueError('variant out of range')
+
+    req = var[variant]['reply']
+    param = req['parameters']
+
+    if len(param) != 0:
+        start = 0
+        end = 0
+
+        rm_param = list()
+        data_common = dict()
+        if cmd == 'CBBA':
+            f = ('Window reference width', 'Window reference height')
+            rm_param = [i for i in param if i['comment'] in f]
+        elif cmd == 'CB90':
+            f = ('Number of sources')
+            rm_param = [i for i in param if i['comment'] in f]
+            blk_len_check = ('Source block length')
+            optional_param = ('Type specific source block')
+
+        for i in rm_param:
+            param_len = i['length']
+            comment = i['comment']
+            if param_len:
+                end = start + param_len
+                data_common[comment] = int(raw[start:end].hex(), 16)
+                prev_val = data_common[comment]
+                start = end
+
+        if len(data_common):
+            pkg.append(data_common)
+
+        while end < len(raw):
+            prev = None
+            data = dict()
+            blk_len = 0
+            for i in param:
+                if i in rm_param:
+                    continue
+                if start >= len(raw):
+                    if prev and prev['comment'].find(comment) != -1 and prev_val == 0:
+                        comment = i['comment']
+                        data[comment] = bytearray()
+                    break
+                param_id = i.get('parameterID', None)
+                if param_id:
+                    i = legacy_get_param_list(doc, param_id)
+                param_len = i['length']
+                comment = i['comment']
+                if param_len:
+                    end = start + param_len
+                    data[comment] = int(raw[start:end].hex(), 16)
+                    prev_val = data[comment]
+                    if blk_len_check and comment in blk_len_check:
+                        blk_len = 0
+                else:
+                    if prev and prev['comment'].find(comment) != -1:
+                        end = start + prev_val
+                        data[comment] = raw[start:end]
+                    else:
+                        if optional_param and optional_param == comment:
+                            end += (data[blk_len_check] - blk_len + 1)
+                            data[comment] = raw[start:end]
+                        else:
+                            data[comment] = raw
+                            end = len(raw)
+                prev = i
+                blk_len += end - start
+                start = end
+            pkg.append(data)
+    return category, sub, pkg
+
+
+def content_sources(blocks):
+    raw = bytearray([blocks & 0xFF])
+    for i in range(blocks):
+        name = f'source {i}'.encode('utf-8')
+        extra = bytes(4)
+        raw += (4 + len(name) + len(extra)).to_bytes(2, 'big') + i.to_bytes(2, 'big') + bytes([len(name)]) + name + extra
+    return {'type': 'GET', 'cmd': bytearray.fromhex('CB90'), 'data': raw}
+
+
+def window_list(blocks):
+    raw = bytearray.fromhex('07800438')
+    for i in range(blocks):
+        name = f'window {i}'.encode('utf-8')
+        raw += i.to_bytes(2, 'big') + b'\x01' + bytes([len(name)]) + name
+    return {'type': 'GET', 'cmd': bytearray.fromhex('CBBA'), 'data': raw}
+
+
+def bench(doc, name, raw_package, number):
+    assert legacy_get_response(doc, raw_package) == doc.generate_get_response(raw_package)
+    legacy = min(timeit.repeat(lambda: legacy_get_response(doc, raw_package), number=number, repeat=5))
+    compiled = min(timeit.repeat(lambda: doc.generate_get_response(raw_package), number=number, repeat=5))
+    print(f'{name:<20} {legacy / number * 1e6:10.1f} us {compiled / number * 1e6:10.1f} us {legacy / compiled:6.1f}x')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='reply decoder benchmark')
+    parser.add_argument('-f', action='store', dest='wp_file', default=TEST_DOC, help='wolfprot.json file location')
+    parser.add_argument('-n', action='store', dest='blocks', type=int, default=200, help='blocks per reply')
+    args = parser.parse_args()
+
+    doc = wolfdoc.Wolfdoc(args.wp_file)
+    number = max(1, 20000 // args.blocks)
+    print(f'{"reply":<20} {"legacy":>13} {"compiled":>13} {"speedup":>7}')
+    bench(doc, 'CB90 Content Sources', content_sources(args.blocks), number)
+    bench(doc, 'CBBA Window list', window_list(args.blocks), number)
+    bench(doc, 'Uptime', {'type': 'GET', 'cmd': bytearray.fromhex('CB6A'), 'data': bytearray(4)}, 20000)
+
+
+if __name__ == '__main__':
+    main()
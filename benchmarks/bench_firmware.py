@@ -0,0 +1,52 @@
+"""
+firmware upload throughput against a local simulated device
+
+python benchmarks/bench_firmware.py [-s size in MB] [-c chunk sizes in KB]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from wolfprot import cynap
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+TEST_DOC = os.path.join(os.path.dirname(__file__), '..', 'tests', 'wolfprot_test.json')
+
+
+def main():
+    parser_ = argparse.ArgumentParser(description='firmware upload benchmark')
+    parser_.add_argument('-s', action='store', dest='size', type=int, default=256, help='image size in MB')
+    parser_.add_argument('-c', action='store', dest='chunks', default='64,256,1024,4096',
+                         help='comma separated chunk sizes in KB')
+    args = parser_.parse_args()
+
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    # the firmware data is dropped
+    sim = simulator.Simulator(doc, keep_firmware=False).start_thread()
+
+    fd, name = tempfile.mkstemp(suffix='.wgz')
+    os.close(fd)
+    cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+    try:
+        with open(name, 'wb') as fp:
+            fp.truncate(args.size << 20)
+        if cb.connect() is False:
+            raise ConnectionError('simulator not reachable')
+
+        print(f'{"chunk":>10} {"MB/s":>10}')
+        for chunk in args.chunks.split(','):
+            chunk_size = int(chunk) << 10
+            start = time.perf_counter()
+            cb.set_firmware_update(name, chunk_size=chunk_size)
+            elapsed = time.perf_counter() - start
+            print(f'{chunk + " KB":>10} {args.size / elapsed:10.1f}')
+    finally:
+        cb.disconnect()
+        os.remove(name)
+        sim.stop_thread()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+import copy
+import json
+import os
+
+import pytest
+
+from wolfprot import cynap
+from wolfprot import schema
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+TEST_DOC = os.path.join(os.path.dirname(__file__), '..', 'tests', 'wolfprot_test.json')
+CATEGORIES = 50
+ELEMENTS = 40
+
+
+def large_doc(categories=CATEGORIES, elements=ELEMENTS):
+    """
+    the test document with categories * elements copies of Device/Boxname in GET and SET
+    """
+    with open(TEST_DOC) as fp:
+        root = json.load(fp)
+
+    for direction in ('GET', 'SET'):
+        template = root[direction]['categories']['Device']['Boxname']
+        for c in range(categories):
+            section = root[direction]['categories'].setdefault(f'Category {c}', dict())
+            for e in range(elements):
+                element = copy.deepcopy(template)
+                element['command'] = f'{0xC000 + c * elements + e:04X}'
+                section[f'Element {e}'] = element
+    return root
+
+
+@pytest.fixture(scope='session')
+def large_doc_file(tmp_path_factory):
+    name = tmp_path_factory.mktemp('doc') / 'wolfprot_large.json'
+    with open(name, 'w') as fp:
+        json.dump(large_doc(), fp)
+    return str(name)
+
+
+@pytest.fixture(scope='session')
+def large_wolfdoc(large_doc_file):
+    return wolfdoc.Wolfdoc(large_doc_file)
+
+
+@pytest.fixture(scope='session')
+def large_schema(large_doc_file):
+    return schema.load(large_doc_file)
+
+
+@pytest.fixture(scope='module')
+def device():
+    """
+    logged in Cynap connected to a simulated device on loopback
+    """
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+        if cb.connect() is False:
+            raise ConnectionError('simulator not reachable')
+        yield cb
+        cb.disconnect()
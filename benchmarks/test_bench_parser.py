@@ -0,0 +1,53 @@
+import pytest
+
+from wolfprot import parser
+
+pytest.importorskip('pytest_benchmark')
+
+# header variant: (cmd_type, cmd, data, ext_hdr, ext_len, error)
+VARIANTS = {'standard': ('GET', '4E', b'\x05' * 16, None, None, None),
+            'ext_len': ('GET', '4E', b'\x05' * 0x400, None, 1, None),
+            'ext_hdr': ('SET', '4E', b'\x05' * 0x10000, 1, None, None),
+            'ext_cmd': ('GET', 'CB67', b'box' * 5, None, None, None),
+            'error': ('GET', 'CB67', None, None, None, 'busy'),
+            }
+
+
+@pytest.fixture(params=list(VARIANTS))
+def variant(request):
+    return VARIANTS[request.param]
+
+
+def parse(package):
+    p = parser.Parser()
+    p.append_buffer(package)
+    p.parse_header()
+    return p.get_data()
+
+
+def test_parse(benchmark, variant):
+    package = bytes(parser.Parser().generate_package(*variant))
+    data = benchmark(parse, package)
+    if variant[5] is None:
+        assert(data == bytearray(variant[2]))
+
+
+def test_generate_package(benchmark, variant):
+    wp = parser.Parser()
+
+    def generate():
+        wp.buffer = bytearray()
+        return wp.generate_package(*variant)
+
+    assert(len(benchmark(generate)) > 2)
+
+
+def test_frame_decoder(benchmark, variant):
+    package = bytes(parser.Parser().generate_package(*variant))
+    dec = parser.FrameDecoder()
+
+    def decode():
+        dec.feed(package)
+        return dec.next_frame()
+
+    assert(benchmark(decode).cmd.hex().upper() == variant[1])
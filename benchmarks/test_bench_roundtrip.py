@@ -0,0 +1,34 @@
+import pytest
+
+from conftest import TEST_DOC
+from wolfprot import mux
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+pytest.importorskip('pytest_benchmark')
+
+
+def test_send_package(benchmark, device):
+    res = benchmark(device.send_package, 'Device', 'Boxname', 0, None, 'GET', False)
+    assert(res == ('Device', 'Boxname', [{'Name of box': bytearray(b'x' * 16)}]))
+
+
+def test_send_packages(benchmark, device):
+    requests = [('Device', 'Boxname'), ('Device', 'Uptime')] * 10
+    res = benchmark(device.send_packages, requests)
+    assert(len(res) == 20 and all(i['error'] is None for i in res))
+
+
+def test_mux(benchmark):
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc) as sim:
+        m = mux.Multiplexer(doc=doc)
+        key = m.connect('127.0.0.1', False, sim.ports['tcp'])
+        m.run_until_complete([m.login(key)])
+
+        def run():
+            return m.run_until_complete([m.request(key, 'Device', 'Boxname') for i in range(20)])
+
+        res = benchmark(run)
+        m.close()
+        assert(len(res) == 20 and all(i['error'] is None for i in res))
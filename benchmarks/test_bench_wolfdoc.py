@@ -0,0 +1,84 @@
+import pytest
+
+from conftest import CATEGORIES, ELEMENTS
+from wolfprot import parser
+from wolfprot import schema
+from wolfprot import wolfdoc
+
+pytest.importorskip('pytest_benchmark')
+
+LAST = f'{0xC000 + CATEGORIES * ELEMENTS - 1:04X}'
+
+
+def test_load(benchmark, large_doc_file):
+    doc = benchmark.pedantic(wolfdoc.Wolfdoc, (large_doc_file,), rounds=5)
+    assert(doc.get_element_by_cmd('GET', LAST) is not None)
+
+
+def test_load_cached(benchmark, large_doc_file):
+    wolfdoc.Wolfdoc(large_doc_file, cache=True)
+    doc = benchmark.pedantic(wolfdoc.Wolfdoc, (large_doc_file, True), rounds=5)
+    assert(doc.get_element_by_cmd('GET', LAST) is not None)
+
+
+def test_get_element_by_cmd(benchmark, large_wolfdoc):
+    res = benchmark(large_wolfdoc.get_element_by_cmd, 'GET', LAST)
+    assert(list(res) == [f'Category {CATEGORIES - 1}'])
+
+
+def test_generate_get_request(benchmark, large_wolfdoc):
+    section, name = f'Category {CATEGORIES - 1}', f'Element {ELEMENTS - 1}'
+    param = {'Name of box length': 7, 'Name of box': 'benchmk'}
+    req = benchmark(large_wolfdoc.generate_get_request, section, name, 0, param, 'SET')
+    assert(req[1:3] == bytearray.fromhex(LAST))
+
+
+def test_generate_get_response(benchmark, large_wolfdoc):
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex(LAST), 'data': bytearray(b'box' * 20)}
+    res = benchmark(large_wolfdoc.generate_get_response, raw)
+    assert(res == (f'Category {CATEGORIES - 1}', f'Element {ELEMENTS - 1}', [{'Name of box': bytearray(b'box' * 20)}]))
+
+
+def test_load_lazy(benchmark, large_doc_file):
+    wolfdoc.Wolfdoc(large_doc_file, cache=True)
+
+    def load():
+        doc = wolfdoc.Wolfdoc(large_doc_file, cache=True, lazy=True)
+        return doc.get_element_by_cmd('GET', LAST)
+
+    assert(benchmark.pedantic(load, rounds=5) is not None)
+
+
+def test_schema_load(benchmark, large_schema):
+    sc = benchmark(schema.Schema, large_schema.file)
+    assert(sc.get_element_by_cmd('GET', LAST) is not None)
+
+
+def test_schema_get_element_by_cmd(benchmark, large_schema):
+    res = benchmark(large_schema.get_element_by_cmd, 'GET', LAST)
+    assert(list(res) == [f'Category {CATEGORIES - 1}'])
+
+
+def test_schema_get_element_by_name(benchmark, large_schema):
+    res = benchmark(large_schema.get_element_by_name, 'GET', None, f'Element {ELEMENTS - 1}', ['command'])
+    assert(len(res) == CATEGORIES)
+
+
+def test_schema_generate_get_response(benchmark, large_schema):
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex(LAST), 'data': bytearray(b'box' * 20)}
+    res = benchmark(large_schema.generate_get_response, raw)
+    assert(res == (f'Category {CATEGORIES - 1}', f'Element {ELEMENTS - 1}', [{'Name of box': bytearray(b'box' * 20)}]))
+
+
+def test_encode_batch(benchmark, large_wolfdoc):
+    requests = [('GET', f'Category {i}', f'Element {j}', 0, None) for i in range(CATEGORIES) for j in range(4)]
+    buf = bytearray(4 * len(requests))
+    buf, offsets = benchmark(large_wolfdoc.encode_batch, requests, buf)
+    assert(len(offsets) == len(requests) + 1)
+
+
+def test_decode_array(benchmark, large_wolfdoc):
+    pytest.importorskip('numpy')
+    frames = b''.join(parser.Parser().generate_package('GET', '4E', bytes([i % 4, i % 256])) for i in range(10000))
+    arr = benchmark(large_wolfdoc.decode_array, 'Audio', 'Volume', frames, 1)
+    assert(len(arr) == 10000)
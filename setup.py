@@ -26,10 +26,14 @@ setup(name='pywolfprot',
       author_email='stefan.ursella@wolfvision.net',
       license='GPLv2',
       packages=['wolfprot'],
-      python_requires='>=3.6',
+      python_requires='>=3.7',
       install_requires=[
           'websocket-client',
       ],
+      extras_require={
+          'async': ['websockets'],
+          'numpy': ['numpy'],
+      },
       project_urls={
           'Bug Reports': 'https://github.com/stefanu21/pywolfprot',
           'Source': 'https://github.com/stefanu21/pywolfprot',
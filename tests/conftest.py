@@ -0,0 +1,38 @@
+import shutil
+import subprocess
+
+import pytest
+
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+TEST_DOC = 'tests/wolfprot_test.json'
+REPLIES = {'CB67': b'box', '4E': b'\x05'}
+
+
+@pytest.fixture
+def doc():
+    return wolfdoc.Wolfdoc(TEST_DOC)
+
+
+@pytest.fixture(scope='session')
+def cert(tmp_path_factory):
+    """
+    self-signed certificate for 127.0.0.1: (certfile, keyfile)
+    """
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl needed for a test certificate')
+    tmp = tmp_path_factory.mktemp('cert')
+    certfile, keyfile = str(tmp / 'cert.pem'), str(tmp / 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=127.0.0.1',
+                    '-days', '1', '-keyout', keyfile, '-out', certfile], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+@pytest.fixture
+def device(doc):
+    """
+    simulated device in a thread answering REPLIES, the other commands from the test document
+    """
+    with simulator.Simulator(doc, replies=REPLIES) as sim:
+        yield sim
@@ -0,0 +1,55 @@
+import asyncio
+
+import pytest
+
+from conftest import REPLIES
+from wolfprot import aio
+from wolfprot import simulator
+
+
+async def sessions(count, doc, port):
+    async def session():
+        async with aio.AsyncCynap('127.0.0.1', False, doc=doc, port=port) as cb:
+            name = await cb.send_package('Device', 'Boxname', 0, None, 'GET', False)
+            many = await cb.send_packages([('Device', 'Boxname'), ('Audio', 'Volume')])
+            return name, [i['data'] for i in many]
+
+    return await asyncio.gather(*[session() for i in range(count)])
+
+
+def test_async_cynap(doc, device):
+    res = asyncio.run(sessions(50, doc, device.ports['tcp']))
+    assert(len(res) == 50)
+    for name, many in res:
+        assert(name == ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+        assert(many == [bytearray(b'box'), bytearray(b'\x05')])
+
+
+async def boxname(host, use_ssl, doc, port=None):
+    async with aio.AsyncCynap(host, use_ssl, doc=doc, port=port) as cb:
+        return await cb.send_package('Device', 'Boxname', return_raw=False)
+
+
+def test_not_connected():
+    sock = aio.AsyncSocket('127.0.0.1', False)
+    try:
+        asyncio.run(sock.send_receive(bytearray.fromhex('08CB6700')))
+        assert(False)
+    except ConnectionError as err:
+        assert(str(err) == 'not connected')
+
+
+def test_tls(doc, cert):
+    with simulator.Simulator(doc, port=None, tls_port=0, certfile=cert[0], keyfile=cert[1], replies=REPLIES) as sim:
+        assert(asyncio.run(boxname('127.0.0.1', True, doc, sim.ports['tls'])) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+
+
+def test_websocket(doc, cert):
+    pytest.importorskip('websockets')
+    with simulator.Simulator(doc, port=None, ws_port=0, replies=REPLIES) as sim:
+        assert(asyncio.run(boxname(f'ws://127.0.0.1:{sim.ports["ws"]}', False, doc)) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+    with simulator.Simulator(doc, port=None, ws_port=0, certfile=cert[0], keyfile=cert[1], replies=REPLIES) as sim:
+        assert(asyncio.run(boxname(f'wss://127.0.0.1:{sim.ports["ws"]}', True, doc)) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
@@ -0,0 +1,142 @@
+import asyncio
+import threading
+import time
+
+from conftest import TEST_DOC
+from wolfprot import aio
+from wolfprot import cache
+from wolfprot import cynap
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+
+def test_cache():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    rc = cache.ResponseCache(ttl=60, ttls={'cb00': 0})
+    with simulator.Simulator(doc, replies={'CB67': b'box'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'], cache=rc)
+        assert(cb.connect())
+        requests = sim.requests
+        for i in range(3):
+            assert(cb.send_package('Device', 'Boxname', return_raw=False) ==
+                   ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+        assert(sim.requests == requests + 1)
+        assert(rc.stats() == {'hits': 2, 'misses': 1, 'size': 1})
+
+        # the reply is a copy
+        cb.send_package('Device', 'Boxname')['data'].clear()
+        assert(cb.send_package('Device', 'Boxname')['data'] == bytearray(b'box'))
+
+        # ttl 0: not cached
+        cb.send_package('Device', 'Model')
+        cb.send_package('Device', 'Model')
+        assert(sim.requests == requests + 3)
+
+        # a SET of the command drops the reply
+        cb.send_package('Device', 'Boxname', 0, {'Name of box length': 3, 'Name of box': 'new'}, 'SET')
+        assert(len(rc) == 0)
+        cb.send_package('Device', 'Boxname')
+        assert(sim.requests == requests + 5)
+        cb.disconnect()
+
+
+def test_lru_ttl():
+    rc = cache.ResponseCache(max_size=2, ttl=0.05)
+    reply = {'type': 'GET', 'cmd': bytearray.fromhex('cb67'), 'header': '', 'data': bytearray(b'box'), 'error': None}
+    keys = [rc.key('127.0.0.1', 'GET', 'cb67', bytes([i])) for i in range(3)]
+    for key in keys:
+        rc.put(key, reply)
+        rc.get(keys[0])
+    assert(rc.get(keys[0]) is not None and rc.get(keys[1]) is None and rc.get(keys[2]) is not None)
+
+    rc.put(keys[1], dict(reply, error='busy'))
+    assert(rc.get(keys[1]) is None)
+
+    time.sleep(0.1)
+    assert(rc.get(keys[0]) is None and len(rc) == 1)
+    rc.invalidate('127.0.0.1')
+    assert(len(rc) == 0)
+
+
+def test_single_flight():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, replies={'CB67': b'box'}, latency=0.2) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'], single_flight=cache.SingleFlight())
+        assert(cb.connect())
+        requests = sim.requests
+        results = list()
+
+        def run():
+            results.append(cb.send_package('Device', 'Boxname', return_raw=False))
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        assert(results == [('Device', 'Boxname', [{'Name of box': bytearray(b'box')}])] * 8)
+        assert(sim.requests - requests < 8 and cb.single_flight.shared == 8 - (sim.requests - requests))
+        cb.disconnect()
+
+
+def test_single_flight_error():
+    flights = cache.SingleFlight()
+    started = threading.Event()
+    errors = list()
+
+    def fail():
+        started.set()
+        time.sleep(0.1)
+        raise ValueError('failed')
+
+    def follow():
+        started.wait()
+        try:
+            flights.do('key', fail)
+        except ValueError as err:
+            errors.append(err)
+
+    follower = threading.Thread(target=follow)
+    follower.start()
+    try:
+        flights.do('key', fail)
+        assert(False)
+    except ValueError:
+        pass
+    follower.join()
+    assert(len(errors) == 1 and flights.shared == 1)
+
+
+def test_async_single_flight():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+
+    async def run(port):
+        async with aio.AsyncCynap('127.0.0.1', False, doc=doc, port=port,
+                                  single_flight=cache.AsyncSingleFlight()) as cb:
+            results = await asyncio.gather(*[cb.send_package('Device', 'Boxname', return_raw=False) for i in range(8)])
+            return results, cb.single_flight.shared
+
+    with simulator.Simulator(doc, replies={'CB67': b'box'}, latency=0.1) as sim:
+        results, shared = asyncio.run(run(sim.ports['tcp']))
+        assert(results == [('Device', 'Boxname', [{'Name of box': bytearray(b'box')}])] * 8)
+        assert(shared == 7 and sim.requests == 2)
+
+
+def test_async_single_flight_cancel():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+
+    async def run(port):
+        async with aio.AsyncCynap('127.0.0.1', False, doc=doc, port=port,
+                                  single_flight=cache.AsyncSingleFlight()) as cb:
+            leader = asyncio.ensure_future(cb.send_package('Device', 'Boxname'))
+            await asyncio.sleep(0.05)
+            # another return_raw shares the raw reply
+            follower = asyncio.ensure_future(cb.send_package('Device', 'Boxname', return_raw=False))
+            await asyncio.sleep(0.05)
+            leader.cancel()
+            return leader, await follower, cb.single_flight.shared
+
+    with simulator.Simulator(doc, replies={'CB67': b'box'}, latency=0.3) as sim:
+        leader, result, shared = asyncio.run(run(sim.ports['tcp']))
+        assert(leader.cancelled() and shared == 1 and sim.requests == 2)
+        assert(result == ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
@@ -0,0 +1,75 @@
+import socket
+import threading
+
+from wolfprot import connection
+from wolfprot import parser
+
+
+def fake_connection(reply):
+    """
+    Socket on one end of a socketpair, the other end answers all requests with reply
+    """
+    a, b = socket.socketpair()
+    s = connection.Socket('127.0.0.1', False)
+    s.sock = a
+
+    def device():
+        b.recv(4096)
+        b.sendall(reply)
+        b.close()
+
+    t = threading.Thread(target=device)
+    t.start()
+    return s, t
+
+
+def test_send_receive_many():
+    wv = parser.Parser()
+    replies = [wv.generate_package('get', 'cb67', b'box'),
+               wv.generate_package('get', 'cb00', b'', error='busy'),
+               wv.generate_package('get', '4e', b'\x05')]
+    s, t = fake_connection(b''.join(replies))
+    res = s.send_receive_many([wv.generate_package('get', 'cb67', None),
+                               wv.generate_package('get', 'cb00', None),
+                               wv.generate_package('get', '4e', None)])
+    t.join()
+    s.sock.close()
+
+    assert([(i['type'], i['cmd'].hex(), i['data'], i['error']) for i in res] ==
+           [('GET', 'cb67', bytearray(b'box'), None),
+            ('GET', 'cb00', bytearray(b'\x09'), 'busy'),
+            ('GET', '4e', bytearray(b'\x05'), None)])
+    assert(res[0]['header'] == '08cb6703')
+
+
+def test_send_receive_tail():
+    wv = parser.Parser()
+    s, t = fake_connection(wv.generate_package('get', 'cb67', b'box') + wv.generate_package('get', '4e', b'\x05'))
+    assert(s.send_receive(wv.generate_package('get', 'cb67', None)) == bytearray(b'box'))
+    assert(s.receive_frame(s.sock).data == b'\x05')
+    t.join()
+    s.sock.close()
+
+
+def test_trace(caplog):
+    wv = parser.Parser()
+    reply = wv.generate_package('get', 'cb67', b'box')
+    s, t = fake_connection(reply)
+    parser.enable_trace()
+    try:
+        with caplog.at_level(parser.TRACE, logger='wolfprot.trace'):
+            s.send_receive(wv.generate_package('get', 'cb67', None))
+    finally:
+        parser.disable_trace()
+        t.join()
+        s.sock.close()
+    assert([i.getMessage() for i in caplog.records if i.name == 'wolfprot.trace'] ==
+           ['127.0.0.1:50915 tx 08cb6700', f'127.0.0.1:50915 rx {reply.hex()}'])
+
+    # disabled: nothing is formatted
+    caplog.clear()
+    s, t = fake_connection(reply)
+    s.send_receive(wv.generate_package('get', 'cb67', None))
+    t.join()
+    s.sock.close()
+    assert(caplog.records == list())
@@ -0,0 +1,122 @@
+import concurrent.futures
+import os
+import threading
+
+from conftest import TEST_DOC
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import parser
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+
+def test_firmware_update(tmp_path):
+    image = os.urandom(100000)
+    name = str(tmp_path / 'cb1.wgz')
+    with open(name, 'wb') as fp:
+        fp.write(image)
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, replies={'CB67': b'box'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+        assert(cb.connect())
+        assert(cb.firmware_cmd() == 'CB1F')
+
+        steps = list()
+        assert(cb.set_firmware_update(name, chunk_size=30000, progress=lambda *i: steps.append(i)) == len(image))
+        assert(sim.firmware == image)
+        assert(steps == [(30000, 100000), (60000, 100000), (90000, 100000), (100000, 100000)])
+
+        # resume
+        sim.firmware = bytearray(image[:60000])
+        assert(cb.set_firmware_update(name, 'CB1F', 0x10000, 60000) == len(image))
+        assert(sim.firmware == image and sim.firmware_size == 140000)
+        cb.disconnect()
+
+
+def test_ext_header():
+    wv = parser.Parser()
+    hdr = wv.generate_ext_header('SET', 'CB1F', 3)
+    assert(hdr + b'abc' == wv.generate_package('SET', 'CB1F', b'abc', 1))
+    assert(wv.generate_ext_header('GET', 0x4e, 0) == bytearray.fromhex('02014e00000000'))
+
+
+def test_stream_package():
+    raw = bytearray([200])
+    for i in range(200):
+        name = f'source {i}'.encode('utf-8')
+        raw += (4 + len(name)).to_bytes(2, 'big') + i.to_bytes(2, 'big') + bytes([len(name)]) + name
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, replies={'CB90': raw, 'CB67': b'box'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+        assert(cb.connect())
+        records = list(cb.stream_package('Content', 'Content Sources'))
+        assert(records == doc.generate_get_response({'type': 'GET', 'cmd': bytearray.fromhex('CB90'),
+                                                     'data': raw})[2])
+        assert(len(records) == 201)
+
+        # stop early, the connection stays in sync
+        for record in cb.stream_package('Content', 'Content Sources'):
+            break
+        assert(cb.send_package('Device', 'Boxname')['data'] == bytearray(b'box'))
+
+        # the first record is decoded before the last chunk is received
+        send_receive_chunks = cb.connection.send_receive_chunks
+        received = list()
+
+        def small_chunks(data):
+            cmd_type, cmd, size, chunks = send_receive_chunks(data)
+
+            def pieces():
+                try:
+                    for chunk in chunks:
+                        for i in range(0, len(chunk), 64):
+                            received.append(len(chunk[i:i + 64]))
+                            yield chunk[i:i + 64]
+                finally:
+                    chunks.close()
+            return cmd_type, cmd, size, pieces()
+
+        cb.connection.send_receive_chunks = small_chunks
+        stream = cb.stream_package('Content', 'Content Sources')
+        assert(next(stream) == records[0])
+        assert(0 < sum(received) < len(raw))
+
+        # the lock is held until the generator is closed
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            assert(executor.submit(cb.lock.acquire, False).result(5) is False)
+            stream.close()
+            assert(executor.submit(cb.send_package, 'Device', 'Boxname').result(5)['data'] == bytearray(b'box'))
+        cb.disconnect()
+
+
+def test_threads():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    requests = [('Device', 'Boxname', b'box'), ('Device', 'Model', b'model'), ('Audio', 'Volume', b'\x07')]
+    replies = {doc.get_element_by_name('GET', section, name)[section][name]['command']: data
+               for section, name, data in requests}
+    with simulator.Simulator(doc, replies=replies, errors={'CB6A': 'busy'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+        assert(cb.connect())
+        failed = list()
+
+        def run(i):
+            section, name, data = requests[i % len(requests)]
+            for n in range(50):
+                res = cb.send_package(section, name)
+                if res['data'] != bytearray(data):
+                    failed.append(res)
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(6)]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+        assert(failed == list())
+
+        futures = [cb.submit(section, name) for section, name, data in requests * 20]
+        assert([i.result(5)['data'] for i in futures] == [bytearray(data) for section, name, data in requests * 20])
+        assert(cb.submit('Device', 'Boxname', return_raw=False).result(5) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+        assert(isinstance(cb.submit('Device', 'Uptime').exception(5), connection.DeviceError))
+        assert(isinstance(cb.submit('Device', 'Unknown').exception(5), KeyError))
+        cb.disconnect()
@@ -0,0 +1,27 @@
+import asyncio
+
+from conftest import TEST_DOC
+from wolfprot import fleet
+
+
+async def fleet_run(port):
+    results = list()
+    async with fleet.Fleet(['127.0.0.1', '127.0.0.2', '127.0.0.1'], 2, doc_file=TEST_DOC, use_ssl=False,
+                           port=port) as f:
+        async for res in f.run([('Device', 'Boxname'), ('Audio', 'Volume')]):
+            results.append(res)
+        sessions = dict(f.sessions)
+        async for res in f.run([('Device', 'Boxname')]):
+            results.append(res)
+        assert(f.sessions == sessions)
+    return results
+
+
+def test_fleet(device):
+    results = asyncio.run(fleet_run(device.ports['tcp']))
+    assert(len(results) == 4)
+    ok = [i for i in results if i['error'] is None]
+    failed = [i for i in results if i['error'] is not None]
+    assert(len(ok) == 2 and len(failed) == 2)
+    assert(all(i['host'] == '127.0.0.2' for i in failed))
+    assert(ok[0]['replies'][0] == ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
@@ -0,0 +1,54 @@
+from conftest import TEST_DOC
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import metrics
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+
+def test_histogram():
+    hist = metrics.Histogram((1, 2, 4))
+    for i in (0.5, 1, 3, 10):
+        hist.observe(i)
+    assert(hist.buckets() == [(1, 2), (2, 2), (4, 3), (float('inf'), 4)])
+    assert(hist.sum == 14.5 and hist.count == 4)
+
+
+def test_metrics():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    recorded = list()
+    m = metrics.enable(lambda name, labels, value: recorded.append(name))
+    try:
+        with simulator.Simulator(doc, replies={'CB67': b'box'}, errors={'4E': 'busy'}) as sim:
+            cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+            assert(cb.connect())
+            cb.send_package('Device', 'Boxname', return_raw=False)
+            try:
+                cb.send_package('Audio', 'Volume')
+            except connection.DeviceError:
+                pass
+            cb.disconnect()
+    finally:
+        metrics.disable()
+
+    assert(m.counters[('device_errors', (('error', 'busy'),))] == 1)
+    assert(m.counters[('bytes_sent', ())] == len(doc.generate_get_request('System', 'Login', 0, cynap.login_param(),
+                                                                          'SET')) + 4 + 3)
+    assert(m.counters[('bytes_received', ())] == len(sim.package('SET', 'CB41')) + len(sim.package('GET', 'CB67')) +
+           len(sim.package('GET', '4E', 'busy')))
+    assert(m.histograms[('wire', (('cmd', 'CB67'),))].count == 1)
+    assert(m.histograms[('encode', (('cmd', 'CB67'),))].count == 1)
+    assert(m.histograms[('decode', (('cmd', 'CB67'),))].count == 1)
+    assert(m.histograms[('login', (('cmd', 'CB41'),))].count == 1)
+    assert(m.histograms[('recv_calls', ())].count == 3)
+    assert('device_errors' in recorded)
+
+    text = m.prometheus()
+    assert('wolfprot_device_errors_total{error="busy"} 1\n' in text)
+    assert('# TYPE wolfprot_wire_seconds histogram\n' in text)
+    assert('wolfprot_wire_seconds_bucket{cmd="CB67",le="+Inf"} 1\n' in text)
+    assert('wolfprot_recv_calls_count 3\n' in text)
+
+    # disabled: nothing is recorded
+    doc.generate_get_request('Device', 'Boxname')
+    assert(m.histograms[('encode', (('cmd', 'CB67'),))].count == 1)
@@ -0,0 +1,63 @@
+import socket
+
+from conftest import TEST_DOC
+from wolfprot import mux
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def test_mux():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, login_required=True, replies={'CB67': b'box'}, errors={'4E': 'busy'}) as sim:
+        with mux.Multiplexer(doc=doc) as m:
+            key = m.connect('127.0.0.1', False, sim.ports['tcp'])
+            refused = m.connect('127.0.0.1', False, free_port())
+            called = list()
+            login = m.login(key)
+            futures = [m.request(key, 'Device', 'Boxname', callback=called.append) for i in range(50)]
+            busy = m.request(key, 'Audio', 'Volume')
+            failed = m.request(refused, 'Device', 'Boxname')
+
+            assert(login.result(5)['error'] is None)
+            assert(all(i.result(5)['data'] == bytearray(b'box') for i in futures))
+            assert(busy.result(5)['error'] == 'busy')
+            assert(called == futures)
+            assert(isinstance(failed.exception(5), ConnectionRefusedError))
+
+            m.close(key)
+            assert(isinstance(m.request(key, 'Device', 'Boxname').exception(5), ConnectionError))
+    assert(sim.connections == 1)
+
+
+def test_timeout():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, latency=1) as sim:
+        m = mux.Multiplexer(0.2, doc)
+        key = m.connect('127.0.0.1', False, sim.ports['tcp'])
+        future = m.request(key, 'Device', 'Boxname')
+        try:
+            m.run_until_complete([future])
+            assert(False)
+        except TimeoutError:
+            pass
+        m.close()
+        assert(m._wake_r.fileno() == -1 and m._wake_w.fileno() == -1)
+
+
+def test_tls(cert):
+    with simulator.Simulator(doc_file=TEST_DOC, tls_port=0, certfile=cert[0], keyfile=cert[1],
+                             reply_size=0x8000) as sim:
+        # single thread
+        m = mux.Multiplexer(doc=sim.doc)
+        keys = [m.connect('127.0.0.1', True, sim.ports['tls']), m.connect('127.0.0.1', False, sim.ports['tcp'])]
+        futures = [m.request(k, 'Device', 'Boxname') for i in range(20) for k in keys]
+        replies = m.run_until_complete(futures, 5)
+        assert(all(i['data'] == bytearray(b'x' * 0x8000) for i in replies))
+        assert(sim.connections == 2)
+        m.close()
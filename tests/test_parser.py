@@ -1,4 +1,6 @@
 import json
+import socket
+import threading
 
 from wolfprot import parser
 
@@ -69,6 +71,98 @@ def test_B():
         assert(result == read_test_input(t[i]))
 
 
+def test_C():
+    t = read_test_data()
+    stream = bytes.fromhex(''.join(read_test_input(t[i]) for i in t))
+    for chunk in (1, 3, len(stream)):
+        dec = parser.FrameDecoder(8)
+        frames = list()
+        for i in range(0, len(stream), chunk):
+            dec.feed(stream[i:i + chunk])
+            frame = dec.next_frame()
+            while frame is not None:
+                frames.append((frame.cmd_type, frame.cmd.hex(), frame.data.hex(), frame.get_error()))
+                frame = dec.next_frame()
+
+        assert(len(dec) == 0)
+        assert(len(frames) == len(t))
+        for frame, i in zip(frames, t):
+            hdr = read_test_result_header(t[i])
+            err = None if read_test_result_error(t[i]) == 'None' else read_test_result_error(t[i])
+            assert(frame == (hdr[0], hdr[1].hex(), read_test_result_data(t[i]), err))
+
+
+def test_D():
+    data = bytes(range(256)) * 4096
+    wv = parser.Parser()
+    pkg = wv.generate_package('get', 'cbcb', data, 1, 0)
+    pkg += wv.generate_package('set', 'cb', '00')
+
+    a, b = socket.socketpair()
+    tx = threading.Thread(target=a.sendall, args=(pkg,))
+    tx.start()
+    try:
+        dec = parser.FrameDecoder()
+        frame = dec.next_frame()
+        while frame is None:
+            assert(dec.recv_into(b) > 0)
+            frame = dec.next_frame()
+        assert(frame.cmd == bytes.fromhex('cbcb'))
+        assert(frame.data == data)
+
+        frame = dec.next_frame()
+        while frame is None:
+            assert(dec.recv_into(b) > 0)
+            frame = dec.next_frame()
+        assert((frame.cmd_type, frame.data.hex()) == ('SET', '00'))
+    finally:
+        tx.join()
+        a.close()
+        b.close()
+
+
+def test_E():
+    t = read_test_data()
+    wv = parser.Parser()
+    offsets = list()
+    for i in t:
+        offsets.append(len(wv.buffer))
+        wv.append_buffer(read_test_input(t[i]))
+
+    for offset, i in zip(offsets, t):
+        assert(wv.parse_header(offset)[0:2] == read_test_result_header(t[i])[0:2])
+        assert(wv.package_complete() is True)
+        assert(wv.get_data().hex() == read_test_result_data(t[i]))
+        assert(wv.get_header().hex().upper() == read_test_input(t[i])[:len(wv.get_header()) * 2])
+
+
+def test_F():
+    wv = parser.Parser()
+    wv.append_buffer('004E00')
+    assert(wv.package_complete() is True)
+    assert(wv.get_data() == bytearray())
+
+
 if __name__ == '__main__':
     test_A()
     test_B()
+    test_C()
+    test_D()
+    test_E()
+    test_F()
+
+
+def test_G():
+    # frames are views into the receive buffer, valid until the next feed
+    wv = parser.Parser()
+    first = bytes(wv.generate_package('get', 'cb67', b'box'))
+    second = bytes(wv.generate_package('get', 'cb68', b'abc'))
+    dec = parser.FrameDecoder()
+    dec.feed(first)
+    frame = dec.next_frame()
+    assert(frame.package == first and len(dec) == 0)
+    dec.feed(second)
+    assert(frame.package == second)
+    copy = bytes(dec.next_frame().package)
+    dec.feed(first)
+    assert(copy == second)
@@ -0,0 +1,41 @@
+from wolfprot import pool
+
+
+def test_pool(doc, device):
+    port = device.ports['tcp']
+    p = pool.ConnectionPool(doc=doc)
+    try:
+        for i in range(3):
+            with p.borrow('127.0.0.1', False, port=port) as cb:
+                assert(cb.send_package('Device', 'Boxname')['data'] == bytearray(b'box'))
+        assert(device.logins == 1)
+
+        # the device closed the idle connection: health check fails, new login
+        device.close_connections_thread()
+        with p.borrow('127.0.0.1', False, port=port) as cb2:
+            assert(cb2 is not cb)
+        assert(device.logins == 2)
+
+        # broken while borrowed: transparent reconnect
+        with p.borrow('127.0.0.1', False, port=port) as cb3:
+            device.close_connections_thread()
+            assert(cb3.send_package('Audio', 'Volume')['data'] == bytearray(b'\x05'))
+        assert(device.logins == 3)
+
+        # other credentials never get an idle session
+        with p.borrow('127.0.0.1', False, port=port) as cb4:
+            pass
+        with p.borrow('127.0.0.1', False, 'wrong', port=port) as cb5:
+            assert(cb5 is not cb4)
+        assert(device.logins == 4)
+        try:
+            pool.ConnectionPool().acquire('127.0.0.1', False, port=port)
+            assert(False)
+        except ValueError:
+            pass
+
+        p.idle_timeout = 0
+        p.evict_idle()
+        assert(len(p._idle) == 0)
+    finally:
+        p.clear()
@@ -0,0 +1,123 @@
+import pickle
+
+from conftest import TEST_DOC
+from wolfprot import cynap
+from wolfprot import schema
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+REPLIES = [{'type': 'GET', 'cmd': bytearray.fromhex('4E'), 'data': bytearray.fromhex('0305')},
+           {'type': 'GET', 'cmd': bytearray.fromhex('CBBA'),
+            'data': bytearray.fromhex('07800438' + '0001' + '01' + '03' + '616263' + '0002' + '02' + '00')},
+           {'type': 'GET', 'cmd': bytearray.fromhex('CB90'),
+            'data': bytearray.fromhex('02' + '0008' + '0001' + '02' + '6869' + '0a0b' + '0006' + '0002' + '02' + '6a6b')},
+           {'type': 'GET', 'cmd': bytearray.fromhex('CB67'), 'data': bytearray(b'box')},
+           {'type': 'SET', 'cmd': bytearray.fromhex('CB67'), 'data': bytearray()},
+           {'type': 'GET', 'cmd': bytearray.fromhex('FFFF'), 'data': bytearray()}]
+
+
+def subset(element):
+    """
+    the parts of an element kept in the schema
+    """
+    def param(p):
+        res = {'value': p.get('value'), 'length': p.get('length', 0),
+               'values': [{'value': i['value'], 'comment': i['comment']} for i in p.get('values', list())]}
+        for key in ('comment', 'parameterID'):
+            if key in p:
+                res[key] = p[key]
+        return res
+
+    return {'command': element['command'], 'userlevel': element['userlevel'],
+            'commandLength': element['commandLength'],
+            'variations': [{t: {'parameterLengthLength': v[t]['parameterLengthLength'],
+                                'parameters': [param(p) for p in v[t]['parameters']]} for t in ('request', 'reply')}
+                           for v in element['variations']]}
+
+
+def load(tmp_path):
+    wd = wolfdoc.Wolfdoc(TEST_DOC)
+    return wd, schema.Schema(schema.build(wd, str(tmp_path / 'wolfprot.schema')))
+
+
+def test_lookup(tmp_path):
+    wd, sc = load(tmp_path)
+    for direction in wd.direction_types:
+        elements = wd.get_elements(direction)
+        assert(sc.get_element_by_name(direction, None, None, {'command', 'userlevel'}) ==
+               wd.get_element_by_name(direction, None, None, {'command', 'userlevel'}))
+        for section in elements:
+            for name, element in elements[section].items():
+                c = sc.get_element_by_cmd(direction, element['command'])
+                first = wd.get_element_by_cmd(direction, element['command'])
+                sec, n = next(iter(first)), next(iter(first[next(iter(first))]))
+                assert(c == {sec: {n: subset(first[sec][n])}})
+                if (sec, n) != (section, name):
+                    continue
+                assert(sc.get_element_by_name(direction, section, name) == c)
+                assert(sc.get_element_by_name(direction, None, name) == c)
+    assert(sc.get_element_by_cmd('GET', 'FFFF') is None)
+    assert(sc.get_element_by_name('GET', 'Device', 'Unknown') is None)
+
+    for value in (1, 2, 'Window type', 'Volume', 3, 'Unknown', None):
+        entry = wd.get_param_list(value)
+        if entry is None:
+            assert(sc.get_param_list(value) is None)
+            continue
+        expected = {key: entry[key] for key in ('idx', 'name', 'comment', 'length', 'value')}
+        expected['values'] = [{'value': i['value'], 'comment': i['comment']} for i in entry['values']]
+        assert(sc.get_param_list(value) == expected)
+
+
+def test_name_index(tmp_path):
+    wd = wolfdoc.Wolfdoc(TEST_DOC)
+    wd.copy_element('GET', 'Device', 'Boxname', 'Audio', 'Boxname', 'FFFE')
+    sc = schema.Schema(schema.build(wd, str(tmp_path / 'wolfprot.schema')))
+
+    res = sc.get_element_by_name('GET', None, 'Boxname', {'command'})
+    assert(res == wd.get_element_by_name('GET', None, 'Boxname', {'command'}))
+    assert(list(res) == ['Device', 'Audio'])
+    assert(sc.get_element_by_name('SET', None, 'Unknown') is None)
+
+
+def test_template_parameter(tmp_path):
+    wd = wolfdoc.Wolfdoc(TEST_DOC)
+    wd.generate_template_parameter('Template', 'a0', 1, 'template')
+    wd.add_value_to_template_parameter('first', '01')
+    wd.add_template_parameter()
+    sc = schema.Schema(schema.build(wd, str(tmp_path / 'wolfprot.schema')))
+
+    assert('idx' not in wd.get_param_list('Template'))
+    assert(sc.get_param_list('Template') == {'name': 'Template', 'comment': 'Template', 'length': 1, 'value': 'a0',
+                                             'values': [{'value': '01', 'comment': 'first'}]})
+    assert(sc.get_param_list(1)['idx'] == 1)
+
+
+def test_codec(tmp_path):
+    wd, sc = load(tmp_path)
+    for raw in REPLIES:
+        assert(sc.generate_get_response(raw) == wd.generate_get_response(raw))
+    assert(sc.generate_get_response(REPLIES[0], 1) == wd.generate_get_response(REPLIES[0], 1))
+
+    param = {'Name of box length': 3, 'Name of box': 'box'}
+    assert(sc.generate_get_request('Device', 'Boxname', 0, param, 'SET') ==
+           wd.generate_get_request('Device', 'Boxname', 0, param, 'SET'))
+    assert(sc.generate_get_request('Audio', 'Volume', 1, {'Output': 3}) ==
+           wd.generate_get_request('Audio', 'Volume', 1, {'Output': 3}))
+
+    # workers map the same file
+    sc2 = pickle.loads(pickle.dumps(sc))
+    assert(sc2.file == sc.file and sc2.generate_get_response(REPLIES[3]) == wd.generate_get_response(REPLIES[3]))
+
+
+def test_cynap(tmp_path):
+    wd, sc = load(tmp_path)
+    with simulator.Simulator(sc, replies={'CB67': b'box'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=sc, port=sim.ports['tcp'])
+        assert(cb.win_types == [(i['comment'], i['value']) for i in wd.get_window_types()['values']])
+        cb.win_types = [('Custom', '01')]
+        assert(cb.win_types == [('Custom', '01')])
+        assert(cb.connect())
+        assert(cb.send_package('Device', 'Boxname', return_raw=False) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+        cb.disconnect()
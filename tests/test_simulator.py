@@ -0,0 +1,47 @@
+from conftest import TEST_DOC
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import simulator
+from wolfprot import wolfdoc
+
+
+def test_simulator():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, reply_size=5, errors={'4E': 'busy'}) as sim:
+        cb = cynap.Cynap('127.0.0.1', False, doc=doc, port=sim.ports['tcp'])
+        assert(cb.connect())
+        assert(cb.send_package('Device', 'Boxname', return_raw=False) ==
+               ('Device', 'Boxname', [{'Name of box': bytearray(b'xxxxx')}]))
+        assert(cb.send_package('Device', 'Uptime')['data'] == bytearray(4))
+        try:
+            cb.send_package('Audio', 'Volume')
+            assert(False)
+        except connection.DeviceError as err:
+            assert(str(err) == 'busy')
+        replies = cb.raw_packages([bytearray.fromhex('08CBFF00'), bytearray.fromhex('08CB6700')])
+        assert(replies[0]['error'] == 'unknown command')
+        assert(replies[1]['data'] == bytearray(b'xxxxx'))
+        cb.disconnect()
+        assert(sim.requests == 6)
+
+
+def test_login_required():
+    doc = wolfdoc.Wolfdoc(TEST_DOC)
+    with simulator.Simulator(doc, login_required=True, replies={'CB67': b'box'}) as sim:
+        sock = connection.Socket('127.0.0.1', False, sim.ports['tcp'])
+        sock.connect()
+        replies = sock.send_receive_many([doc.generate_get_request('Device', 'Boxname'),
+                                          doc.generate_get_request('System', 'Login', 0,
+                                                                   cynap.login_param(), 'SET'),
+                                          doc.generate_get_request('Device', 'Boxname')])
+        sock.disconnect()
+        assert([i['error'] for i in replies] == ['auth required', None, None])
+        assert(replies[2]['data'] == bytearray(b'box'))
+
+
+def test_tls(cert):
+    with simulator.Simulator(doc_file=TEST_DOC, port=None, tls_port=0, certfile=cert[0], keyfile=cert[1]) as sim:
+        cb = cynap.Cynap('127.0.0.1', True, doc=sim.doc, port=sim.ports['tls'])
+        assert(cb.connect())
+        assert(cb.send_package('Device', 'Boxname')['data'] == bytearray(b'x' * 16))
+        cb.disconnect()
@@ -0,0 +1,286 @@
+import os
+
+import pytest
+
+from conftest import TEST_DOC
+from wolfprot import parser
+from wolfprot import wolfdoc
+
+
+def read_test_doc(doc=TEST_DOC):
+    return wolfdoc.Wolfdoc(doc)
+
+
+def test_element_by_cmd():
+    wd = read_test_doc()
+    c = wd.get_element_by_cmd('GET', 'cb90')
+    assert(list(c) == ['Content'])
+    assert(c['Content']['Content Sources'] is wd.root['GET']['categories']['Content']['Content Sources'])
+    assert(wd.get_element_by_cmd('GET', 'FFFF') is None)
+    assert(wd.get_element_by_cmd('SET', 'CB00') is None)
+
+    c = wd.get_element_by_cmd('GET', 'CB67', ['userlevel'])
+    assert(c == {'Device': {'Boxname': {'command': 'CB67', 'userlevel': '0'}}})
+
+
+def test_element_by_name():
+    wd = read_test_doc()
+    c = wd.get_element_by_name('SET', 'System', 'Login', {'command'})
+    assert(c == {'System': {'Login': {'command': 'CB41'}}})
+    assert(wd.get_element_by_name('SET', 'System', 'Logout') is None)
+    assert(list(wd.get_element_by_name('GET', None, 'Boxname')) == ['Device'])
+
+
+def test_index_sync():
+    wd = read_test_doc()
+    wd.copy_element('GET', 'Device', 'Model', 'Device', 'Model2', 'FFFF')
+    assert(wd.get_element_by_cmd('GET', 'FFFF') == {'Device': {'Model2': wd.root['GET']['categories']['Device']['Model2']}})
+
+    wd.remove_element('GET', 'Device', 'Model2')
+    assert(wd.get_element_by_cmd('GET', 'FFFF') is None)
+
+    wd.generate_element('SET', 'CDCD', 'Device', 'Model2', '', '2')
+    wd.add_element()
+    assert(list(wd.get_element_by_cmd('SET', 'CDCD')['Device']) == ['Model2'])
+
+    wd.edit_section('SET', 'Device', 'rename', 'Box')
+    assert(list(wd.get_element_by_cmd('SET', 'CDCD')) == ['Box'])
+    assert(wd.get_element_by_name('SET', 'Box', 'Boxname') is not None)
+
+    wd.edit_section('SET', 'Box', 'remove')
+    assert(wd.get_element_by_cmd('SET', 'CDCD') is None)
+
+
+def test_generate_get_request():
+    wd = read_test_doc()
+    login = [p['comment'] for p in wd.root['SET']['categories']['System']['Login']['variations'][0]['request']['parameters']]
+    req = wd.generate_get_request('System', 'Login', 0, dict(zip(login, [2, 8, 'Password', 0, ''])), 'SET')
+    assert(req.hex() == '09cb410b020850617373776f726400')
+    assert(wd.generate_get_request('Device', 'Boxname').hex() == '08cb6700')
+    assert(wd.generate_get_request('Audio', 'Volume', 1, {'Output': 3}).hex() == '004e0103')
+    assert(wd.generate_get_request('Audio', 'Volume', 0, {'Volume': 77}, 'SET').hex() == '014e014d')
+
+    param = {'Window ID': 1, 'X': 2, 'Y': 300, 'Width': 1920, 'Height': 1080}
+    req = wd.generate_get_request('Windows', 'Window position', 0, param, 'SET')
+    assert(req.hex() == '0dcbbb000a00010002012c07800438')
+
+    # values longer than the parameter are rejected instead of written with more bytes
+    with pytest.raises(ValueError):
+        wd.generate_get_request('Audio', 'Volume', 1, {'Output': 0x1234})
+    with pytest.raises(ValueError):
+        wd.generate_get_request('Audio', 'Volume', 0, {'Volume': -1}, 'SET')
+
+
+def test_compile_request():
+    wd = read_test_doc()
+    enc = wd.compile_request('Windows', 'Window position', 0, 'SET')
+    assert(enc is wd.compile_request('Windows', 'Window position', 0, 'SET'))
+
+    buf = bytearray(32)
+    param = {'Window ID': 1, 'X': 2, 'Y': 300, 'Width': 1920, 'Height': 1080}
+    assert(enc.encode_into(buf, 2, param) == 15)
+    assert(buf[2:17].hex() == '0dcbbb000a00010002012c07800438')
+
+    wd.remove_element('SET', 'Windows', 'Window position')
+    try:
+        wd.compile_request('Windows', 'Window position', 0, 'SET')
+        assert False
+    except KeyError:
+        pass
+
+
+def test_generate_get_response():
+    wd = read_test_doc()
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex('4E'), 'data': bytearray.fromhex('0305')}
+    assert(wd.generate_get_response(raw, 1) == ('Audio', 'Volume', [{'Output': 3, 'Volume': 5}]))
+
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex('CBBA'),
+           'data': bytearray.fromhex('07800438' + '0001' + '01' + '03' + '616263' + '0002' + '02' + '00')}
+    assert(wd.generate_get_response(raw) == ('Windows', 'Window list', [
+        {'Window reference width': 1920, 'Window reference height': 1080},
+        {'Window ID': 1, 'Window type': 1, 'Window name length': 3, 'Window name': bytearray(b'abc')},
+        {'Window ID': 2, 'Window type': 2, 'Window name length': 0, 'Window name': bytearray()}]))
+
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex('CB90'),
+           'data': bytearray.fromhex('02' + '0008' + '0001' + '02' + '6869' + '0a0b' + '0006' + '0002' + '02' + '6a6b')}
+    assert(wd.generate_get_response(raw) == ('Content', 'Content Sources', [
+        {'Number of sources': 2},
+        {'Source block length': 8, 'Source ID': 1, 'Source name length': 2, 'Source name': bytearray(b'hi'),
+         'Type specific source block': bytearray.fromhex('0a0b')},
+        {'Source block length': 6, 'Source ID': 2, 'Source name length': 2, 'Source name': bytearray(b'jk')}]))
+
+    raw = {'type': 'GET', 'cmd': bytearray.fromhex('CB67'), 'data': bytearray(b'box')}
+    assert(wd.generate_get_response(raw) == ('Device', 'Boxname', [{'Name of box': bytearray(b'box')}]))
+    assert(wd.compile_reply('Windows', 'Window list') is wd.compile_reply('Windows', 'Window list'))
+
+
+def test_cache(tmp_path):
+    name = str(tmp_path / 'wolfprot.json')
+    with open(TEST_DOC) as src, open(name, 'w') as dst:
+        dst.write(src.read())
+
+    wolfdoc.Wolfdoc(name)
+    cache = wolfdoc.Wolfdoc.cache_file(name)
+    assert(not os.path.exists(cache))
+
+    wd = wolfdoc.Wolfdoc(name, cache=True)
+    with open(cache, 'rb') as fp:
+        data = fp.read()
+
+    wd = wolfdoc.Wolfdoc(name, cache=True)
+    c = wd.get_element_by_cmd('GET', 'CB67')
+    assert(c['Device']['Boxname'] is wd.root['GET']['categories']['Device']['Boxname'])
+
+    # a changed file replaces the cache
+    wd.edit_section('GET', 'Device', 'rename', 'Box')
+    wd.dump_json()
+    wd = wolfdoc.Wolfdoc(name, cache=True)
+    assert(list(wd.get_element_by_cmd('GET', 'CB67')) == ['Box'])
+    with open(cache, 'rb') as fp:
+        assert(fp.read() != data)
+
+    assert(list(wolfdoc.Wolfdoc(name).get_element_by_cmd('GET', 'CB67')) == ['Box'])
+
+    # the key is checked before anything is unpickled: a stale cache is never loaded
+    with open(cache, 'wb') as fp:
+        fp.write(wolfdoc.Wolfdoc.cache_header.pack(0, 0, 0) + b'cnot_a_module\nfunc\n.')
+    assert(list(wolfdoc.Wolfdoc(name, cache=True).get_element_by_cmd('GET', 'CB67')) == ['Box'])
+
+
+def test_lazy(tmp_path):
+    name = str(tmp_path / 'wolfprot.json')
+    with open(TEST_DOC) as src, open(name, 'w') as dst:
+        dst.write(src.read())
+
+    eager = wolfdoc.Wolfdoc(name, cache=True)
+    wd = wolfdoc.Wolfdoc(name, cache=True, lazy=True)
+    categories = wd.root['GET']['categories']
+    assert(type(categories) is wolfdoc.LazyCategories)
+    assert(categories.loaded() == [])
+
+    assert(wd.get_element_by_cmd('GET', 'CB67') == eager.get_element_by_cmd('GET', 'CB67'))
+    assert(wd.generate_get_response({'type': 'GET', 'cmd': bytearray.fromhex('4E'), 'data': bytearray.fromhex('0305')},
+                                    1) == ('Audio', 'Volume', [{'Output': 3, 'Volume': 5}]))
+    assert(sorted(categories.loaded()) == ['Audio', 'Device'])
+    assert(wd.get_element_by_name('GET', None, 'Boxname') == eager.get_element_by_name('GET', None, 'Boxname'))
+    assert(sorted(categories.loaded()) == ['Audio', 'Device'])
+
+    wd.remove_element('GET', 'Device', 'Boxname')
+    assert(wd.get_element_by_cmd('GET', 'CB67') is None)
+    wd.edit_section('GET', 'Windows', 'rename', 'Window')
+    assert(list(wd.get_element_by_cmd('GET', 'CBBA')) == ['Window'])
+
+    assert(wd.get_elements('SET') == eager.get_elements('SET'))
+    wd.dump_json()
+    assert(wolfdoc.Wolfdoc(name).get_element_by_cmd('GET', 'CB67') is None)
+    with pytest.raises(ValueError):
+        wolfdoc.Wolfdoc(name, lazy=True)
+
+
+def test_param_list():
+    wd = read_test_doc()
+    window = wd.get_param_list(1)
+    assert(window['name'] == window['comment'] == 'Window type')
+    assert(wd.get_param_list('Window type') == window)
+    assert(wd.param_list[0]['comment'] == 'type of the window')
+    assert(wd.get_param_list(99) is None and wd.get_param_list('Unknown') is None)
+
+    wd.generate_template_parameter('Layout', 'a0', 1, 'screen layout')
+    wd.add_value_to_template_parameter('single', '0x00')
+    wd.add_template_parameter()
+    assert(wd.get_param_list('Layout')['values'][0]['comment'] == 'single')
+    try:
+        wd.generate_template_parameter('Volume', 'a0', 1)
+        wd.add_template_parameter()
+        assert(False)
+    except IndexError:
+        pass
+
+
+def test_iter_decode():
+    wd = read_test_doc()
+    decoder = wd.compile_reply('Content', 'Content Sources')
+    raw = bytearray.fromhex('02' + '0008' + '0001' + '02' + '6869' + '0a0b' + '0006' + '0002' + '02' + '6a6b')
+    received = list()
+
+    def chunks():
+        for i in range(len(raw)):
+            received.append(i)
+            yield raw[i:i + 1]
+
+    records = list()
+    for record in decoder.iter_decode(chunks(), len(raw)):
+        records.append((len(received), record))
+    assert([i[1] for i in records] == decoder.decode(raw)[2])
+    # the first block is complete before the reply
+    assert(records[1][0] < len(raw))
+
+
+def test_encode_batch():
+    wd = read_test_doc()
+    login = [p['comment'] for p in wd.root['SET']['categories']['System']['Login']['variations'][0]['request']['parameters']]
+    login = dict(zip(login, [2, 8, 'Password', 0, '']))
+    requests = [('GET', 'Device', 'Boxname', 0, None), ('SET', 'System', 'Login', 0, login),
+                ('GET', 'Audio', 'Volume', 1, {'Output': 3})]
+    packages = [wd.generate_get_request(section, name, variant, params, direction)
+                for direction, section, name, variant, params in requests]
+    buf, offsets = wd.encode_batch(requests)
+    assert(buf == b''.join(packages))
+    assert([buf[i:j] for i, j in zip(offsets, offsets[1:])] == packages)
+
+    buf = bytearray(4 + len(b''.join(packages)))
+    assert(wd.encode_batch(requests, buf, 4)[1][-1] == len(buf))
+    try:
+        wd.encode_batch(requests, buf, 5)
+        assert(False)
+    except ValueError:
+        pass
+
+
+def test_decode_array():
+    pytest.importorskip('numpy')
+    wd = read_test_doc()
+    wp = parser.Parser()
+    frames = [wp.generate_package('GET', '4E', bytes([i % 4, i])) for i in range(100)]
+    arr = wd.decode_array('Audio', 'Volume', b''.join(frames), 1)
+    assert(arr.dtype.names == ('Output', 'Volume'))
+    assert(arr['Volume'].tolist() == list(range(100)))
+    for row, frame in zip(arr, frames):
+        res = wd.generate_get_response({'type': 'GET', 'cmd': bytearray.fromhex('4E'), 'data': frame[3:]}, 1)
+        assert(res[2] == [{'Output': row['Output'], 'Volume': row['Volume']}])
+
+    error = wp.generate_package('GET', '4E', None, error='busy')
+    for args in ((b''.join(frames)[:-1], 1), (b''.join(frames), 0), (error, 1)):
+        try:
+            wd.decode_array('Audio', 'Volume', *args)
+            assert(False)
+        except ValueError:
+            pass
+    try:
+        wd.decode_array('Device', 'Boxname', b'')
+        assert(False)
+    except ValueError:
+        pass
+
+
+def test_generate_frame():
+    wd = read_test_doc()
+    frame = wd.generate_frame('Device', 'Model')
+    assert(frame == wd.generate_get_request('Device', 'Model') and type(frame) == bytes)
+    assert(wd.generate_frame('Device', 'Model') is frame)
+    assert(wd.generate_frame('Audio', 'Volume', 1, {'Output': 3}) == bytes.fromhex('004e0103'))
+    assert(wd.generate_frame('Audio', 'Volume', 1, {'Output': 3}) is wd.generate_frame('Audio', 'Volume', 1,
+                                                                                        {'Output': 3}))
+
+    # edits drop the memoised packages
+    wd.copy_element('GET', 'Device', 'Model', 'Device', 'Model2', 'FFFF')
+    assert(wd.generate_frame('Device', 'Model2').hex() == '08ffff00')
+    wd.remove_element('GET', 'Device', 'Model2')
+    wd.copy_element('GET', 'Device', 'Model', 'Device', 'Model2', 'FFFE')
+    assert(wd.generate_frame('Device', 'Model2').hex() == '08fffe00')
+    wd.remove_element('GET', 'Device', 'Model')
+    try:
+        wd.generate_frame('Device', 'Model')
+        assert(False)
+    except KeyError:
+        pass
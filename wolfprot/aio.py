@@ -0,0 +1,272 @@
+import asyncio
+import ipaddress
+
+from wolfprot import cache as wp_cache
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import parser
+from wolfprot import wolfdoc
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class AsyncSocket:
+    """
+    asyncio version of connection.Socket
+    """
+    ports = connection.Socket.ports
+    read_size = 0x10000
+    # connection.Socket raises device errors, connection.Websocket reports them
+    raise_device_error = True
+
+    def __init__(self, host: str = '', use_ssl: bool = True, timeout: float = 10, port: int = None):
+        self.host = host
+        self.ssl = use_ssl is True
+        if port is None:
+            port = self.ports['ssl'] if self.ssl else self.ports['no_ssl']
+        self.port = port
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.lock = None
+        self.decoder = parser.FrameDecoder()
+
+    async def _wait(self, aw):
+        try:
+            return await asyncio.wait_for(aw, self.timeout)
+        except asyncio.TimeoutError as err:
+            self.decoder.reset()
+            raise TimeoutError(err)
+
+    async def connect(self):
+        ip_addr = str(ipaddress.ip_address(self.host))
+        await self.disconnect()
+
+        context = connection.ssl_context() if self.ssl else None
+        self.reader, self.writer = await self._wait(asyncio.open_connection(
+            ip_addr, self.port, ssl=context, server_hostname=ip_addr if context else None))
+        self.lock = asyncio.Lock()
+        self.decoder.reset()
+
+    async def disconnect(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        self.reader = None
+        self.writer = None
+
+    def connected(self):
+        return self.writer is not None
+
+    def _abort(self):
+        # the reply stream is out of sync
+        self.decoder.reset()
+        if self.writer:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+
+    async def _send(self, packages):
+        self.writer.write(b''.join(packages))
+        await self._wait(self.writer.drain())
+
+    async def _recv(self):
+        return await self._wait(self.reader.read(self.read_size))
+
+    async def receive_frame(self):
+        frame = self.decoder.next_frame()
+        while frame is None:
+            data = await self._recv()
+            if len(data) == 0:
+                raise ConnectionError('connection closed')
+            self.decoder.feed(data)
+            frame = self.decoder.next_frame()
+        return frame
+
+    async def send_receive_many(self, packages):
+        """
+        pipeline: send all packages at once, return a list of dicts: type, cmd, header, data, error
+        """
+        if self.lock is None:
+            # created by connect, in the loop running the connection
+            raise ConnectionError('not connected')
+        async with self.lock:
+            if not self.connected():
+                raise ConnectionError('not connected')
+            try:
+                await self._send(packages)
+                wp = parser.Parser()
+                offsets = list()
+                for i in range(len(packages)):
+                    offsets.append(len(wp.buffer))
+                    wp.buffer.extend((await self.receive_frame()).package)
+            except BaseException:
+                self._abort()
+                raise
+            return [wp.get_package(offset) for offset in offsets]
+
+    async def send_receive(self, data):
+        res = (await self.send_receive_many([data]))[0]
+        if res['error']:
+            raise connection.DeviceError(res['error'])
+        return res['data']
+
+
+class AsyncWebsocket(AsyncSocket):
+    """
+    asyncio version of connection.Websocket, needs the websockets package
+    """
+    raise_device_error = False
+
+    def __init__(self, uri=None, timeout: float = 10):
+        if not connection.Websocket.is_websocket_url(uri):
+            raise ValueError('not a websocket url')
+        self.ws = None
+        super().__init__(uri, True, timeout)
+
+    async def connect(self):
+        if websockets is None:
+            raise ImportError('websockets package needed for websocket connections')
+        await self.disconnect()
+
+        context = connection.ssl_context() if self.host.startswith('wss') else None
+        self.ws = await self._wait(websockets.connect(self.host, ssl=context))
+        self.lock = asyncio.Lock()
+        self.decoder.reset()
+
+    async def disconnect(self):
+        if self.ws:
+            await self.ws.close()
+        self.ws = None
+
+    def connected(self):
+        return self.ws is not None
+
+    def _abort(self):
+        self.decoder.reset()
+        if self.ws:
+            asyncio.ensure_future(self.ws.close())
+        self.ws = None
+
+    async def _send(self, packages):
+        for i in packages:
+            await self._wait(self.ws.send(bytes(i)))
+
+    async def _recv(self):
+        try:
+            data = await self._wait(self.ws.recv())
+        except websockets.ConnectionClosed:
+            return b''
+        if type(data) == str:
+            data = bytes.fromhex(data)
+        return data
+
+
+class AsyncCynap:
+    """
+    asyncio version of cynap.Cynap
+
+    one Wolfdoc can be shared between many sessions with the doc argument
+    """
+
+    def __init__(self, host: str, use_ssl: bool = True, doc_file: str = None, pw: str = 'Password',
+                 access_level: str = 'Admin', pin: str = '', doc: wolfdoc.Wolfdoc = None, timeout: float = 10,
+                 port: int = None, single_flight: wp_cache.AsyncSingleFlight = None):
+        if doc is None and doc_file:
+            doc = wolfdoc.Wolfdoc(doc_file)
+
+        self.doc = doc
+        self.host = host
+        self.ssl = use_ssl
+        self.pw = pw
+        self.access_level = access_level
+        self.pin = pin
+        self.timeout = timeout
+        self.port = port
+        self.connection = None
+        # see cynap.Cynap.single_flight
+        self.single_flight = single_flight
+
+    async def __aenter__(self):
+        if await self.connect() is False:
+            raise ConnectionError(f'No connection to Host {self.host}')
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def connect(self):
+        if connection.Websocket.is_websocket_url(self.host):
+            self.connection = AsyncWebsocket(self.host, self.timeout)
+        else:
+            self.connection = AsyncSocket(self.host, self.ssl, self.timeout, self.port)
+        try:
+            await self.connection.connect()
+            await self.login(self.access_level, self.pw, self.pin)
+
+        except (ConnectionRefusedError, TimeoutError):
+            await self.connection.disconnect()
+            return False
+        return True
+
+    async def disconnect(self):
+        if self.connection:
+            await self.connection.disconnect()
+
+    async def send_package(self, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET',
+                           return_raw: bool = True) -> dict:
+        if self.connection is None:
+            return
+
+        data = self.doc.generate_frame(section, name, variant, param, direction)
+        if self.single_flight is not None and direction == 'GET':
+            # see cynap.Cynap.send_package
+            reply = await self.single_flight.do((self.host, bytes(data)), lambda: self.raw_package(data))
+        else:
+            reply = await self.raw_package(data)
+        if return_raw:
+            return reply
+
+        return self.doc.generate_get_response(reply, variant)
+
+    async def send_packages(self, requests: list, return_raw: bool = True) -> list:
+        """
+        see cynap.Cynap.send_packages
+        """
+        if self.connection is None:
+            return
+
+        requests = [cynap.Cynap._request(*req) for req in requests]
+        replies = await self.raw_packages([self.doc.generate_get_request(*req) for req in requests])
+        if return_raw:
+            return replies
+
+        return [reply if reply['error'] else self.doc.generate_get_response(reply, req[2])
+                for req, reply in zip(requests, replies)]
+
+    async def raw_packages(self, packages: list) -> list:
+        if self.connection is None:
+            return
+
+        return await self.connection.send_receive_many(packages)
+
+    async def raw_package(self, data: bytearray) -> dict:
+        if self.connection is None:
+            return
+
+        res = (await self.connection.send_receive_many([data]))[0]
+        if res['error'] and self.connection.raise_device_error:
+            raise connection.DeviceError(res['error'])
+        return res
+
+    async def login(self, access_level: str = 'Admin', password: str = 'Password', admin_pin: str = ''):
+        """
+        access_level = 'None', 'User', 'Admin', 'Annotation', 'Viewer App'
+        """
+        await self.send_package('System', 'Login', 0, cynap.login_param(access_level, password, admin_pin), 'SET')
@@ -0,0 +1,146 @@
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import threading
+import time
+
+from wolfprot import metrics
+
+
+class ResponseCache:
+    """
+    replies of GET requests for ttl seconds, least recently used replies are dropped beyond max_size
+
+    key: (host, direction, cmd, request package), the package holds the parameters
+    ttls: dict cmd (hex) -> seconds overriding ttl, 0 disables caching of the command
+    a successful SET of a command drops its cached replies (see Cynap.raw_package)
+    """
+
+    def __init__(self, max_size: int = 256, ttl: float = 1.0, ttls: dict = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.ttls = {cmd.upper(): seconds for cmd, seconds in (ttls or dict()).items()}
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()  # key -> (expires, reply)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def key(host: str, direction: str, cmd: str, package):
+        return host, direction, cmd.upper(), bytes(package)
+
+    def get(self, key):
+        """
+        return a copy of the cached reply dict or None
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+        if metrics.active is not None:
+            metrics.active.inc('cache_misses' if entry is None else 'cache_hits', labels=(('cmd', key[2]),))
+        if entry is None:
+            return None
+        return dict(entry[1], data=bytearray(entry[1]['data']))
+
+    def put(self, key, reply: dict):
+        ttl = self.ttls.get(key[2], self.ttl)
+        if ttl <= 0 or reply['error']:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, dict(reply, data=bytearray(reply['data'])))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, host: str = None, cmd: str = None):
+        """
+        drop the replies of a host and command, None matches all
+        """
+        cmd = cmd.upper() if cmd else None
+        with self._lock:
+            for key in [i for i in self._entries if (host is None or i[0] == host) and (cmd is None or i[2] == cmd)]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self._entries)}
+
+
+class SingleFlight:
+    """
+    concurrent calls (threads) with the same key share one call of func,
+    the callers waiting for it get a copy of its result
+
+    shared counts the calls answered by the call of another caller
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = dict()  # key -> concurrent.futures.Future
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = concurrent.futures.Future()
+                call.set_running_or_notify_cancel()
+            else:
+                self.shared += 1
+
+        if not leader:
+            return copy.deepcopy(call.result())
+
+        try:
+            res = func()
+        except BaseException as err:
+            call.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+        call.set_result(res)
+        return res
+
+
+class AsyncSingleFlight:
+    """
+    asyncio version of SingleFlight, func is a coroutine function
+
+    the shared call runs in its own task, a cancelled caller does not cancel it for the others
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = dict()  # key -> asyncio.Task
+
+    async def do(self, key, func):
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = self._calls[key] = asyncio.ensure_future(func())
+            call.add_done_callback(lambda task: self._done(key, task))
+        else:
+            self.shared += 1
+
+        res = await asyncio.shield(call)
+        return res if leader else copy.deepcopy(res)
+
+    def _done(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved, also without waiters
@@ -0,0 +1,577 @@
+import struct
+import time
+
+from wolfprot import metrics
+from wolfprot import parser as wp_parser
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+int_formats = {1: 'B', 2: 'H', 4: 'I'}
+int_structs = {length: struct.Struct('>' + fmt) for length, fmt in int_formats.items()}
+
+# reply decoder operations
+RUN, INT, LENSTR, OPT, REST = range(5)
+
+
+def pack_int(value: int, length: int) -> bytes:
+    try:
+        return int_structs[length].pack(value)
+    except struct.error as err:
+        raise ValueError(f'{value} does not fit into {length} byte: {err}')
+
+
+class RequestEncoder:
+    """
+    request package of one command variation, compiled once
+
+    fields: list of (comment, length) with parameterID references resolved
+    """
+    # packages memoised by frame, dropped with the encoder when the document is edited
+    frame_cache_size = 64
+
+    def __init__(self, direction: str, cmd: str, param_len_len: int, fields: list):
+        self.direction = direction
+        self.cmd = cmd
+        self.fields = fields
+        self.comments = [comment for comment, length in fields]
+
+        ext_hdr = 1 if param_len_len == 4 else None
+        ext_len = 1 if param_len_len == 2 else None
+        hdr = wp_parser.Parser().generate_package(direction, cmd, b'', ext_hdr, ext_len)
+        self.len_len = param_len_len if param_len_len in int_structs else 1
+        self.prefix = bytes(hdr[:-self.len_len])
+        self.header_len = len(hdr)
+        self.max_len = (1 << (8 * self.len_len)) - 1
+        self._len_struct = int_structs[self.len_len]
+        self._frames = dict()  # parameter values -> package
+
+        # all fields are numbers: the package has a fixed size
+        if all(length in int_formats for comment, length in fields):
+            self.body = struct.Struct('>' + ''.join(int_formats[length] for comment, length in fields))
+            self.size = self.header_len + self.body.size
+            self.head = self.prefix + self._len_struct.pack(self.body.size)
+            self.template = bytearray(self.size)
+            self.template[:self.header_len] = self.head
+        else:
+            self.body = None
+            self.size = None
+            self.head = None
+            self.template = None
+
+    def _values(self, params):
+        if len(self.comments) == 0:
+            return ()
+        return [params[comment] for comment in self.comments]
+
+    def _chunks(self, values):
+        chunks = list()
+        for (comment, length), value in zip(self.fields, values):
+            if type(value) == int:
+                if length in int_structs:
+                    chunks.append(pack_int(value, length))
+                elif length == 0:
+                    chunks.append(str(value).encode('utf-8'))
+            elif type(value) == str:
+                chunks.append(value.encode('utf-8'))
+            elif type(value) == bytes:
+                chunks.append(value)
+        return chunks
+
+    def _fixed(self, values):
+        return self.body is not None and all(type(value) == int for value in values)
+
+    def package_size(self, params=None) -> int:
+        values = self._values(params)
+        if self._fixed(values):
+            return self.size
+        return self.header_len + sum(len(i) for i in self._chunks(values))
+
+    def _write(self, buf, offset, chunks):
+        data_len = sum(len(i) for i in chunks)
+        if data_len > self.max_len:
+            raise ValueError('data to long')
+        size = self.header_len + data_len
+        if len(buf) < offset + size:
+            raise ValueError('buffer to small')
+
+        pos = offset + len(self.prefix)
+        buf[offset:pos] = self.prefix
+        self._len_struct.pack_into(buf, pos, data_len)
+        pos = offset + self.header_len
+        for i in chunks:
+            buf[pos:pos + len(i)] = i
+            pos += len(i)
+        return size
+
+    def _pack(self, buf, offset, values):
+        if len(buf) < offset + self.size:
+            raise ValueError('buffer to small')
+        buf[offset:offset + self.header_len] = self.head
+        try:
+            self.body.pack_into(buf, offset + self.header_len, *values)
+        except struct.error as err:
+            raise ValueError(err)
+        return self.size
+
+    def encode_into(self, buf, offset: int = 0, params=None) -> int:
+        """
+        write the package to buf[offset:], return the package length
+        """
+        values = self._values(params)
+        if not self._fixed(values):
+            return self._write(buf, offset, self._chunks(values))
+        return self._pack(buf, offset, values)
+
+    def encode(self, params=None) -> bytearray:
+        m = metrics.active
+        if m is None:
+            return self._encode(params)
+        start = time.perf_counter()
+        buf = self._encode(params)
+        m.latency('encode', self.cmd, time.perf_counter() - start)
+        return buf
+
+    def frame(self, params=None) -> bytes:
+        """
+        return the package as bytes, memoised per parameter values (numbers, strings and bytes)
+        """
+        values = tuple(self._values(params))
+        if any(type(value) not in (int, str, bytes) for value in values):
+            return bytes(self.encode(params))
+
+        frame = self._frames.get(values)
+        if frame is None:
+            if len(self._frames) >= self.frame_cache_size:
+                self._frames.clear()
+            frame = self._frames[values] = bytes(self.encode(params))
+        return frame
+
+    def _encode(self, params):
+        values = self._values(params)
+        if not self._fixed(values):
+            chunks = self._chunks(values)
+            buf = bytearray(self.header_len + sum(len(i) for i in chunks))
+            self._write(buf, 0, chunks)
+            return buf
+
+        buf = bytearray(self.template)
+        try:
+            self.body.pack_into(buf, self.header_len, *values)
+        except struct.error as err:
+            raise ValueError(err)
+        return buf
+
+
+def encode_batch(items, buf=None, offset: int = 0):
+    """
+    write the packages of (RequestEncoder, params) back-to-back into buf[offset:],
+    without buf into a new bytearray of the exact size
+
+    return buf, offsets: package i is buf[offsets[i]:offsets[i + 1]]
+    """
+    prepared = list()
+    size = 0
+    for encoder, params in items:
+        values = encoder._values(params)
+        if encoder._fixed(values):
+            prepared.append((encoder, values, None))
+            size += encoder.size
+        else:
+            chunks = encoder._chunks(values)
+            prepared.append((encoder, None, chunks))
+            size += encoder.header_len + sum(len(i) for i in chunks)
+
+    if buf is None:
+        buf = bytearray(offset + size)
+    elif len(buf) < offset + size:
+        raise ValueError('buffer to small')
+
+    offsets = [offset]
+    for encoder, values, chunks in prepared:
+        if chunks is None:
+            offset += encoder._pack(buf, offset, values)
+        else:
+            offset += encoder._write(buf, offset, chunks)
+        offsets.append(offset)
+    return buf, offsets
+
+
+class ReplyDecoder:
+    """
+    reply package of one command variation, compiled once
+
+    mirrors the walk over the reply parameters of Wolfdoc.generate_get_response:
+    the common parameters are read once, the remaining parameters repeat
+    until the package is consumed
+    """
+    # cmd: (common parameters, block length parameter, optional parameter)
+    special_commands = {'CBBA': (('Window reference width', 'Window reference height'), None, None),  # Window 2
+                        'CB90': (('Number of sources'), ('Source block length'), ('Type specific source block')),
+                        }
+
+    # iter_decode drops decoded bytes once they are more than this
+    compact_size = 0x10000
+
+    def __init__(self, category: str, sub: str, cmd: str, param: list, resolve=None):
+        self.category = category
+        self.sub = sub
+        self.cmd = cmd
+        self.empty = len(param) == 0
+
+        common, blk_len_check, optional_param = self.special_commands.get(cmd, ((), None, None))
+        rm_param = [i for i in param if i['comment'] in common] if common else list()
+        self.common = [(i['comment'], i['length']) for i in rm_param if i['length']]
+
+        ops = list()
+        prev = None
+        for i in param:
+            if i in rm_param:
+                continue
+            raw_comment = i.get('comment')
+            param_id = i.get('parameterID', None)
+            if param_id and resolve:
+                i = resolve(param_id)
+            length = i['length']
+            comment = i['comment']
+            if raw_comment is None:
+                raw_comment = comment
+            if length:
+                reset = bool(blk_len_check and comment in blk_len_check)
+                ops.append((INT, comment, length, reset, raw_comment))
+            elif prev and prev['comment'].find(comment) != -1:
+                ops.append((LENSTR, comment, 0, False, raw_comment))
+            elif optional_param and optional_param == comment:
+                ops.append((OPT, comment, 0, False, raw_comment))
+            else:
+                ops.append((REST, comment, 0, False, raw_comment))
+            prev = i
+        self.blk_len_check = blk_len_check
+        self.ops = self._group(ops)
+
+    @staticmethod
+    def _group(ops):
+        """
+        merge consecutive numbers of 1, 2 or 4 byte into one struct
+        op: kind, comment(s), length, reset, raw comment, struct, single numbers
+        """
+        grouped = list()
+        run = list()
+
+        def flush():
+            if len(run):
+                layout = struct.Struct('>' + ''.join(int_formats[i[2]] for i in run))
+                reset_tail = None
+                for idx, i in enumerate(run):
+                    if i[3]:
+                        reset_tail = sum(j[2] for j in run[idx:])
+                grouped.append((RUN, tuple(i[1] for i in run), layout.size, reset_tail, run[0][4], layout,
+                                tuple(run)))
+            run.clear()
+
+        for i in ops:
+            if i[0] == INT and i[2] in int_formats:
+                run.append(i)
+            else:
+                flush()
+                grouped.append(i + (None, None))
+        flush()
+        return grouped
+
+    def decode_common(self, mv):
+        data_common = dict()
+        start = 0
+        prev_val = None
+        for comment, length in self.common:
+            if start >= len(mv):
+                raise ValueError(f'reply to short for {comment}')
+            end = start + length
+            data_common[comment] = prev_val = int.from_bytes(mv[start:end], 'big')
+            start = end
+        return data_common, start, prev_val
+
+    def decode_block(self, raw, mv, start, size, prev_val):
+        """
+        decode one repeating block at raw[start:]
+
+        size is the length of the whole reply data relative to raw
+        return data, end, prev_val
+        """
+        data = dict()
+        blk_len = 0
+        first = True
+        end = start
+        for kind, comment, length, reset, raw_comment, layout, run in self.ops:
+            if start >= size:
+                # add string value when previous value was the length value with data value zero
+                if not first and prev_val == 0:
+                    data[raw_comment] = bytearray()
+                break
+
+            if kind == RUN:
+                end = start + length
+                if end > size:
+                    # the package ends inside of the run
+                    end, prev_val, blk_len, stop = self._decode_partial(mv, start, size, prev_val, run,
+                                                                        data, blk_len, first)
+                    if stop:
+                        break
+                else:
+                    values = layout.unpack_from(raw, start)
+                    data.update(zip(comment, values))
+                    prev_val = values[-1]
+                    blk_len = blk_len + length if reset is None else reset
+            elif kind == LENSTR:
+                # prev_val = string length
+                end = start + prev_val
+                data[comment] = raw[start:end]
+                blk_len += end - start
+            elif kind == INT:
+                end = start + length
+                data[comment] = prev_val = int.from_bytes(mv[start:min(end, size)], 'big')
+                if reset:
+                    blk_len = 0
+                blk_len += end - start
+            elif kind == OPT:
+                end += (data[self.blk_len_check] - blk_len + 1)
+                data[comment] = raw[start:end]
+                blk_len += end - start
+            else:
+                data[comment] = raw
+                end = size
+                blk_len += end - start
+            first = False
+            start = end
+        return data, end, prev_val
+
+    @staticmethod
+    def _decode_partial(mv, start, size, prev_val, ops, data, blk_len, first):
+        end = start
+        for op in ops:
+            if start >= size:
+                if not first and prev_val == 0:
+                    data[op[4]] = bytearray()
+                return end, prev_val, blk_len, True
+            end = start + op[2]
+            prev_val = int.from_bytes(mv[start:min(end, size)], 'big')
+            data[op[1]] = prev_val
+            if op[3]:
+                blk_len = 0
+            blk_len += end - start
+            first = False
+            start = end
+        return end, prev_val, blk_len, False
+
+    def decode(self, raw):
+        """
+        return category, sub, list of parameter dicts
+        """
+        m = metrics.active
+        if m is None:
+            return self._decode(raw)
+        start = time.perf_counter()
+        res = self._decode(raw)
+        m.latency('decode', self.cmd, time.perf_counter() - start)
+        return res
+
+    def _decode(self, raw):
+        pkg = list()
+        if self.empty:
+            return self.category, self.sub, pkg
+
+        mv = memoryview(raw)
+        size = len(raw)
+        data_common, end, prev_val = self.decode_common(mv)
+        if len(data_common):
+            pkg.append(data_common)
+
+        # I expect it is a repeating block when the raw package
+        # size is not finish after first iteration over the parameters
+        while end < size:
+            start = end
+            data, end, prev_val = self.decode_block(raw, mv, start, size, prev_val)
+            pkg.append(data)
+            if end <= start:
+                break
+        return self.category, self.sub, pkg
+
+    def dtype(self):
+        """
+        numpy structured dtype (big-endian numbers) of a reply with a fixed layout
+        """
+        if np is None:
+            raise ImportError('numpy package needed for array decoding')
+
+        fields = list(self.common)
+        for op in self.ops:
+            if op[0] == RUN:
+                fields.extend((i[1], i[2]) for i in op[6])
+            elif op[0] == INT:
+                fields.append((op[1], op[2]))
+            else:
+                raise ValueError(f'{self.category} {self.sub}: reply has no fixed layout')
+        if len(fields) == 0 or any(length not in (1, 2, 4, 8) for comment, length in fields):
+            raise ValueError(f'{self.category} {self.sub}: reply has no fixed layout')
+        return np.dtype([(comment, f'>u{length}') for comment, length in fields])
+
+    def decode_array(self, buf):
+        """
+        decode concatenated reply packages of this command in one go
+
+        return a numpy structured array (one row per package, one column per parameter)
+        as view on buf
+        """
+        record = self.dtype()
+        if len(buf) == 0:
+            return np.zeros(0, record)
+
+        hdr = wp_parser.header_info(buf)
+        if hdr is None:
+            raise ValueError('package incomplete')
+        cmd_type, cmd, data_start, data_end, error = hdr
+        if error:
+            raise ValueError('error package')
+        if int(bytes(cmd).hex(), 16) != int(self.cmd, 16):
+            raise ValueError(f'package of command {bytes(cmd).hex()} not {self.cmd}')
+        if data_end - data_start != record.itemsize:
+            raise ValueError(f'package data length {data_end - data_start} not {record.itemsize}')
+        if len(buf) % data_end:
+            raise ValueError('buffer is no multiple of the package length')
+
+        headers = np.frombuffer(buf, np.uint8).reshape(-1, data_end)[:, :data_start]
+        if not (headers == headers[0]).all():
+            raise ValueError('packages differ in header')
+
+        frame = np.dtype({'names': record.names, 'formats': [record.fields[i][0] for i in record.names],
+                          'offsets': [data_start + record.fields[i][1] for i in record.names],
+                          'itemsize': data_end})
+        return np.frombuffer(buf, frame)
+
+    def iter_decode(self, chunks, size: int):
+        """
+        decode a reply arriving in pieces: chunks is an iterable of bytes, size the length of the whole reply data
+
+        yield the parameter dicts of decode one by one, the common parameters and every repeating block
+        as soon as the bytes behind it are received, consumed bytes are dropped
+        """
+        if self.empty or any(op[0] == REST for op in self.ops):
+            # nothing to decode or the last parameter takes the rest of the reply
+            raw = bytearray()
+            for chunk in chunks:
+                raw.extend(chunk)
+            yield from self.decode(raw)[2]
+            return
+
+        common_len = sum(length for comment, length in self.common)
+        common = len(self.common) == 0
+        buf = bytearray()
+        pos = 0
+        received = 0
+        prev_val = None
+        final = size == 0
+        chunks = iter(chunks)
+        while True:
+            if not common and (len(buf) >= common_len or final):
+                with memoryview(buf) as mv:
+                    data_common, pos, prev_val = self.decode_common(mv)
+                common = True
+                if len(data_common):
+                    yield data_common
+
+            while common and pos < len(buf):
+                # a block is complete when it ends before the received bytes
+                with memoryview(buf) as mv:
+                    data, end, val = self.decode_block(buf, mv, pos, len(buf), prev_val)
+                if end >= len(buf) and not final:
+                    break
+                prev_val = val
+                yield data
+                if end <= pos:
+                    return
+                pos = end
+
+            if final:
+                return
+
+            if pos > self.compact_size and pos * 2 > len(buf):
+                del buf[:pos]
+                pos = 0
+
+            chunk = next(chunks, None)
+            if chunk is None:
+                # reply ends early
+                final = True
+            else:
+                buf.extend(chunk)
+                received += len(chunk)
+                final = received >= size
+
+
+class DocumentCodec:
+    """
+    compiled request encoders and reply decoders of a wolfprot document, cached per command variation
+
+    the document provides _encoders and _decoders dicts, get_param_list and
+    _variation_of(section, name, variant, direction) returning (command, variation)
+    """
+
+    def _resolve_parameters(self, param: list) -> list:
+        fields = list()
+        for i in param:
+            param_id = i.get('parameterID', None)
+            if param_id:
+                i = self.get_param_list(param_id)
+            fields.append((i['comment'], i['length']))
+        return fields
+
+    def compile_request(self, section: str, name: str, variant: int = 0, direction: str = 'GET'):
+        """
+        return the cached request encoder of the command variation
+        """
+        key = (direction, section, name, variant)
+        encoder = self._encoders.get(key)
+        if encoder is None:
+            cmd, var = self._variation_of(section, name, variant, direction)
+            req = var['request']
+            encoder = RequestEncoder(direction, cmd, req['parameterLengthLength'],
+                                     self._resolve_parameters(req['parameters']))
+            self._encoders[key] = encoder
+        return encoder
+
+    def generate_get_request(self, section: str, name: str, variant: int = 0, req_param=None, direction: str = 'GET'):
+        return self.compile_request(section, name, variant, direction).encode(req_param)
+
+    def generate_frame(self, section: str, name: str, variant: int = 0, req_param=None, direction: str = 'GET'):
+        """
+        like generate_get_request, the package is memoised as bytes (see RequestEncoder.frame)
+        """
+        return self.compile_request(section, name, variant, direction).frame(req_param)
+
+    def encode_batch(self, requests, buf=None, offset: int = 0):
+        """
+        requests: iterable of (direction, section, name, variant, params)
+        see encode_batch
+        """
+        return encode_batch(((self.compile_request(section, name, variant, direction), params)
+                             for direction, section, name, variant, params in requests), buf, offset)
+
+    def decode_array(self, section: str, name: str, buf, variant: int = 0, direction: str = 'GET'):
+        """
+        decode concatenated replies of one command with a fixed layout into a numpy structured array
+        see ReplyDecoder.decode_array
+        """
+        return self.compile_reply(section, name, variant, direction).decode_array(buf)
+
+    def compile_reply(self, section: str, name: str, variant: int = 0, direction: str = 'GET'):
+        """
+        return the cached reply decoder of the command variation
+        """
+        key = (direction, section, name, variant)
+        decoder = self._decoders.get(key)
+        if decoder is None:
+            cmd, var = self._variation_of(section, name, variant, direction)
+            decoder = ReplyDecoder(section, name, cmd, var['reply']['parameters'], self.get_param_list)
+            self._decoders[key] = decoder
+        return decoder
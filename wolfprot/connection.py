@@ -1,66 +1,275 @@
+import functools
+import logging
+import select
 import socket
 import ssl
 import ipaddress
+import threading
+import time
 import websocket
 
 from urllib.parse import urlparse
+from wolfprot import metrics
 from wolfprot import parser
 
+log = logging.getLogger(__name__)
+
+
+class DeviceError(ConnectionError):
+    """
+    the device answered with an error package (see parser.Parser.error_dict)
+    """
+
+
+def locked(method):
+    """
+    serialise the wire access of a connection between threads
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+def ssl_context():
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.VerifyFlags.VERIFY_DEFAULT
+    return context
+
 
 class Socket(parser.Parser):
     ports = {'ssl': 50917, 'no_ssl': 50915, }
+    # error replies of send_receive raise DeviceError, Websocket reports them in the reply
+    raise_device_error = True
 
-    def __init__(self, host: str = '', use_ssl: bool = True):
+    def __init__(self, host: str = '', use_ssl: bool = True, port: int = None):
         self.host = host
         self.sock = None
         self.ssock = None
-        self.port = self.ports['ssl'] if use_ssl is True else self.ports['no_ssl']
+        self.use_ssl = use_ssl is True
+        if port is None:
+            port = self.ports['ssl'] if self.use_ssl else self.ports['no_ssl']
+        self.port = port
+        self.decoder = parser.FrameDecoder()
+        self.lock = threading.RLock()
+        self._sent_at = None  # time of the last send, with metrics enabled
         super().__init__()
 
     def __del__(self):
-        self.disconnect()
+        self._close()
 
-    def disconnect(self):
-        print('disconnect')
+    def _close(self):
         if self.sock:
             self.sock.close()
 
         if self.ssock:
             self.ssock.close()
 
+    def disconnect(self):
+        if self.sock:
+            log.debug('%s:%s disconnect', self.host, self.port)
+        self._close()
+
+    def is_alive(self):
+        """
+        health check of an idle connection: readable without a request means closed by peer or out of sync
+        """
+        sock = self.ssock if self.use_ssl else self.sock
+        if sock is None or len(self.decoder):
+            return False
+        try:
+            if sock.fileno() < 0:
+                return False
+            readable, _, _ = select.select([sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return len(readable) == 0
+
     def connect(self):
         ip_addr = str(ipaddress.ip_address(self.host))
         self.disconnect()
+        self.decoder.reset()
 
         try:
             self.sock = socket.create_connection(
                 (ip_addr, self.port), timeout=10)
 
-            if self.port == self.ports['ssl']:
-                context = ssl.create_default_context()
-                context.check_hostname = False
-                context.verify_mode = ssl.VerifyFlags.VERIFY_DEFAULT
+            if self.use_ssl:
+                context = ssl_context()
                 self.ssock = context.wrap_socket(
                     self.sock, server_hostname=ip_addr)
                 self.ssock.settimeout(10)
-            print('connected')
+            log.debug('%s:%s connected', ip_addr, self.port)
         except socket.timeout as err:
             raise TimeoutError(err)
 
+    def receive_frame(self, sock):
+        """
+        return the next package as parser.Frame
+        """
+        frame = self.decoder.next_frame()
+        recv_calls = 0
+        while frame is None:
+            if self.decoder.recv_into(sock) == 0:
+                raise ConnectionError('connection closed')
+            recv_calls += 1
+            frame = self.decoder.next_frame()
+        if metrics.active is not None or parser.trace_log.isEnabledFor(parser.TRACE):
+            self._received(frame, recv_calls)
+        return frame
+
+    def _sent(self, *data):
+        # metrics and trace of sent packages
+        if parser.trace_log.isEnabledFor(parser.TRACE):
+            for i in data:
+                parser.trace_log.log(parser.TRACE, '%s:%s tx %s', self.host, self.port, bytes(i).hex())
+        m = metrics.active
+        if m is not None:
+            self._sent_at = time.perf_counter()
+            m.sent(sum(len(i) for i in data))
+
+    def _received(self, frame, recv_calls):
+        if parser.trace_log.isEnabledFor(parser.TRACE):
+            parser.trace_log.log(parser.TRACE, '%s:%s rx %s', self.host, self.port, bytes(frame.package).hex())
+        m = metrics.active
+        if m is not None:
+            m.frame(frame, recv_calls, None if self._sent_at is None else time.perf_counter() - self._sent_at)
+
+    @locked
     def send_receive(self, data):
         try:
-            sock = self.ssock if self.port == self.ports['ssl'] else self.sock
+            sock = self.ssock if self.use_ssl else self.sock
             self.reset_buffers()
-            sock.send(bytes(data))
-            ret = sock.recv(2048)
-            self.append_buffer(ret)
-            while not self.package_complete() and len(ret) != 0:
-                ret = sock.recv(2048)
-                self.append_buffer(ret)
+            sock.sendall(data)
+            self._sent(data)
+            self.append_buffer(self.receive_frame(sock).package)
             if self.get_error():
-                raise ConnectionError(self.get_error())
+                raise DeviceError(self.get_error())
             return self.get_data()
         except socket.timeout as err:
+            self.decoder.reset()
+            raise TimeoutError(err)
+
+    @locked
+    def send_receive_stream(self, header, data):
+        """
+        like send_receive, header and data (e.g. a memoryview into a mmap'd file) are sent without joining them
+        """
+        try:
+            sock = self.ssock if self.use_ssl else self.sock
+            self.reset_buffers()
+            sock.sendall(header)
+            sock.sendall(data)
+            self._sent(header, data)
+            self.append_buffer(self.receive_frame(sock).package)
+            if self.get_error():
+                raise DeviceError(self.get_error())
+            return self.get_data()
+        except socket.timeout as err:
+            self.decoder.reset()
+            raise TimeoutError(err)
+
+    def _socket(self):
+        return self.ssock if self.use_ssl else self.sock
+
+    def _send(self, sock, data):
+        sock.sendall(data)
+        self._sent(data)
+
+    def _fill(self, sock):
+        return self.decoder.recv_into(sock)
+
+    def _drain(self, sock):
+        # skip the rest of a package opened with decoder.open_package
+        while self.decoder.data_pending:
+            if len(self.decoder.read_data()) == 0 and self._fill(sock) == 0:
+                raise ConnectionError('connection closed')
+
+    def send_receive_chunks(self, data):
+        """
+        send a request and return cmd_type, cmd, data length and a generator of the reply data
+        as it is received, the generator has to be finished before the next request
+        (hold self.lock until then when the connection is shared)
+        """
+        try:
+            sock = self._socket()
+            self._drain(sock)
+            self._send(sock, data)
+            header = self.decoder.open_package()
+            while header is None:
+                if self._fill(sock) == 0:
+                    raise ConnectionError('connection closed')
+                header = self.decoder.open_package()
+
+            cmd_type, cmd, error, size = header
+            if error:
+                error = b''
+                while len(error) < size:
+                    chunk = self.decoder.read_data()
+                    if len(chunk) == 0 and self._fill(sock) == 0:
+                        raise ConnectionError('connection closed')
+                    error += chunk
+                raise DeviceError(self.error_dict.get(error.hex().upper(), 'unknown'))
+        except socket.timeout as err:
+            self.decoder.reset()
+            raise TimeoutError(err)
+
+        def chunks():
+            try:
+                while self.decoder.data_pending:
+                    chunk = self.decoder.read_data()
+                    if len(chunk):
+                        yield chunk
+                    elif self._fill(sock) == 0:
+                        raise ConnectionError('connection closed')
+            except socket.timeout as err:
+                self.decoder.reset()
+                raise TimeoutError(err)
+            finally:
+                # a closed generator reads the rest, the following replies stay in order
+                self._drain(sock)
+
+        return cmd_type, cmd, size, chunks()
+
+    def _receive_packages(self, count, sock):
+        self.reset_buffers()
+        offsets = list()
+        for i in range(count):
+            offsets.append(len(self.buffer))
+            self.buffer.extend(self.receive_frame(sock).package)
+        return [self.get_package(offset) for offset in offsets]
+
+    @locked
+    def send_receive_many(self, packages):
+        """
+        pipeline: send all packages with one sendall and split the replies in order
+
+        return a list of dicts: type, cmd, header, data, error
+        """
+        try:
+            sock = self.ssock if self.use_ssl else self.sock
+            data = b''.join(packages)
+            sock.sendall(data)
+            self._sent(data)
+            return self._receive_packages(len(packages), sock)
+        except socket.timeout as err:
+            self.decoder.reset()
+            raise TimeoutError(err)
+
+    @locked
+    def send_receive_batch(self, buf, offsets):
+        """
+        pipeline the packages of a batch buffer (see codec.encode_batch) with one sendall
+        """
+        try:
+            sock = self.ssock if self.use_ssl else self.sock
+            sock.sendall(memoryview(buf)[offsets[0]:offsets[-1]])
+            self._sent(memoryview(buf)[offsets[0]:offsets[-1]])
+            return self._receive_packages(len(offsets) - 1, sock)
+        except socket.timeout as err:
+            self.decoder.reset()
             raise TimeoutError(err)
 
     def send_package_ext_len(self, cmd_type='get', cmd=None, data=None):
@@ -78,6 +287,8 @@ class Socket(parser.Parser):
 
 class Websocket(Socket):
     # TODO we need a ping pong for websocket
+    raise_device_error = False
+
     def __init__(self, uri=None):
         super().__init__(uri, True)
         u = urlparse(uri)
@@ -96,18 +307,81 @@ class Websocket(Socket):
         self.sock = websocket.WebSocket(
             sslopt={'check_hostname': False, 'cert_reqs': ssl.VerifyFlags.VERIFY_DEFAULT})
         self.sock.connect(self.host)
-        print('connected')
+        self.decoder.reset()
+        log.debug('%s connected', self.host)
+
+    def is_alive(self):
+        if self.sock is None or not self.sock.connected or len(self.decoder):
+            return False
+        try:
+            readable, _, _ = select.select([self.sock.sock], [], [], 0)
+        except (OSError, ValueError, TypeError):
+            return False
+        return len(readable) == 0
+
+    def _socket(self):
+        return self.sock
+
+    def _send(self, sock, data):
+        sock.send_binary(bytes(data))
+        self._sent(data)
+
+    def _fill(self, sock):
+        ret = sock.recv()
+        if type(ret) == str:
+            ret = bytes.fromhex(ret)
+        return self.decoder.feed(ret)
+
+    def receive_frame(self, sock):
+        frame = self.decoder.next_frame()
+        recv_calls = 0
+        while frame is None:
+            ret = sock.recv()
+            if len(ret) == 0:
+                raise ConnectionError('connection closed')
+            if type(ret) == str:
+                ret = bytes.fromhex(ret)
+            self.decoder.feed(ret)
+            recv_calls += 1
+            frame = self.decoder.next_frame()
+        if metrics.active is not None or parser.trace_log.isEnabledFor(parser.TRACE):
+            self._received(frame, recv_calls)
+        return frame
+
+    @locked
+    def send_receive_many(self, packages):
+        for i in packages:
+            self.sock.send_binary(bytes(i))
+        self._sent(*packages)
+        return self._receive_packages(len(packages), self.sock)
+
+    @locked
+    def send_receive_batch(self, buf, offsets):
+        view = memoryview(buf)
+        for start, stop in zip(offsets, offsets[1:]):
+            self.sock.send_binary(bytes(view[start:stop]))
+        self._sent(view[offsets[0]:offsets[-1]])
+        return self._receive_packages(len(offsets) - 1, self.sock)
+
+    @locked
+    def send_receive_stream(self, header, data):
+        # one websocket message per package
+        return self.send_receive(header + data)
 
+    @locked
     def send_receive(self, data):
         try:
             self.reset_buffers()
             self.sock.send_binary(bytes(data))
+            self._sent(data)
             ret = self.sock.recv()
             self.append_buffer(ret)
             while not self.package_complete() and len(ret) != 0:
                 ret = self.sock.recv()
                 self.append_buffer(ret)
+            if parser.trace_log.isEnabledFor(parser.TRACE):
+                parser.trace_log.log(parser.TRACE, '%s rx %s', self.host, self.buffer.hex())
             return self.get_data()
 
         except ValueError as err:
-            print("ws tx-rx: error: {0}".format(err))
+            log.error('%s tx-rx: %s', self.host, err)
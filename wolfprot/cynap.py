@@ -1,62 +1,310 @@
 import argparse
+import concurrent.futures
+import json
+import logging
+import mmap
+import os
+import queue
+import threading
+import time
+from wolfprot import cache as wp_cache
 from wolfprot import connection
+from wolfprot import metrics
+from wolfprot import parser as wp_parser
 from wolfprot import wolfdoc
 from textwrap import dedent
 
+log = logging.getLogger(__name__)
+
+
+def login_param(access_level: str = 'Admin', password: str = 'Password', admin_pin: str = ''):
+    """
+    access_level = 'None', 'User', 'Admin', 'Annotation', 'Viewer App'
+    """
+    login_access_level = {'None': 0x00,
+                          'User': 0x01,
+                          'Admin': 0x02,
+                          'Annotation': 0x03,
+                          'Viewer': 0x04,
+                          'App': 0x05
+                          }
+
+    if access_level not in login_access_level:
+        raise KeyError(f'Login level {access_level} not supported: {login_access_level.keys()}')
+
+    return {'Access level': login_access_level[access_level],
+            'Password length': len(password),
+            'Password': password,
+            'PIN length. This is an optional parameter and is only required if '
+            '<b>Admin Remote PIN</b> is set to <b>PIN required</b> and <b>Access '
+            'level</b> is set to <b>Admin</b>': len(admin_pin),
+            'PIN. This is an optional parameter and is only required if '
+            '<b>Admin Remote PIN</b> is set to <b>PIN required</b> and <b>Access level</b> '
+            'is set to <b>Admin</b>': admin_pin}
+
 
 class Cynap:
+    """
+    one logged in device connection, safe to share between threads:
+    the requests of all threads are serialised by self.lock, every call returns its own reply objects
+    """
+    # SET element of the firmware upload, used when set_firmware_update gets no cmd
+    firmware_update = ('System', 'Firmware update')
+    firmware_chunk_size = 0x100000
+
     def __init__(self, host: str, use_ssl: bool = True, doc_file: str = None, pw: str = 'Password',
-                 access_level: str = 'Admin', pin: str = '') -> object:
+                 access_level: str = 'Admin', pin: str = '', doc: wolfdoc.Wolfdoc = None, port: int = None,
+                 cache: wp_cache.ResponseCache = None, single_flight: wp_cache.SingleFlight = None) -> object:
 
-        if doc_file:
-            self.doc = wolfdoc.Wolfdoc(doc_file)
-            self.win_types = [(i['comment'], i['value']) for i in self.doc.get_window_types()['values']]
-        else:
-            self.doc = None
-            self.win_types = None
+        if doc is None and doc_file:
+            doc = wolfdoc.Wolfdoc(doc_file)
+
+        self.doc = doc
+        self._win_types = None
 
         self.host = host
         self.ssl = use_ssl
         self.pw = pw
         self.access_level = access_level
         self.pin = pin
+        self.port = port
         self.connection = None
+        # optional ResponseCache of the GET replies, can be shared between Cynaps
+        self.cache = cache
+        # optional SingleFlight: concurrent identical GETs share one request, can be shared between Cynaps
+        self.single_flight = single_flight
+        # reconnect and send again once when the connection breaks (not on device errors)
+        self.reconnect = False
+        self._connecting = False
+        self.lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._worker = None
+
+    @property
+    def win_types(self):
+        """
+        (comment, value) of the window types, read from the wolfprot file on first use
+        """
+        if self._win_types is None and self.doc:
+            self._win_types = [(i['comment'], i['value']) for i in self.doc.get_window_types()['values']]
+        return self._win_types
+
+    @win_types.setter
+    def win_types(self, value):
+        self._win_types = value
 
     def connect(self):
-        if connection.Websocket.is_websocket_url(self.host):
-            self.connection = connection.Websocket(self.host)
+        with self.lock:
+            if connection.Websocket.is_websocket_url(self.host):
+                self.connection = connection.Websocket(self.host)
+            else:
+                self.connection = connection.Socket(self.host, self.ssl, self.port)
+            try:
+                self._connecting = True
+                self.connection.connect()
+                self.login(self.access_level, self.pw, self.pin)
+
+            except (ConnectionRefusedError, TimeoutError) as err:
+                log.warning('%s: no connection: %s', self.host, err)
+                return False
+            finally:
+                self._connecting = False
+            return True
+
+    def disconnect(self):
+        self._stop_worker()
+        with self.lock:
+            if self.connection:
+                self.connection.disconnect()
+            self.connection = None
+
+    def is_alive(self) -> bool:
+        return self.connection is not None and self.connection.is_alive()
+
+    def send_package(self, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET', return_raw: bool = True) -> dict:
+        if self.connection is None:
+            return
+
+        data = self.doc.generate_frame(section, name, variant, param, direction)
+        if self.single_flight is not None and direction == 'GET':
+            # the raw reply is shared, every caller decodes it itself
+            reply = self.single_flight.do((self.host, bytes(data)), lambda: self.raw_package(data))
         else:
-            self.connection = connection.Socket(self.host, self.ssl)
-        try:
-            self.connection.connect()
-            self.login(self.access_level, self.pw, self.pin)
+            reply = self.raw_package(data)
+        if return_raw:
+            return reply
 
-        except (ConnectionRefusedError, TimeoutError) as err:
-            print(f'error: {err}')
-            return False
-        return True
+        return self.doc.generate_get_response(reply, variant)
 
-    def send_package(self, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET', return_raw: bool = True) -> dict:
+    def send_packages(self, requests: list, return_raw: bool = True) -> list:
+        """
+        pipeline several requests over the connection
+
+        requests: list of (section, name, variant, param, direction), trailing items can be omitted
+        return one reply per request in order, with return_raw False failed requests keep the raw reply
+        """
         if self.connection is None:
             return
 
-        data = self.doc.generate_get_request(section, name, variant, param, direction)
+        requests = [self._request(*req) for req in requests]
+        buf, offsets = self.doc.encode_batch((direction, section, name, variant, param)
+                                             for section, name, variant, param, direction in requests)
+        replies = self._transfer('send_receive_batch', buf, offsets)
+        if self.cache is not None:
+            for reply in replies:
+                if reply['type'] == 'SET' and not reply['error']:
+                    self.cache.invalidate(self.host, reply['cmd'].hex())
         if return_raw:
-            return self.raw_package(data)
+            return replies
+
+        return [reply if reply['error'] else self.doc.generate_get_response(reply, req[2])
+                for req, reply in zip(requests, replies)]
+
+    def stream_package(self, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET'):
+        """
+        generator: send the request and yield the decoded parameter dicts of the reply (common parameters,
+        then every repeating block) as soon as their bytes are received
 
-        return self.doc.generate_get_response(self.raw_package(data), variant)
+        the request is sent with the first next(), self.lock is held from then on until the generator
+        is exhausted or closed: iterate and close it in one thread (e.g. with contextlib.closing)
+        and finish it before the next request of this thread, an abandoned generator blocks the other threads
+        until it is collected
+        """
+        if self.connection is None:
+            return
+
+        data = self.doc.generate_frame(section, name, variant, param, direction)
+        decoder = self.doc.compile_reply(section, name, variant, direction)
+        with self.lock:
+            cmd_type, cmd, size, chunks = self.connection.send_receive_chunks(data)
+            try:
+                yield from decoder.iter_decode(chunks, size)
+            finally:
+                # reads the rest of the reply, the connection stays in sync
+                chunks.close()
+
+    @staticmethod
+    def _request(section: str, name: str, variant: int = 0, param=None, direction: str = 'GET'):
+        return section, name, variant, param, direction
+
+    def raw_packages(self, packages: list) -> list:
+        if self.connection is None:
+            return
+
+        return self._transfer('send_receive_many', packages)
+
+    def _transfer(self, method: str, *args):
+        with self.lock:
+            if self.connection is None:
+                raise ConnectionError('not connected')
+            try:
+                return getattr(self.connection, method)(*args)
+            except (ConnectionError, TimeoutError) as err:
+                if not self.reconnect or self._connecting or isinstance(err, connection.DeviceError):
+                    raise
+                if metrics.active is not None:
+                    metrics.active.inc('reconnects')
+                if self.connect() is False:
+                    raise
+                return getattr(self.connection, method)(*args)
 
     def raw_package(self, data: bytearray) -> dict:
         if self.connection is None:
             return
 
-        d = self.connection.send_receive(data)
-        h = self.connection.get_header().hex()
-        t, cmd, start, stop = self.connection.parse_header()
-        e = self.get_error_status()
-        res = {'type': t, 'cmd': cmd, 'header': h, 'data': d, 'error': e}
+        key = None
+        if self.cache is not None:
+            hdr = wp_parser.header_info(data)
+            if hdr is not None:
+                cmd_type, cmd = hdr[0], bytes(hdr[1]).hex().upper()
+                if cmd_type == 'GET':
+                    key = self.cache.key(self.host, cmd_type, cmd, data)
+                    res = self.cache.get(key)
+                    if res is not None:
+                        return res
+
+        with self.lock:
+            res = self._transfer('send_receive_many', [data])[0]
+            if res['error'] and self.connection.raise_device_error:
+                raise connection.DeviceError(res['error'])
+
+        if key is not None:
+            self.cache.put(key, res)
+        elif self.cache is not None and res['type'] == 'SET' and not res['error']:
+            self.cache.invalidate(self.host, res['cmd'].hex())
         return res
 
+    def submit(self, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET',
+               return_raw: bool = True) -> concurrent.futures.Future:
+        """
+        queue a request for the worker thread, return a concurrent.futures.Future of the send_package result
+
+        the worker pipelines all requests queued meanwhile (by any thread) with one send_packages,
+        the connection is not idle between them
+        """
+        future = concurrent.futures.Future()
+        with self.lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._work, daemon=True)
+                self._worker.start()
+            self._queue.put((future, self._request(section, name, variant, param, direction), return_raw))
+        return future
+
+    def _stop_worker(self):
+        with self.lock:
+            worker = self._worker
+            self._worker = None
+            if worker is None:
+                return
+            self._queue.put(None)
+        if worker is not threading.current_thread():
+            worker.join()
+
+    def _work(self):
+        stop = False
+        while not stop:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in batch
+            batch = [i for i in batch if i is not None and i[0].set_running_or_notify_cancel()]
+            if batch:
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            with self.lock:
+                replies = self.send_packages([req for future, req, return_raw in batch])
+                if replies is None:
+                    raise ConnectionError('not connected')
+                raise_device_error = self.connection.raise_device_error
+        except (ValueError, KeyError) as err:
+            if len(batch) == 1:
+                batch[0][0].set_exception(err)
+                return
+            # fail only the invalid request
+            for i in batch:
+                self._run_batch([i])
+            return
+        except Exception as err:
+            for future, req, return_raw in batch:
+                future.set_exception(err)
+            return
+
+        for (future, req, return_raw), reply in zip(batch, replies):
+            if reply['error'] and raise_device_error:
+                future.set_exception(connection.DeviceError(reply['error']))
+            elif return_raw:
+                future.set_result(reply)
+            else:
+                try:
+                    future.set_result(self.doc.generate_get_response(reply, req[2]))
+                except (ValueError, KeyError) as err:
+                    future.set_exception(err)
+
     def get_error_status(self) -> str:
         if self.connection is None:
             return
@@ -66,27 +314,106 @@ class Cynap:
         """
         access_level = 'None', 'User', 'Admin', 'Annotation', 'Viewer App'
         """
-        login_access_level = {'None': 0x00,
-                              'User': 0x01,
-                              'Admin': 0x02,
-                              'Annotation': 0x03,
-                              'Viewer': 0x04,
-                              'App': 0x05
-                              }
-
-        if access_level not in login_access_level:
-            raise KeyError(f'Login level {access_level} not supported: {login_access_level.keys()}')
-
-        param = {'Access level': login_access_level[access_level],
-                 'Password length': len(password),
-                 'Password': password,
-                 'PIN length. This is an optional parameter and is only required if '
-                 '<b>Admin Remote PIN</b> is set to <b>PIN required</b> and <b>Access '
-                 'level</b> is set to <b>Admin</b>': len(admin_pin),
-                 'PIN. This is an optional parameter and is only required if '
-                 '<b>Admin Remote PIN</b> is set to <b>PIN required</b> and <b>Access level</b> '
-                 'is set to <b>Admin</b>': admin_pin}
-        self.send_package('System', 'Login', 0, param, 'SET')
+        m = metrics.active
+        start = time.perf_counter()
+        self.send_package('System', 'Login', 0, login_param(access_level, password, admin_pin), 'SET')
+        if m is not None:
+            m.latency('login', self.doc.compile_request('System', 'Login', 0, 'SET').cmd, time.perf_counter() - start)
+
+    def firmware_cmd(self) -> str:
+        """
+        command of the firmware upload from the wolfprot file (see firmware_update)
+        """
+        section, name = self.firmware_update
+        if self.doc is None:
+            raise KeyError('no wolfprot file, firmware upload command unknown')
+        return self.doc.get_element_by_name('SET', section, name)[section][name]['command']
+
+    def set_firmware_update(self, file: str, cmd=None, chunk_size: int = None, offset: int = 0, progress=None) -> int:
+        """
+        upload a firmware image (e.g. cb1.wgz)
+
+        the file is mmap'd and sent in chunks, each chunk is one SET package with extended header
+        cmd: firmware upload command, default see firmware_cmd
+        offset: resume an interrupted upload at this file position
+        progress(sent, total) is called after every chunk the device acknowledged
+        return the file position reached (the file size when finished)
+        """
+        if self.connection is None:
+            return
+
+        if cmd is None:
+            cmd = self.firmware_cmd()
+        if chunk_size is None:
+            chunk_size = self.firmware_chunk_size
+        if not 0 < chunk_size <= 0xFFFFFFFF:
+            raise ValueError('chunk size out of range')
+
+        with open(file, 'rb') as fp, self.lock:
+            total = os.fstat(fp.fileno()).st_size
+            if not 0 <= offset <= total:
+                raise ValueError('offset out of range')
+            if offset == total:
+                return offset
+
+            image = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            data = memoryview(image)
+            try:
+                header = self.connection.generate_ext_header('SET', cmd, chunk_size)
+                while offset < total:
+                    with data[offset:offset + chunk_size] as chunk:
+                        if len(chunk) != chunk_size:
+                            header = self.connection.generate_ext_header('SET', cmd, len(chunk))
+                        self.connection.send_receive_stream(header, chunk)
+                        offset += len(chunk)
+                    if progress:
+                        progress(offset, total)
+            finally:
+                data.release()
+                image.close()
+        return offset
+
+
+def parse_request(text: str):
+    """
+    return section, name, variant of a request "section/name[/variant]"
+    """
+    req = text.split('/')
+    if len(req) not in (2, 3):
+        raise ValueError(f'request {text}: expect section/name[/variant]')
+    return req[0], req[1], int(req[2]) if len(req) == 3 else 0
+
+
+def fleet_main(args, pwd, level, pin):
+    """run the -r requests on all --hosts and print the results as they arrive
+    """
+    from wolfprot import fleet
+
+    if args.wp_file is None or not args.requests:
+        raise BaseException('fleet mode needs a wolfprot file (-f) and requests (-r)')
+
+    if args.hosts.startswith('@'):
+        with open(args.hosts[1:]) as fp:
+            hosts = [i.strip() for i in fp if i.strip()]
+    else:
+        hosts = [i.strip() for i in args.hosts.split(',') if i.strip()]
+
+    credentials = None
+    if args.credentials:
+        with open(args.credentials) as fp:
+            credentials = json.load(fp)
+
+    requests = [parse_request(i) for i in args.requests]
+
+    def show(res):
+        if res['error']:
+            print(f'{res["host"]}: error: {res["error"]}')
+        else:
+            print(f'{res["host"]}: {res["replies"]}')
+
+    results = fleet.run(hosts, requests, show, concurrency=args.jobs, credentials=credentials, doc_file=args.wp_file,
+                        pw=pwd, access_level=level, pin=pin)
+    return all(res['error'] is None for res in results)
 
 
 def main():
@@ -118,19 +445,52 @@ def main():
     parser.add_argument('-c',
                         action='store',
                         dest='cmd',
-                        help='raw wolfprot command e.g. 09CB020101')
+                        help='raw wolfprot command e.g. 09CB020101 or GET request "section/name[/variant]"')
     parser.add_argument('-f',
                         action='store',
                         dest='wp_file',
                         help='wolfprot.json file location')
+    parser.add_argument('--hosts',
+                        action='store',
+                        dest='hosts',
+                        help='fleet mode: comma separated ip addresses or @file with one host per line')
+    parser.add_argument('-r',
+                        action='append',
+                        dest='requests',
+                        help='fleet mode: GET request "section/name[/variant]" e.g. Device/Boxname, repeatable')
+    parser.add_argument('-j',
+                        action='store',
+                        dest='jobs',
+                        type=int,
+                        default=32,
+                        help='fleet mode: number of hosts in parallel')
+    parser.add_argument('--credentials',
+                        action='store',
+                        dest='credentials',
+                        help='fleet mode: json file {"host": {"pw": "", "access_level": "", "pin": ""}}')
+    parser.add_argument('-v',
+                        action='store_true',
+                        dest='verbose',
+                        help='debug output')
+    parser.add_argument('--trace',
+                        action='store_true',
+                        dest='trace',
+                        help='print every sent and received package as hex')
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(name)s: %(message)s')
+    if args.trace:
+        wp_parser.enable_trace()
+
     cmd = args.cmd
     pwd = args.pwd if args.pwd else 'Password'
     level = args.level if args.level else 'Admin'
     wp_file = args.wp_file if args.wp_file else None
     pin = args.pin if args.pin else ''
 
+    if args.hosts:
+        return fleet_main(args, pwd, level, pin)
+
     if wp_file is None and args.cmd is None:
         raise BaseException('no wolfprot file or wolfprot command selected')
 
@@ -142,9 +502,17 @@ def main():
     print(f'PW: {pwd}')
 
     if args.cmd:
-        data_ = bytes.fromhex(''.join(''.join(cmd.casefold().split(sep='0x')).split()))
-        ret = cb1.raw_package(bytearray(data_))
-        print(cb1.doc.get_response(ret))
+        variant = 0
+        if '/' in cmd:
+            if cb1.doc is None:
+                raise BaseException('GET request needs a wolfprot file (-f)')
+            section, name, variant = parse_request(cmd)
+            data_ = cb1.doc.generate_frame(section, name, variant)
+        else:
+            data_ = bytes.fromhex(''.join(''.join(cmd.casefold().split(sep='0x')).split()))
+        ret = cb1.raw_package(data_)
+        res = cb1.doc.generate_get_response(ret, variant) if cb1.doc else None
+        print(res if res is not None else ret)
         return
 
     while True:
@@ -0,0 +1,108 @@
+import asyncio
+
+from wolfprot import aio
+from wolfprot import wolfdoc
+
+
+class Fleet:
+    """
+    run the same requests against many Cynap hosts concurrently
+
+    credentials: dict host -> {'pw': ..., 'access_level': ..., 'pin': ...},
+    missing keys and hosts use the pw, access_level and pin arguments
+    the logged in sessions are kept and reused by the following runs
+    """
+
+    def __init__(self, hosts: list, concurrency: int = 32, credentials: dict = None, doc_file: str = None,
+                 pw: str = 'Password', access_level: str = 'Admin', pin: str = '', use_ssl: bool = True,
+                 doc: wolfdoc.Wolfdoc = None, timeout: float = 10, port: int = None):
+        if doc is None and doc_file:
+            doc = wolfdoc.Wolfdoc(doc_file)
+
+        self.hosts = list(dict.fromkeys(hosts))
+        self.concurrency = concurrency
+        self.credentials = credentials if credentials else dict()
+        self.default = {'pw': pw, 'access_level': access_level, 'pin': pin}
+        self.doc = doc
+        self.ssl = use_ssl
+        self.timeout = timeout
+        self.port = port
+        self.sessions = dict()
+
+    def _credentials(self, host):
+        cred = dict(self.default)
+        cred.update(self.credentials.get(host, dict()))
+        return cred
+
+    async def _session(self, host):
+        session = self.sessions.get(host)
+        if session is not None and session.connection.connected():
+            return session
+
+        cred = self._credentials(host)
+        session = aio.AsyncCynap(host, self.ssl, None, cred['pw'], cred['access_level'], cred['pin'], self.doc,
+                                 self.timeout, self.port)
+        if await session.connect() is False:
+            raise ConnectionError(f'No connection to Host {host}')
+        self.sessions[host] = session
+        return session
+
+    async def _drop(self, host):
+        session = self.sessions.pop(host, None)
+        if session is not None:
+            await session.disconnect()
+
+    async def run_host(self, host: str, requests: list, return_raw: bool = False) -> dict:
+        """
+        return {'host': host, 'replies': list or None, 'error': None or str}
+        """
+        try:
+            session = await self._session(host)
+            replies = await session.send_packages(requests, return_raw)
+            return {'host': host, 'replies': replies, 'error': None}
+        except Exception as err:
+            await self._drop(host)
+            return {'host': host, 'replies': None, 'error': f'{type(err).__name__}: {err}'}
+
+    async def run(self, requests: list, return_raw: bool = False):
+        """
+        async generator, yields the result of each host as soon as it is finished
+
+        requests: list of (section, name, variant, param, direction), see cynap.Cynap.send_packages
+        """
+        sem = asyncio.Semaphore(self.concurrency)
+
+        async def limited(host):
+            async with sem:
+                return await self.run_host(host, requests, return_raw)
+
+        for res in asyncio.as_completed([limited(host) for host in self.hosts]):
+            yield await res
+
+    async def close(self):
+        for host in list(self.sessions):
+            await self._drop(host)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def run(hosts: list, requests: list, callback=None, return_raw: bool = False, **kwargs) -> list:
+    """
+    blocking helper: run the requests on all hosts, call callback(result) per finished host
+
+    kwargs are passed to Fleet
+    """
+    async def main():
+        results = list()
+        async with Fleet(hosts, **kwargs) as fleet:
+            async for res in fleet.run(requests, return_raw):
+                if callback:
+                    callback(res)
+                results.append(res)
+        return results
+
+    return asyncio.run(main())
@@ -0,0 +1,156 @@
+import bisect
+import threading
+
+# the Metrics instance recording the hot path, None when disabled
+active = None
+
+
+class Histogram:
+    """
+    cumulative histogram in the prometheus sense, bucket i counts the values <= bounds[i]
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # the last bucket is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def buckets(self):
+        """
+        return (upper bound, cumulative count), the last bound is +Inf
+        """
+        res = list()
+        total = 0
+        for bound, count in zip(list(self.bounds) + [float('inf')], self.counts):
+            total += count
+            res.append((bound, total))
+        return res
+
+
+class Metrics:
+    """
+    counters and histograms of the wolfprot hot path, see enable
+
+    histograms (seconds per command): encode, wire (request sent until reply received), decode, login
+    histogram recv_calls: recv calls per received package
+    counters: bytes_sent, bytes_received, reconnects, device_errors per error of parser.Parser.error_dict
+
+    callback(name, labels, value) is called with every recorded value
+    """
+    latency_buckets = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5,
+                       10)
+    recv_buckets = (1, 2, 4, 8, 16, 32, 64, 128)
+    prefix = 'wolfprot'
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.histograms = dict()  # (name, labels) -> Histogram
+        self.counters = dict()  # (name, labels) -> value
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value, labels=()):
+        """
+        labels: tuple of (label, value)
+        """
+        key = (name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(self.recv_buckets if name == 'recv_calls' else
+                                                        self.latency_buckets)
+            hist.observe(value)
+        if self.callback:
+            self.callback(name, dict(labels), value)
+
+    def inc(self, name: str, value=1, labels=()):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        if self.callback:
+            self.callback(name, dict(labels), value)
+
+    # hooks of the hot path
+
+    def latency(self, name: str, cmd, seconds: float):
+        self.observe(name, seconds, (('cmd', cmd.hex().upper() if isinstance(cmd, (bytes, bytearray, memoryview))
+                                      else str(cmd).upper()),))
+
+    def sent(self, size: int):
+        self.inc('bytes_sent', size)
+
+    def frame(self, frame, recv_calls: int, seconds: float = None):
+        """
+        a parser.Frame was received with recv_calls recv calls, seconds after its request was sent
+        """
+        self.inc('bytes_received', len(frame.package))
+        self.observe('recv_calls', recv_calls)
+        if seconds is not None:
+            self.latency('wire', frame.cmd, seconds)
+        if frame.error is not None:
+            self.inc('device_errors', labels=(('error', frame.get_error()),))
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+
+    def prometheus(self) -> str:
+        """
+        return the metrics in the prometheus text format
+        """
+        def labels(items, extra=()):
+            items = tuple(items) + tuple(extra)
+            if len(items) == 0:
+                return ''
+            return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+        def number(value):
+            if value == float('inf'):
+                return '+Inf'
+            return repr(value) if isinstance(value, float) else str(value)
+
+        lines = list()
+        with self._lock:
+            histograms = {key: (hist.buckets(), hist.sum, hist.count) for key, hist in self.histograms.items()}
+            counters = dict(self.counters)
+
+        for name in sorted({key[0] for key in counters}):
+            metric = f'{self.prefix}_{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            for key in sorted(i for i in counters if i[0] == name):
+                lines.append(f'{metric}{labels(key[1])} {number(counters[key])}')
+
+        for name in sorted({key[0] for key in histograms}):
+            metric = f'{self.prefix}_{name}' if name == 'recv_calls' else f'{self.prefix}_{name}_seconds'
+            lines.append(f'# TYPE {metric} histogram')
+            for key in sorted(i for i in histograms if i[0] == name):
+                buckets, total, count = histograms[key]
+                for bound, cumulative in buckets:
+                    lines.append(f'{metric}_bucket{labels(key[1], (("le", number(bound)),))} {cumulative}')
+                lines.append(f'{metric}_sum{labels(key[1])} {number(total)}')
+                lines.append(f'{metric}_count{labels(key[1])} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def enable(callback=None) -> Metrics:
+    """
+    start recording, return the Metrics instance
+
+    metrics.enable()
+    ...
+    print(metrics.active.prometheus())
+    """
+    global active
+    active = Metrics(callback)
+    return active
+
+
+def disable():
+    global active
+    active = None
@@ -0,0 +1,384 @@
+import collections
+import concurrent.futures
+import errno
+import ipaddress
+import os
+import queue
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import parser
+from wolfprot import wolfdoc
+
+# device states
+CONNECTING, HANDSHAKE, READY, CLOSED = range(4)
+
+
+class _Device:
+    """
+    one non-blocking connection of the Multiplexer
+    """
+    send_size = 0x4000
+
+    def __init__(self, key, ip_addr: str, use_ssl: bool, deadline: float):
+        self.key = key
+        self.ip_addr = ip_addr
+        self.use_ssl = use_ssl
+        self.sock = None
+        self.state = CONNECTING
+        self.error = None  # of a closed connection
+        self.deadline = deadline  # of connect and handshake
+        self.events = 0
+        self.want = selectors.EVENT_READ  # of the tls handshake
+        self.out = bytearray()
+        self.chunk = None  # a tls send has to be retried with the same data
+        self.pending = collections.deque()  # (future, deadline) in request order
+        self.decoder = parser.FrameDecoder()
+        self.parser = parser.Parser()
+
+    def reply(self, package) -> dict:
+        self.parser.reset_buffers()
+        self.parser.buffer.extend(package)
+        return self.parser.get_package(0)
+
+
+class Multiplexer:
+    """
+    many device connections on one thread without asyncio
+
+    the sockets (and tls handshakes) are non-blocking and driven by a selector,
+    requests are queued from any thread and pipelined per device,
+    every request returns a concurrent.futures.Future of the reply dict: type, cmd, header, data, error
+
+    with mux.Multiplexer(doc=doc) as m:
+        key = m.connect('192.168.100.45')
+        m.login(key)
+        print(m.request(key, 'Device', 'Boxname').result())
+
+    without start_thread the owning thread drives the connections with run_once or run_until_complete
+    and calls close when done
+    """
+
+    def __init__(self, timeout: float = 10, doc: wolfdoc.Wolfdoc = None):
+        self.timeout = timeout
+        self.doc = doc
+        self.devices = dict()  # (host, port) -> _Device
+        self.selector = selectors.DefaultSelector()
+        self._queue = queue.Queue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+        self._running = False
+        self._thread = None
+
+    @staticmethod
+    def key(host: str, use_ssl: bool = True, port: int = None):
+        if port is None:
+            port = connection.Socket.ports['ssl'] if use_ssl else connection.Socket.ports['no_ssl']
+        return host, port
+
+    def _call(self, func, *args):
+        # run func in the thread of the selector loop
+        self._queue.put((func, args))
+        try:
+            self._wake_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def connect(self, host: str, use_ssl: bool = True, port: int = None):
+        """
+        open a connection, return its key for request
+
+        requests are queued until the connection is established, connection errors fail them
+        """
+        ip_addr = str(ipaddress.ip_address(host))
+        key = self.key(host, use_ssl, port)
+        self._call(self._connect, key, ip_addr, use_ssl is True)
+        return key
+
+    def close(self, key=None):
+        """
+        close the connection of key, without key close the multiplexer: stop its thread, close all connections,
+        the selector and the wake up sockets
+        """
+        if key is not None:
+            self._call(self._close, key, ConnectionError('connection closed'))
+            return
+
+        self.stop_thread()
+        for key in list(self.devices):
+            self._close(key, ConnectionError('multiplexer closed'))
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def submit(self, key, package, callback=None) -> concurrent.futures.Future:
+        """
+        queue a request package, callback(future) is called in the selector thread with the reply
+        """
+        future = concurrent.futures.Future()
+        if callback:
+            future.add_done_callback(callback)
+        self._call(self._submit, key, bytes(package), future)
+        return future
+
+    def request(self, key, section: str, name: str, variant: int = 0, param=None, direction: str = 'GET',
+                callback=None) -> concurrent.futures.Future:
+        """
+        see submit, the package is generated by doc
+        """
+        return self.submit(key, self.doc.generate_frame(section, name, variant, param, direction), callback)
+
+    def login(self, key, access_level: str = 'Admin', password: str = 'Password', admin_pin: str = '',
+              callback=None) -> concurrent.futures.Future:
+        return self.request(key, 'System', 'Login', 0, cynap.login_param(access_level, password, admin_pin), 'SET',
+                            callback)
+
+    def _connect(self, key, ip_addr, use_ssl):
+        old = self.devices.get(key)
+        if old is not None:
+            self._fail(old, ConnectionError('reconnected'))
+
+        dev = _Device(key, ip_addr, use_ssl, time.monotonic() + self.timeout)
+        self.devices[key] = dev
+        family = socket.AF_INET6 if ipaddress.ip_address(ip_addr).version == 6 else socket.AF_INET
+        dev.sock = socket.socket(family, socket.SOCK_STREAM)
+        dev.sock.setblocking(False)
+        err = dev.sock.connect_ex((ip_addr, key[1]))
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self._fail(dev, OSError(err, os.strerror(err)))
+            return
+        self._update(dev)
+
+    def _close(self, key, err):
+        dev = self.devices.pop(key, None)
+        if dev is not None:
+            self._fail(dev, err)
+
+    def _submit(self, key, package, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        dev = self.devices.get(key)
+        if dev is None or dev.state == CLOSED:
+            future.set_exception(dev.error if dev else ConnectionError('not connected'))
+            return
+        dev.out.extend(package)
+        dev.pending.append((future, time.monotonic() + self.timeout))
+        self._update(dev)
+
+    def _fail(self, dev, err):
+        if dev.state != CLOSED:
+            dev.state = CLOSED
+            dev.error = err
+            if dev.events:
+                self.selector.unregister(dev.sock)
+                dev.events = 0
+            dev.sock.close()
+        dev.out.clear()
+        dev.chunk = None
+        while dev.pending:
+            dev.pending.popleft()[0].set_exception(err)
+
+    def _update(self, dev):
+        # selector events of the device state
+        if dev.state == CONNECTING:
+            events = selectors.EVENT_WRITE
+        elif dev.state == HANDSHAKE:
+            events = dev.want
+        elif dev.state == READY:
+            events = selectors.EVENT_READ
+            if dev.out or dev.chunk:
+                events |= selectors.EVENT_WRITE
+        else:
+            events = 0
+
+        if events == dev.events:
+            return
+        if dev.events == 0:
+            self.selector.register(dev.sock, events, dev)
+        elif events == 0:
+            self.selector.unregister(dev.sock)
+        else:
+            self.selector.modify(dev.sock, events, dev)
+        dev.events = events
+
+    def _connected(self, dev):
+        err = dev.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._fail(dev, OSError(err, os.strerror(err)))
+            return
+        if not dev.use_ssl:
+            dev.state = READY
+            self._update(dev)
+            return
+
+        # the wrapped socket replaces the registered one
+        self.selector.unregister(dev.sock)
+        dev.events = 0
+        dev.sock = connection.ssl_context().wrap_socket(dev.sock, server_hostname=dev.ip_addr,
+                                                        do_handshake_on_connect=False)
+        dev.state = HANDSHAKE
+        self._handshake(dev)
+
+    def _handshake(self, dev):
+        try:
+            dev.sock.do_handshake()
+        except ssl.SSLWantReadError:
+            dev.want = selectors.EVENT_READ
+        except ssl.SSLWantWriteError:
+            dev.want = selectors.EVENT_WRITE
+        except OSError as err:
+            self._fail(dev, err)
+            return
+        else:
+            dev.state = READY
+        self._update(dev)
+
+    def _read(self, dev):
+        while True:
+            try:
+                n = dev.decoder.recv_into(dev.sock)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except OSError as err:
+                self._fail(dev, err)
+                return
+            if n == 0:
+                self._fail(dev, ConnectionError('connection closed'))
+                return
+
+            frame = dev.decoder.next_frame()
+            while frame is not None:
+                if not dev.pending:
+                    self._fail(dev, ConnectionError('package without request'))
+                    return
+                future = dev.pending.popleft()[0]
+                future.set_result(dev.reply(frame.package))
+                frame = dev.decoder.next_frame()
+
+            # tls keeps already decrypted bytes the selector does not see
+            if not (dev.use_ssl and dev.sock.pending()):
+                return
+
+    def _write(self, dev):
+        while dev.out or dev.chunk:
+            if dev.chunk is None:
+                dev.chunk = memoryview(bytes(dev.out[:dev.send_size]))
+                del dev.out[:len(dev.chunk)]
+            try:
+                n = dev.sock.send(dev.chunk)
+            except (BlockingIOError, ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                break
+            except OSError as err:
+                self._fail(dev, err)
+                return
+            dev.chunk = dev.chunk[n:] if n < len(dev.chunk) else None
+            if dev.chunk is not None:
+                break
+        self._update(dev)
+
+    def _handle(self, dev, events):
+        if dev.state == CONNECTING:
+            self._connected(dev)
+        elif dev.state == HANDSHAKE:
+            self._handshake(dev)
+        if dev.state != READY:
+            return
+        if events & selectors.EVENT_READ:
+            self._read(dev)
+        if events & selectors.EVENT_WRITE and dev.state == READY:
+            self._write(dev)
+
+    def _process_queue(self):
+        while True:
+            try:
+                func, args = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            func(*args)
+
+    def _next_deadline(self):
+        deadlines = [dev.deadline for dev in self.devices.values() if dev.state in (CONNECTING, HANDSHAKE)]
+        deadlines.extend(dev.pending[0][1] for dev in self.devices.values() if dev.pending)
+        return min(deadlines) if deadlines else None
+
+    def _check_deadlines(self):
+        now = time.monotonic()
+        for dev in list(self.devices.values()):
+            if dev.state in (CONNECTING, HANDSHAKE) and dev.deadline < now:
+                self._fail(dev, TimeoutError('connect timed out'))
+            elif dev.pending and dev.pending[0][1] < now:
+                # the reply stream is out of sync
+                self._fail(dev, TimeoutError('no reply'))
+
+    def run_once(self, timeout: float = None):
+        """
+        handle queued calls and the events of at most timeout seconds
+        """
+        self._process_queue()
+        deadline = self._next_deadline()
+        if deadline is not None:
+            wait = max(0, deadline - time.monotonic())
+            timeout = wait if timeout is None else min(timeout, wait)
+
+        for key, events in self.selector.select(timeout):
+            if key.data is None:
+                try:
+                    while self._wake_r.recv(0x1000):
+                        pass
+                except BlockingIOError:
+                    pass
+            else:
+                self._handle(key.data, events)
+        self._process_queue()
+        self._check_deadlines()
+
+    def run_until_complete(self, futures, timeout: float = None):
+        """
+        drive the connections in this thread until the futures are done
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        while not all(i.done() for i in futures):
+            if end is not None and time.monotonic() >= end:
+                raise TimeoutError('futures not done')
+            self.run_once(None if end is None else end - time.monotonic())
+        return [i.result() for i in futures]
+
+    def run(self):
+        """
+        run the selector loop until stop
+        """
+        self._running = True
+        while self._running:
+            self.run_once()
+        for key in list(self.devices):
+            self._close(key, ConnectionError('multiplexer stopped'))
+
+    def stop(self):
+        def stop():
+            self._running = False
+        self._call(stop)
+
+    def start_thread(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop_thread(self):
+        if self._thread is None:
+            return
+        self.stop()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start_thread()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -1,3 +1,103 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+# every sent and received package as hex, opt-in with enable_trace
+TRACE = 5
+logging.addLevelName(TRACE, 'TRACE')
+trace_log = logging.getLogger('wolfprot.trace')
+
+
+def enable_trace(handler: logging.Handler = None):
+    """
+    log the packages of all connections as hex to the wolfprot.trace logger
+    """
+    trace_log.setLevel(TRACE)
+    if handler is not None:
+        trace_log.addHandler(handler)
+
+
+def disable_trace():
+    trace_log.setLevel(logging.NOTSET)
+
+
+def header_info(buf, offset=0, end=None):
+    """
+    parse the package header at buf[offset:end]
+
+    return cmd_type, cmd, data_start, data_end, error
+    or None when the header is not complete
+    data_start and data_end are absolute positions in buf
+    """
+    if end is None:
+        end = len(buf)
+    avail = end - offset
+
+    if avail < 2:
+        return None
+
+    hdr_len = 3  # dir + cmd + len
+    flags = buf[offset]
+    error = None
+    ext_hdr = None
+    ext_len = None
+    ext_cmd = None
+
+    if flags & 0x80:
+        error = 1
+    elif flags & 0x02:  # dir + 0x01 + cmd + len
+        ext_hdr = 1
+        hdr_len += 1
+    elif flags & 0x04:
+        ext_len = 1
+
+    if flags & 0x08:  # dir + cmd + cmd + len
+        ext_cmd = 1
+        hdr_len += 1
+
+    if error is None:
+        if ext_hdr and (buf[offset + 1] & 0x01):
+            hdr_len += 3
+        elif ext_len:
+            hdr_len += 1
+
+    if avail < hdr_len:
+        return None
+
+    cmd_type = 'SET' if flags & 0x01 else 'GET'
+
+    # aa cc ll dd
+    cmd_start = 1
+    len_start = 2
+    data_start = 3
+
+    if error:
+        # aa cc DD
+        data_start = 2
+        if ext_cmd:
+            # aa cc CC dd
+            data_start += 1
+        len_start = data_start
+        data_end = data_start + 1
+    else:
+        if ext_hdr:
+            # aa 01 cc ll LL LL LL dd
+            cmd_start += 1
+            data_start += 4
+            len_start += 1
+        if ext_cmd:
+            # aa cc CC ll dd
+            len_start += 1
+            data_start += 1
+        if ext_len and ext_hdr is None:
+            # aa cc ll LL dd
+            data_start += 1
+        data_end = data_start + int.from_bytes(buf[offset + len_start:offset + data_start], 'big')
+
+    cmd = buf[offset + cmd_start:offset + len_start]
+    return cmd_type, cmd, data_start + offset, data_end + offset, error
+
+
 class Parser:
     error_dict = {'01': 'Timeout',
                   '02': 'unknown command',
@@ -20,7 +120,7 @@ class Parser:
                 self.append_buffer(byte_str)
 
         except ValueError as err:
-            print("error: {0}".format(err))
+            log.warning('invalid package: %s', err)
 
     def reset_buffers(self):
         self.buffer = bytearray()
@@ -36,10 +136,10 @@ class Parser:
             if type(data) == str:
                 data_ = bytes.fromhex(''.join(''.join(data.casefold().split(sep='0x')).split()))
                 self.buffer.extend(data_)
-            elif type(data) == bytes:
+            elif type(data) in (bytes, bytearray, memoryview):
                 self.buffer.extend(data)
         except ValueError as err:
-            print("error: {0}".format(err))
+            log.warning('invalid package: %s', err)
             return -1
 
         if self.cmd_type is None:
@@ -58,90 +158,18 @@ class Parser:
         self.data_end = None
         self.error = None
 
-        hdr_len = 3  # dir + cmd + len
-
         if offset > len(self.buffer):
             raise ValueError('offset out of range')
 
-        sub_buffer = self.buffer[offset:]
-
-        if(len(sub_buffer) < 2):
-            return None, None, None, None
-
-        ext_hdr = None
-        ext_len = None
-        ext_cmd = None
-
-        if self.buffer[0] & 0x80:
-            self.error = 1
-        elif self.buffer[0] & 0x02:  # dir + 0x01 + cmd + len
-            ext_hdr = 1
-            hdr_len += 1
-        elif self.buffer[0] & 0x04:
-            ext_len = 1
-
-        if self.buffer[0] & 0x08:  # dir + cmd + cmd + len
-            ext_cmd = 1
-            hdr_len += 1
-
-        if self.error is None:
-            if len(sub_buffer) < 4:
-                return None, None, None, None
-            if ext_hdr and (self.buffer[1] & 0x01):
-                hdr_len += 3
-            elif ext_len:
-                hdr_len += 1
-
-        if len(sub_buffer) < hdr_len:
+        hdr = header_info(self.buffer, offset)
+        if hdr is None:
             return None, None, None, None
 
-        if self.buffer[0] & 0x01:
-            cmd_type = 'SET'
-        else:
-            cmd_type = 'GET'
-
-        # aa cc ll dd
-        cmd_start = 1
-        len_start = 2
-        data_start = 3
-
-        if self.error:
-            # aa cc DD
-            data_start = 2
-            if ext_cmd:
-                # aa cc CC dd
-                data_start += 1
-            len_start = data_start
-            data_end = data_start + 1
-        else:
-            if ext_hdr:
-                # aa 01 cc ll LL LL LL dd
-                cmd_start += 1
-                data_start += 4
-                len_start += 1
-            if ext_cmd:
-                # aa cc CC ll dd
-                len_start += 1
-                data_start += 1
-            if ext_len and ext_hdr is None:
-                # aa cc ll LL dd
-                data_start += 1
-            data_len = self.buffer[len_start:data_start]
-            data_end = data_start + int(data_len.hex(), 16)
-
-        cmd = self.buffer[cmd_start:len_start]
-
-        data_end += offset
-        data_start += offset
-        self.cmd_type = cmd_type
-        self.cmd = cmd
-        self.data_start = data_start
-        self.data_end = data_end
-        return cmd_type, cmd, data_start, data_end
+        self.cmd_type, self.cmd, self.data_start, self.data_end, self.error = hdr
+        return self.cmd_type, self.cmd, self.data_start, self.data_end
 
     def package_complete(self):
-        sub_byte_str = self.buffer[self.offset:]
-        if self.data_end is None or self.offset + len(sub_byte_str) < self.data_end:
+        if self.data_end is None or len(self.buffer) < self.data_end:
             return False
         return True
 
@@ -156,7 +184,7 @@ class Parser:
     def get_header(self):
         if not self.package_complete():
             return None
-        return self.buffer[:self.data_start]
+        return self.buffer[self.offset:self.data_start]
 
     def get_error(self):
         if self.package_complete() is False:
@@ -164,7 +192,17 @@ class Parser:
 
         if self.error is None:
             return None
-        return self.error_dict[self.get_data().hex()]
+        return self.error_dict[self.get_data().hex().upper()]
+
+    def get_package(self, offset=0):
+        """
+        return the package at offset as dict: type, cmd, header, data, error
+        """
+        t, cmd, start, end = self.parse_header(offset)
+        if not self.package_complete():
+            return None
+        return {'type': t, 'cmd': cmd, 'header': self.get_header().hex(), 'data': self.get_data(),
+                'error': self.get_error()}
 
     def generate_header_information(self, cmd_type, cmd, ext_hdr=None, ext_len=None, error=None):
         hdr = self.generate_package(cmd_type, cmd, b'', ext_hdr, ext_len, error)
@@ -199,7 +237,14 @@ class Parser:
         else:
             raise ValueError('unknown type')
 
-        if ((len(data_) > 0xFF) and ext_len is None) or (len(data_) > 0xFFFF and ext_hdr is None):
+        if ext_hdr:
+            max_len = 0xFFFFFFFF
+        elif ext_len:
+            max_len = 0xFFFF
+        else:
+            max_len = 0xFF
+
+        if len(data_) > max_len:
             raise ValueError('data to long')
 
         if type(cmd) is str:
@@ -236,3 +281,180 @@ class Parser:
 
         self.buffer.extend(buf)
         return buf
+
+    @staticmethod
+    def generate_ext_header(cmd_type, cmd, data_len):
+        """
+        return the extended header (32 bit length) of a package with data_len bytes of data,
+        the data itself is sent separately, e.g. streamed from a file
+        """
+        if data_len > 0xFFFFFFFF:
+            raise ValueError('data to long')
+
+        if type(cmd) is str:
+            cmd = ''.join(''.join(cmd.casefold().split(sep='0x')).split())
+            cmd = int(cmd, 16)
+        elif type(cmd) is not int:
+            raise ValueError('unexpected cmd type')
+
+        buf = bytearray((0x02, 0x01))
+        if cmd_type.casefold() == 'set':
+            buf[0] += 0x01
+
+        if cmd > 0xFF:
+            buf[0] += 0x08
+            buf.extend(cmd.to_bytes(2, 'big'))
+        else:
+            buf.extend(cmd.to_bytes(1, 'big'))
+
+        buf.extend(data_len.to_bytes(4, 'big'))
+        return buf
+
+
+class Frame:
+    """
+    one received package
+
+    package, header and data are memoryviews into the receive buffer of the FrameDecoder,
+    they are valid until the next recv_into/feed call
+    """
+    __slots__ = ('cmd_type', 'cmd', 'error', 'package', 'header', 'data')
+
+    def __init__(self, cmd_type, cmd, error, package, header, data):
+        self.cmd_type = cmd_type
+        self.cmd = cmd
+        self.error = error
+        self.package = package
+        self.header = header
+        self.data = data
+
+    def get_error(self):
+        if self.error is None:
+            return None
+        return Parser.error_dict.get(self.data.hex().upper(), 'unknown')
+
+
+class FrameDecoder:
+    """
+    incremental package decoder
+
+    received bytes are written directly into a preallocated buffer (recv_into),
+    the header of the next package is parsed once and complete packages are
+    returned as memoryviews without copying
+    """
+    chunk_size = 0x4000
+
+    def __init__(self, size: int = 0x10000):
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+        self.start = 0  # first byte of the next package
+        self.end = 0  # end of the received bytes
+        self._hdr = None  # header of the package at start
+        self.data_pending = 0  # data bytes of the package opened with open_package not yet read
+
+    def __len__(self):
+        return self.end - self.start
+
+    def reset(self):
+        self.start = 0
+        self.end = 0
+        self._hdr = None
+        self.data_pending = 0
+
+    def reserve(self, size: int):
+        """
+        make room for size bytes behind the received bytes
+        """
+        if len(self.buffer) - self.end >= size:
+            return
+
+        # a bytearray with exported memoryviews can not be resized, move the pending bytes to a new one
+        pending = self.end - self.start
+        capacity = len(self.buffer)
+        if pending + size > capacity:
+            capacity = max(capacity * 2, pending + size)
+        buffer = bytearray(capacity)
+        buffer[:pending] = self._view[self.start:self.end]
+        self.buffer = buffer
+        self._view = memoryview(buffer)
+        self.start = 0
+        self.end = pending
+        self._hdr = None  # absolute positions changed
+
+    def _missing(self):
+        if self._hdr is None:
+            return self.chunk_size
+        return max(self.chunk_size, self._hdr[3] - self.end)
+
+    def recv_into(self, sock) -> int:
+        """
+        receive from sock into the buffer, return the number of received bytes
+        """
+        self.reserve(self._missing())
+        n = sock.recv_into(self._view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data) -> int:
+        self.reserve(len(data))
+        self.buffer[self.end:self.end + len(data)] = data
+        self.end += len(data)
+        return len(data)
+
+    def next_frame(self):
+        """
+        return the next complete package as Frame or None
+        """
+        if self._hdr is None:
+            if self.end - self.start < 2:
+                return None
+            self._hdr = header_info(self.buffer, self.start, self.end)
+            if self._hdr is None:
+                return None
+
+        cmd_type, cmd, data_start, data_end, error = self._hdr
+        if self.end < data_end:
+            return None
+
+        view = self._view
+        frame = Frame(cmd_type, bytes(cmd), error, view[self.start:data_end], view[self.start:data_start],
+                      view[data_start:data_end])
+        self._hdr = None
+        if data_end == self.end:
+            # everything consumed, reuse the buffer from the beginning
+            self.start = 0
+            self.end = 0
+        else:
+            self.start = data_end
+        return frame
+
+    def open_package(self):
+        """
+        read the next package in pieces: return cmd_type, cmd, error, data length as soon as the header
+        is received or None, the data follows with read_data
+        """
+        if self._hdr is None:
+            if self.end - self.start < 2:
+                return None
+            self._hdr = header_info(self.buffer, self.start, self.end)
+            if self._hdr is None:
+                return None
+
+        cmd_type, cmd, data_start, data_end, error = self._hdr
+        self._hdr = None
+        self.start = data_start
+        self.data_pending = data_end - data_start
+        return cmd_type, bytes(cmd), error, self.data_pending
+
+    def read_data(self) -> bytes:
+        """
+        return the received data of the opened package, b'' when nothing new is received
+        """
+        n = min(self.data_pending, self.end - self.start)
+        data = bytes(self._view[self.start:self.start + n])
+        self.data_pending -= n
+        self.start += n
+        if self.start == self.end:
+            self.start = 0
+            self.end = 0
+        return data
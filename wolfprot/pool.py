@@ -0,0 +1,132 @@
+import contextlib
+import hashlib
+import threading
+import time
+
+from wolfprot import connection
+from wolfprot import cynap
+from wolfprot import wolfdoc
+
+
+class ConnectionPool:
+    """
+    logged in Cynap connections keyed by (host, port, access level, hash of password and pin)
+
+    idle connections are health checked before they are handed out again
+    and closed after idle_timeout seconds
+    """
+
+    def __init__(self, max_idle: int = 4, idle_timeout: float = 300, doc: wolfdoc.Wolfdoc = None):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.doc = doc
+        self._idle = dict()  # key -> list of (last used, Cynap)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(host: str, use_ssl: bool = True, port: int = None, access_level: str = 'Admin', pw: str = 'Password',
+            pin: str = ''):
+        # a session is only handed out again with the credentials it was logged in with
+        if port is None and not connection.Websocket.is_websocket_url(host):
+            port = connection.Socket.ports['ssl'] if use_ssl else connection.Socket.ports['no_ssl']
+        credentials = hashlib.sha256(f'{access_level}\0{pw}\0{pin}'.encode('utf-8')).hexdigest()
+        return host, port, access_level, credentials
+
+    def _pop_idle(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()[1]
+        return None
+
+    def acquire(self, host: str, use_ssl: bool = True, pw: str = 'Password', access_level: str = 'Admin',
+                pin: str = '', port: int = None, doc: wolfdoc.Wolfdoc = None) -> cynap.Cynap:
+        """
+        return a logged in Cynap, give it back with release
+        """
+        if doc is None and self.doc is None:
+            raise ValueError('a wolfprot document is needed for the login (doc of the pool or of acquire)')
+        self.evict_idle()
+        key = self.key(host, use_ssl, port, access_level, pw, pin)
+
+        cb = self._pop_idle(key)
+        while cb is not None:
+            if cb.is_alive():
+                return cb
+            cb.disconnect()
+            cb = self._pop_idle(key)
+
+        cb = cynap.Cynap(host, use_ssl, None, pw, access_level, pin, doc if doc else self.doc, port)
+        if cb.connect() is False:
+            raise ConnectionError(f'No connection to Host {host}')
+        cb.reconnect = True
+        return cb
+
+    def release(self, cb: cynap.Cynap, discard: bool = False):
+        if discard or cb.connection is None:
+            cb.disconnect()
+            return
+
+        key = self.key(cb.host, cb.ssl, cb.port, cb.access_level, cb.pw, cb.pin)
+        with self._lock:
+            idle = self._idle.setdefault(key, list())
+            if len(idle) < self.max_idle:
+                idle.append((time.monotonic(), cb))
+                cb = None
+        if cb is not None:
+            cb.disconnect()
+
+    def evict_idle(self):
+        """
+        close connections which are idle longer than idle_timeout
+        """
+        limit = time.monotonic() - self.idle_timeout
+        evicted = list()
+        with self._lock:
+            for key in list(self._idle):
+                idle = self._idle[key]
+                evicted.extend(cb for last_used, cb in idle if last_used < limit)
+                idle[:] = [(last_used, cb) for last_used, cb in idle if last_used >= limit]
+                if len(idle) == 0:
+                    self._idle.pop(key)
+        for cb in evicted:
+            cb.disconnect()
+
+    def clear(self):
+        with self._lock:
+            idle = [cb for key in self._idle for last_used, cb in self._idle[key]]
+            self._idle.clear()
+        for cb in idle:
+            cb.disconnect()
+
+    @contextlib.contextmanager
+    def borrow(self, host: str, use_ssl: bool = True, pw: str = 'Password', access_level: str = 'Admin',
+               pin: str = '', port: int = None, doc: wolfdoc.Wolfdoc = None):
+        """
+        borrow a logged in Cynap:
+
+        with pool.borrow(host) as cb:
+            cb.send_package('Device', 'Boxname')
+        """
+        cb = self.acquire(host, use_ssl, pw, access_level, pin, port, doc)
+        try:
+            yield cb
+        except BaseException as err:
+            # broken or interrupted transfers leave the connection out of sync
+            broken = not isinstance(err, Exception) or (isinstance(err, (ConnectionError, TimeoutError)) and
+                                                        not isinstance(err, connection.DeviceError))
+            self.release(cb, broken)
+            raise
+        self.release(cb)
+
+
+# process wide pool
+pool = ConnectionPool()
+
+
+def borrow(host: str, use_ssl: bool = True, pw: str = 'Password', access_level: str = 'Admin', pin: str = '',
+           port: int = None, doc: wolfdoc.Wolfdoc = None):
+    """
+    borrow a connection of the process wide pool, see ConnectionPool.borrow
+    """
+    return pool.borrow(host, use_ssl, pw, access_level, pin, port, doc)
@@ -0,0 +1,396 @@
+import mmap
+import os
+import struct
+
+from wolfprot import codec
+from wolfprot import wolfdoc
+
+NONE = 0xFFFFFFFF  # no string / no command code
+
+# header: magic, version, size and modification time of the wolfprot file, (offset, count) per table
+header_struct = struct.Struct('<4sIQQ18I')
+MAGIC = b'WPSC'
+VERSION = 2
+STR_OFF, STR_BLOB, ELEM, CMD, NAME, VAR, FIELD, VALUE, ELEM_NAME = range(9)
+tables = 9
+
+# direction, code, command, section, name, userlevel, commandLength, first variation, variations
+elem_struct = struct.Struct('<B3xIIIIIIII')
+# element row
+index_struct = struct.Struct('<I')
+# request: parameterLengthLength, first field, fields - reply: the same
+var_struct = struct.Struct('<B3xIIB3xII')
+# comment, length, parameterID, value, first value, values
+field_struct = struct.Struct('<IIIIII')
+# value, comment
+value_struct = struct.Struct('<II')
+
+
+def schema_file(file) -> str:
+    return f'{file}.schema'
+
+
+def build(doc: wolfdoc.Wolfdoc, file: str = None) -> str:
+    """
+    write the compiled schema of doc, default next to the wolfprot file (see schema_file)
+
+    the parameterlist is stored as direction Schema.param_direction with one element per entry:
+    name, idx (as command code) and one variation holding the entry as request field
+    return the file name
+    """
+    if file is None:
+        file = schema_file(doc.file)
+
+    strings = dict()
+
+    def s(value):
+        if value is None:
+            return NONE
+        return strings.setdefault(str(value), len(strings))
+
+    elements = bytearray()
+    variations = bytearray()
+    fields = bytearray()
+    values = bytearray()
+    keys = list()  # (direction, code, section, name, row)
+
+    def add_fields(params):
+        first = len(fields) // field_struct.size
+        for p in params:
+            first_value = len(values) // value_struct.size
+            for v in p.get('values', list()):
+                values.extend(value_struct.pack(s(v.get('value')), s(v.get('comment'))))
+            fields.extend(field_struct.pack(s(p.get('comment')), p.get('length', 0), p.get('parameterID') or 0,
+                                            s(p.get('value')), first_value,
+                                            len(values) // value_struct.size - first_value))
+        return first, len(params)
+
+    def add_element(direction, code, section, name, element, variants):
+        first = len(variations) // var_struct.size
+        for request, reply in variants:
+            req = add_fields(request['parameters'])
+            rep = add_fields(reply['parameters'])
+            variations.extend(var_struct.pack(request['parameterLengthLength'], *req,
+                                              reply['parameterLengthLength'], *rep))
+        row = len(elements) // elem_struct.size
+        elements.extend(elem_struct.pack(direction, code, s(element.get('command')), s(section), s(name),
+                                         s(element.get('userlevel')), element.get('commandLength', 0), first,
+                                         len(variants)))
+        keys.append((direction, code, section.encode('utf-8'), name.encode('utf-8'), row))
+
+    for direction, direction_name in enumerate(Schema.direction_types):
+        for section, sub in doc.root[direction_name]['categories'].items():
+            for name, element in sub.items():
+                try:
+                    code = int(element['command'], 16)
+                except ValueError:
+                    code = NONE
+                add_element(direction, code, section, name, element,
+                            [(i['request'], i['reply']) for i in element['variations']])
+
+    for param in doc.param_list:
+        entry = dict(param)
+        entry['comment'] = param['name']
+        # entries added with Wolfdoc.add_template_parameter have no idx
+        idx = param.get('idx')
+        add_element(Schema.param_direction, NONE if idx is None else idx, '', param['name'], param,
+                    [({'parameterLengthLength': 0, 'parameters': [entry]}, {'parameterLengthLength': 0,
+                                                                           'parameters': []})])
+
+    # first element in document order wins for duplicated commands
+    cmd_rows = [k[4] for k in sorted(keys, key=lambda k: (k[0], k[1], k[4]))]
+    name_rows = [k[4] for k in sorted(keys, key=lambda k: (k[0], k[2], k[3], k[4]))]
+    # elements and parameter list entries by name only, in document order per name
+    elem_name_rows = [k[4] for k in sorted(keys, key=lambda k: (k[0], k[3], k[4]))]
+
+    blob = bytearray()
+    offsets = bytearray()
+    for i in strings:
+        offsets.extend(index_struct.pack(len(blob)))
+        blob.extend(i.encode('utf-8'))
+    offsets.extend(index_struct.pack(len(blob)))
+
+    body = [(offsets, len(strings)), (blob, len(blob)), (elements, len(keys)),
+            (b''.join(index_struct.pack(i) for i in cmd_rows), len(cmd_rows)),
+            (b''.join(index_struct.pack(i) for i in name_rows), len(name_rows)),
+            (variations, len(variations) // var_struct.size), (fields, len(fields) // field_struct.size),
+            (values, len(values) // value_struct.size),
+            (b''.join(index_struct.pack(i) for i in elem_name_rows), len(elem_name_rows))]
+
+    table_info = list()
+    pos = header_struct.size
+    for data, count in body:
+        pos += -pos % 8
+        table_info.extend((pos, count))
+        pos += len(data)
+
+    st = os.stat(doc.file)
+    tmp = f'{file}.{os.getpid()}'
+    with open(tmp, 'wb') as fp:
+        fp.write(header_struct.pack(MAGIC, VERSION, st.st_size, st.st_mtime_ns, *table_info))
+        for data, count in body:
+            fp.write(bytes(-fp.tell() % 8))
+            fp.write(data)
+    os.replace(tmp, file)
+    return file
+
+
+class Schema(codec.DocumentCodec):
+    """
+    read only wolfprot document from a compiled schema file (see build)
+
+    the file is memory mapped: processes loading the same schema share its pages,
+    elements and parameters are built on access, the compiled encoders and decoders are cached per process
+    lookup, encode and decode methods match the ones of wolfdoc.Wolfdoc
+    """
+    direction_types = wolfdoc.Wolfdoc.direction_types
+    param_direction = len(direction_types)
+
+    def __init__(self, file: str):
+        self.file = file
+        with open(file, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = header_struct.unpack_from(self.mm)
+        if header[0] != MAGIC or header[1] != VERSION:
+            self.mm.close()
+            raise ValueError(f'{file}: no wolfprot schema of version {VERSION}')
+        self.source_key = header[2:4]
+        info = header[4:]
+        self._tables = [(info[2 * i], info[2 * i + 1]) for i in range(tables)]
+        self._blob = self._tables[STR_BLOB][0]
+        self._encoders = dict()
+        self._decoders = dict()
+        self._cmd_decoders = dict()  # (direction, command code, variant) -> decoder
+
+    def __reduce__(self):
+        # workers map the file themselves
+        return self.__class__, (self.file,)
+
+    def close(self):
+        self.mm.close()
+
+    def _row(self, table, st, row):
+        return st.unpack_from(self.mm, self._tables[table][0] + row * st.size)
+
+    def _string_bytes(self, idx):
+        start, end = struct.unpack_from('<II', self.mm, self._tables[STR_OFF][0] + idx * 4)
+        return self.mm[self._blob + start:self._blob + end]
+
+    def _string(self, idx):
+        if idx == NONE:
+            return None
+        return self._string_bytes(idx).decode('utf-8')
+
+    def _direction(self, direction):
+        if direction not in self.direction_types:
+            raise KeyError(f'{direction} - expect {self.direction_types}')
+        return self.direction_types.index(direction)
+
+    def _values(self, first, count):
+        values = list()
+        for i in range(first, first + count):
+            value, comment = self._row(VALUE, value_struct, i)
+            values.append({'value': self._string(value), 'comment': self._string(comment)})
+        return values
+
+    def _fields(self, first, count):
+        params = list()
+        for i in range(first, first + count):
+            comment, length, param_id, value, value_first, value_count = self._row(FIELD, field_struct, i)
+            param = {'value': self._string(value), 'length': length,
+                     'values': self._values(value_first, value_count)}
+            if comment != NONE:
+                param['comment'] = self._string(comment)
+            if param_id:
+                param['parameterID'] = param_id
+            params.append(param)
+        return params
+
+    def _variation(self, row):
+        req_len_len, req_first, req_count, rep_len_len, rep_first, rep_count = self._row(VAR, var_struct, row)
+        return {'request': {'parameterLengthLength': req_len_len, 'parameters': self._fields(req_first, req_count)},
+                'reply': {'parameterLengthLength': rep_len_len, 'parameters': self._fields(rep_first, rep_count)}}
+
+    def _element(self, row, attr=None):
+        """
+        return section, name, element dict
+        """
+        direction, code, command, section, name, userlevel, cmd_len, var_first, var_count = \
+            self._row(ELEM, elem_struct, row)
+        element = {'command': self._string(command), 'userlevel': self._string(userlevel), 'commandLength': cmd_len}
+        if attr is None or 'variations' in attr:
+            element['variations'] = [self._variation(i) for i in range(var_first, var_first + var_count)]
+        if attr is not None:
+            element = {key: element[key] for key in element if key in attr}
+        return self._string(section), self._string(name), element
+
+    def _index_row(self, table, pos):
+        return index_struct.unpack_from(self.mm, self._tables[table][0] + pos * 4)[0]
+
+    def _lower_bound(self, table, key, key_fn):
+        """
+        return the first position in the sorted index table with key_fn(row) >= key
+        """
+        lo, hi = 0, self._tables[table][1]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key_fn(self._index_row(table, mid)) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _search(self, table, key, key_fn):
+        """
+        return the first row of the sorted index table with key_fn(row) >= key
+        """
+        pos = self._lower_bound(table, key, key_fn)
+        if pos == self._tables[table][1]:
+            return None
+        return self._index_row(table, pos)
+
+    def _cmd_key(self, row):
+        return self._row(ELEM, elem_struct, row)[:2]
+
+    def _name_key(self, row):
+        direction, code, command, section, name = self._row(ELEM, elem_struct, row)[:5]
+        return direction, self._string_bytes(section), self._string_bytes(name)
+
+    def _elem_name_key(self, row):
+        direction, code, command, section, name = self._row(ELEM, elem_struct, row)[:5]
+        return direction, self._string_bytes(name)
+
+    def _find_cmd(self, direction: int, code: int):
+        row = self._search(CMD, (direction, code), self._cmd_key)
+        if row is None or self._cmd_key(row) != (direction, code):
+            return None
+        return row
+
+    def _find_name(self, direction: int, section: str, name: str):
+        key = (direction, section.encode('utf-8'), name.encode('utf-8'))
+        row = self._search(NAME, key, self._name_key)
+        if row is None or self._name_key(row) != key:
+            return None
+        return row
+
+    def _find_names(self, direction: int, name: str):
+        """
+        yield the rows of the elements with name in document order
+        """
+        key = (direction, name.encode('utf-8'))
+        pos = self._lower_bound(ELEM_NAME, key, self._elem_name_key)
+        while pos < self._tables[ELEM_NAME][1]:
+            row = self._index_row(ELEM_NAME, pos)
+            if self._elem_name_key(row) != key:
+                return
+            yield row
+            pos += 1
+
+    def _rows(self, direction: int):
+        for row in range(self._tables[ELEM][1]):
+            if self._row(ELEM, elem_struct, row)[0] == direction:
+                yield row
+
+    def get_element_by_cmd(self, direction, cmd, attr=None) -> dict:
+        try:
+            code = int(cmd, 16)
+        except ValueError:
+            return None
+        row = self._find_cmd(self._direction(direction), code)
+        if row is None:
+            return None
+
+        if attr is not None:
+            attr = set(attr) | {'command'}
+        section, name, element = self._element(row, attr)
+        return {section: {name: element}}
+
+    def get_elements(self, direction, section=None, attr=None):
+        result = dict()
+        for row in self._rows(self._direction(direction)):
+            sec, name, element = self._element(row, attr)
+            if section is None or sec == section:
+                result.setdefault(sec, dict())[name] = element
+        if section is not None and section not in result:
+            raise KeyError(section)
+        return result
+
+    def get_element_by_name(self, direction, section, name, attr=None):
+        if name is None:
+            return self.get_elements(direction, section, attr)
+
+        d = self._direction(direction)
+        if section is None:
+            result = dict()
+            for row in self._find_names(d, name):
+                sec, n, element = self._element(row, attr)
+                result[sec] = {n: element}
+            return result if len(result) else None
+
+        row = self._find_name(d, section, name)
+        if row is None:
+            return None
+        return {section: {name: self._element(row, attr)[2]}}
+
+    def get_param_list(self, value=None):
+        if type(value) is int:
+            row = self._find_cmd(self.param_direction, value)
+        elif isinstance(value, str):
+            row = next(self._find_names(self.param_direction, value), None)
+        else:
+            row = None
+        if row is None:
+            return None
+
+        direction, idx, command, section, name, userlevel, cmd_len, var_first, var_count = \
+            self._row(ELEM, elem_struct, row)
+        entry = self._variation(var_first)['request']['parameters'][0]
+        if idx != NONE:
+            entry['idx'] = idx
+        entry['name'] = entry['comment']
+        return entry
+
+    def get_window_types(self):
+        return self.get_param_list('Window type')
+
+    def _variation_of(self, section, name, variant, direction):
+        row = self._find_name(self._direction(direction), section, name)
+        if row is None:
+            raise KeyError(f'{direction} {section} {name} not found')
+        elem = self._row(ELEM, elem_struct, row)
+        if elem[8] <= variant:
+            raise ValueError('variant out of range')
+        return self._string(elem[2]), self._variation(elem[7] + variant)
+
+    def generate_get_response(self, raw_package: bytearray, variant: int = 0):
+        direction = raw_package['type']
+        code = int.from_bytes(raw_package['cmd'], 'big')
+        key = (direction, code, variant)
+        decoder = self._cmd_decoders.get(key)
+        if decoder is None:
+            row = self._find_cmd(self._direction(direction), code)
+            if row is None:
+                return None
+            elem = self._row(ELEM, elem_struct, row)
+            decoder = self._cmd_decoders[key] = self.compile_reply(self._string(elem[3]), self._string(elem[4]),
+                                                                   variant, direction)
+        return decoder.decode(raw_package['data'])
+
+
+def load(doc_file: str) -> Schema:
+    """
+    return the schema of a wolfprot file, compile it when it is missing or older than the file
+    """
+    file = schema_file(doc_file)
+    st = os.stat(doc_file)
+    try:
+        schema = Schema(file)
+        if schema.source_key == (st.st_size, st.st_mtime_ns):
+            return schema
+        schema.close()
+    except (OSError, ValueError, struct.error):
+        pass
+
+    build(wolfdoc.Wolfdoc(doc_file), file)
+    return Schema(file)
@@ -0,0 +1,322 @@
+import argparse
+import asyncio
+import random
+import ssl
+import threading
+from textwrap import dedent
+
+from wolfprot import parser
+from wolfprot import wolfdoc
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+
+class Simulator:
+    """
+    local wolfprot device for tests and benchmarks
+
+    requests are answered from the reply parameters of the wolfprot file:
+    numeric parameters are 0, strings have reply_size bytes (and the length parameter before them is set)
+    replies: dict cmd (hex) -> reply data, overrides the generated replies
+    errors: dict cmd (hex) -> error of parser.Parser.error_dict, always answered with this error
+    error_rate: part of the requests answered with a random error out of error_codes
+    latency: seconds until a request is answered
+    login_required: answer 'auth required' until the client sent the login (SET CB41)
+    keep_firmware: collect the data of the firmware upload packages (SET CB1F) in firmware,
+    otherwise only their size is counted in firmware_size
+
+    port, tls_port and ws_port: 0 for a free port, None to disable, tls needs certfile (and keyfile)
+    """
+    login_cmd = 'CB41'
+    firmware_cmd = 'CB1F'
+
+    def __init__(self, doc: wolfdoc.Wolfdoc = None, doc_file: str = None, host: str = '127.0.0.1', port: int = 0,
+                 tls_port: int = None, ws_port: int = None, certfile: str = None, keyfile: str = None,
+                 latency: float = 0, reply_size: int = 16, replies: dict = None, errors: dict = None,
+                 error_rate: float = 0, error_codes=('busy', 'fifo full'), seed=None, login_required: bool = False,
+                 keep_firmware: bool = True):
+        if doc is None and doc_file:
+            doc = wolfdoc.Wolfdoc(doc_file)
+        if tls_port is not None and certfile is None:
+            raise ValueError('tls needs a certificate file')
+        for err in list((errors or dict()).values()) + list(error_codes):
+            if err not in parser.Parser.error_dict.values():
+                raise KeyError(f'error {err} unknown: {list(parser.Parser.error_dict.values())}')
+
+        self.doc = doc
+        self.host = host
+        self.ports = {'tcp': port, 'tls': tls_port, 'ws': ws_port}
+        self.certfile = certfile
+        self.keyfile = keyfile
+        self.latency = latency
+        self.reply_size = reply_size
+        self.replies = {cmd.upper(): bytes(data) for cmd, data in (replies or dict()).items()}
+        self.errors = {cmd.upper(): err for cmd, err in (errors or dict()).items()}
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.random = random.Random(seed)
+        self.login_required = login_required
+        self.keep_firmware = keep_firmware
+
+        self.requests = 0
+        self.connections = 0
+        self.logins = 0
+        self.firmware = bytearray()
+        self.firmware_size = 0
+        self._packages = dict()  # (type, cmd) -> reply package
+        self._servers = list()
+        self._tasks = set()  # connection handlers
+        self._loop = None
+        self._thread = None
+
+    def reply_data(self, cmd_type: str, cmd: str):
+        """
+        return the reply data of a request or None for unknown commands
+        """
+        if cmd in self.replies:
+            return self.replies[cmd]
+        if self.doc is None:
+            return None
+
+        element = self.doc.get_element_by_cmd(cmd_type, cmd)
+        if element is None:
+            return None
+        if cmd_type == 'SET':
+            return b''
+
+        section, sub = next(iter(element.items()))
+        reply = sub[next(iter(sub))]['variations'][0]['reply']
+        params = self.doc._resolve_parameters(reply['parameters'])
+        fill = b'x' * self.reply_size
+        data = bytearray()
+        for i, (comment, length) in enumerate(params):
+            if length == 0:
+                data.extend(fill)
+                continue
+            value = 0
+            if i + 1 < len(params) and params[i + 1][1] == 0 and comment.find(params[i + 1][0]) != -1:
+                # length of the following string
+                value = min(self.reply_size, (1 << 8 * length) - 1)
+            data.extend(value.to_bytes(length, 'big'))
+        return data
+
+    def package(self, cmd_type: str, cmd: str, error: str = None):
+        wp = parser.Parser()
+        if error:
+            return wp.generate_package(cmd_type, cmd, None, error=error)
+
+        key = (cmd_type, cmd)
+        if key not in self._packages:
+            data = self.reply_data(cmd_type, cmd)
+            if data is None:
+                return wp.generate_package(cmd_type, cmd, None, error='unknown command')
+            self._packages[key] = wp.generate_package(cmd_type, cmd, data, len(data) > 0xFFFF, len(data) > 0xFF)
+        return self._packages[key]
+
+    async def answer(self, frame, session: dict):
+        """
+        return the reply package of a request frame
+        """
+        self.requests += 1
+        cmd = frame.cmd.hex().upper()
+        if cmd == self.firmware_cmd and frame.cmd_type == 'SET':
+            # the data is a view into the receive buffer
+            self.firmware_size += len(frame.data)
+            if self.keep_firmware:
+                self.firmware.extend(frame.data)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if cmd == self.login_cmd and frame.cmd_type == 'SET':
+            session['login'] = True
+            self.logins += 1
+        elif self.login_required and not session['login']:
+            return self.package(frame.cmd_type, cmd, 'auth required')
+
+        error = self.errors.get(cmd)
+        if error is None and self.error_rate and self.random.random() < self.error_rate:
+            error = self.random.choice(self.error_codes)
+        return self.package(frame.cmd_type, cmd, error)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        self._tasks.add(asyncio.current_task())
+        session = {'login': False}
+        dec = parser.FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(0x10000)
+                if not data:
+                    break
+                dec.feed(data)
+                frame = dec.next_frame()
+                while frame is not None:
+                    writer.write(await self.answer(frame, session))
+                    frame = dec.next_frame()
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._tasks.discard(asyncio.current_task())
+            writer.close()
+
+    async def handle_ws(self, ws, path=None):
+        self.connections += 1
+        self._tasks.add(asyncio.current_task())
+        session = {'login': False}
+        dec = parser.FrameDecoder()
+        try:
+            async for data in ws:
+                if type(data) == str:
+                    data = bytes.fromhex(data)
+                dec.feed(data)
+                frame = dec.next_frame()
+                while frame is not None:
+                    await ws.send(bytes(await self.answer(frame, session)))
+                    frame = dec.next_frame()
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._tasks.discard(asyncio.current_task())
+
+    def ssl_context(self):
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self.certfile, self.keyfile)
+        return context
+
+    async def start(self):
+        """
+        start listening, self.ports holds the bound ports
+        """
+        if self.ports['tcp'] is not None:
+            server = await asyncio.start_server(self.handle, self.host, self.ports['tcp'])
+            self.ports['tcp'] = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+
+        if self.ports['tls'] is not None:
+            server = await asyncio.start_server(self.handle, self.host, self.ports['tls'], ssl=self.ssl_context())
+            self.ports['tls'] = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+
+        if self.ports['ws'] is not None:
+            if websockets is None:
+                raise ImportError('websockets package needed for the websocket port')
+            context = self.ssl_context() if self.certfile else None
+            server = await websockets.serve(self.handle_ws, self.host, self.ports['ws'], ssl=context)
+            self.ports['ws'] = server.sockets[0].getsockname()[1]
+            self._servers.append(server)
+
+    async def close_connections(self):
+        """
+        close the client connections, the ports stay open
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # the transports close with the next loop iteration
+        await asyncio.sleep(0)
+
+    async def stop(self):
+        for server in self._servers:
+            server.close()
+        await self.close_connections()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = list()
+
+    def start_thread(self):
+        """
+        run the simulator in a background thread, return when the ports are bound
+        """
+        started = threading.Event()
+        error = list()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            try:
+                self._loop.run_until_complete(self.start())
+            except Exception as err:
+                error.append(err)
+                started.set()
+                return
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self.stop())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        if error:
+            raise error[0]
+        return self
+
+    def close_connections_thread(self):
+        """
+        close_connections of a simulator started with start_thread
+        """
+        asyncio.run_coroutine_threadsafe(self.close_connections(), self._loop).result()
+
+    def stop_thread(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start_thread()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop_thread()
+
+
+def main():
+    """Run a simulated device
+    """
+    description = """Simulated wolfprot device answering from a wolfprot.json file
+    """
+    parser_ = argparse.ArgumentParser(description=dedent(description))
+    parser_.add_argument('-f', action='store', dest='wp_file', required=True, help='wolfprot.json file location')
+    parser_.add_argument('--host', action='store', dest='host', default='127.0.0.1', help='listen address')
+    parser_.add_argument('--port', action='store', dest='port', type=int, default=50915, help='tcp port')
+    parser_.add_argument('--tls-port', action='store', dest='tls_port', type=int, help='tls port, needs --cert')
+    parser_.add_argument('--ws-port', action='store', dest='ws_port', type=int, help='websocket port')
+    parser_.add_argument('--cert', action='store', dest='certfile', help='certificate (pem)')
+    parser_.add_argument('--key', action='store', dest='keyfile', help='private key (pem)')
+    parser_.add_argument('--latency', action='store', dest='latency', type=float, default=0,
+                         help='seconds per request')
+    parser_.add_argument('--reply-size', action='store', dest='reply_size', type=int, default=16,
+                         help='bytes per string in the replies')
+    parser_.add_argument('--error-rate', action='store', dest='error_rate', type=float, default=0,
+                         help='part of the requests answered with an error')
+    parser_.add_argument('--error-codes', action='store', dest='error_codes', default='busy,fifo full',
+                         help='comma separated errors for --error-rate e.g. "busy,fifo full,auth required"')
+    parser_.add_argument('--seed', action='store', dest='seed', type=int, help='random seed of the errors')
+    parser_.add_argument('--login-required', action='store_true', dest='login_required',
+                         help='answer auth required until login')
+    args = parser_.parse_args()
+
+    sim = Simulator(doc_file=args.wp_file, host=args.host, port=args.port, tls_port=args.tls_port,
+                    ws_port=args.ws_port, certfile=args.certfile, keyfile=args.keyfile, latency=args.latency,
+                    reply_size=args.reply_size, error_rate=args.error_rate,
+                    error_codes=[i.strip() for i in args.error_codes.split(',')], seed=args.seed,
+                    login_required=args.login_required)
+
+    async def run():
+        await sim.start()
+        print(f'listening: {sim.ports}')
+        await asyncio.Event().wait()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
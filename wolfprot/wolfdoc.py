@@ -1,204 +1,274 @@
+import collections.abc
+import gc
 import json
+import mmap
+import os
+import pickle
+import struct
 import time
 from wolfprot import parser as wp_parser
+from wolfprot import codec
+
+
+class LazyCategories(collections.abc.MutableMapping):
+    """
+    section -> elements of one direction, the elements of a section are unpickled from the cache on first access
+    """
+
+    def __init__(self, data, start: int, sections: dict):
+        self._data = data
+        self._start = start
+        self._pending = sections  # section -> (offset, length) in data
+        self._sections = dict.fromkeys(sections)
+
+    def _load(self, section):
+        offset, length = self._pending.pop(section)
+        start = self._start + offset
+        # the elements are many small containers, collecting while they are created only costs time
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            elements = self._sections[section] = pickle.loads(self._data[start:start + length])
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return elements
+
+    def __getitem__(self, section):
+        if section in self._pending:
+            return self._load(section)
+        return self._sections[section]
+
+    def __setitem__(self, section, elements):
+        self._pending.pop(section, None)
+        self._sections[section] = elements
+
+    def __delitem__(self, section):
+        self._pending.pop(section, None)
+        del self._sections[section]
+
+    def __iter__(self):
+        return iter(self._sections)
 
+    def __len__(self):
+        return len(self._sections)
 
-class Wolfdoc():
+    def loaded(self) -> list:
+        return [i for i in self._sections if i not in self._pending]
+
+    def load_all(self) -> dict:
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for section in list(self._pending):
+                self._load(section)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return self._sections
+
+
+class Wolfdoc(codec.DocumentCodec):
     main_parameters = ['publicName', 'timestamp', 'commandLength', 'command', 'userlevel', 'variations']
     package_types = ['request', 'reply']
     direction_types = ['GET', 'SET']
     edit_actions = ['rename', 'add', 'remove']
 
-    def __init__(self, file):
+    # bump when the cached data changes
+    cache_version = 3
+    # version, size and modification time of the file, checked before anything is unpickled
+    cache_header = struct.Struct('<IQQ')
+
+    def __init__(self, file, cache: bool = False, lazy: bool = False):
+        """
+        cache: keep the parsed file and the indexes in a pickle next to the file (see cache_file),
+        it is rebuilt when the size or modification time of the file changes,
+        only enable it for directories no one else can write to, loading the pickle runs its code
+        lazy: load the elements of a category from the cache when they are accessed the first time,
+        needs cache=True (a ValueError otherwise), the first load without a valid cache file is a full load
+        """
+        if lazy and not cache:
+            raise ValueError('lazy loading needs the cache')
         self.file = file
         self.element = None
         self.parameter = None
+        self._encoders = dict()
+        self._decoders = dict()
 
-        with open(file) as fp:
-            self.root = json.load(fp)
+        if not (cache and self._load_cache(lazy)):
+            with open(file) as fp:
+                self.root = json.load(fp)
+            self._build_index()
+            if cache:
+                self._save_cache()
 
         self.supported_devices = self.root['devices']
         self.userleves = self.root['userlevels']
         self.param_list = self.root['parameterlist']
+        self._build_param_index()
+
+    @staticmethod
+    def cache_file(file) -> str:
+        return f'{file}.cache'
+
+    def _cache_key(self):
+        st = os.stat(self.file)
+        return self.cache_version, st.st_size, st.st_mtime_ns
+
+    def _load_cache(self, lazy=False) -> bool:
+        """
+        cache file: cache_header, pickle of (root without categories, cmd index, name index,
+        direction -> section -> (offset, length)) followed by one pickle per category
+        """
+        try:
+            with open(self.cache_file(self.file), 'rb') as fp:
+                if fp.read(self.cache_header.size) != self.cache_header.pack(*self._cache_key()):
+                    return False
+                root, cmd_index, name_index, sections = pickle.load(fp)
+                start = fp.tell()
+                data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError):
+            return False
+
+        for direction in self.direction_types:
+            root[direction]['categories'] = LazyCategories(data, start, sections[direction])
+            if not lazy:
+                root[direction]['categories'] = root[direction]['categories'].load_all()
+        if not lazy:
+            data.close()
+
+        self.root = root
+        self._cmd_index = cmd_index
+        self._name_index = name_index
+        return True
+
+    def _save_cache(self):
+        name = self.cache_file(self.file)
+        tmp = f'{name}.{os.getpid()}'
+        root = dict(self.root)
+        blobs = list()
+        sections = dict()
+        pos = 0
+        for direction in self.direction_types:
+            root[direction] = {key: value for key, value in self.root[direction].items() if key != 'categories'}
+            sections[direction] = dict()
+            for section, elements in self.root[direction]['categories'].items():
+                blob = pickle.dumps(elements, pickle.HIGHEST_PROTOCOL)
+                sections[direction][section] = (pos, len(blob))
+                blobs.append(blob)
+                pos += len(blob)
+
+        try:
+            with open(tmp, 'wb') as fp:
+                fp.write(self.cache_header.pack(*self._cache_key()))
+                pickle.dump((root, self._cmd_index, self._name_index, sections), fp, pickle.HIGHEST_PROTOCOL)
+                for blob in blobs:
+                    fp.write(blob)
+            os.replace(tmp, name)
+        except OSError:
+            # read only location, run without cache
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    def _build_index(self):
+        """
+        cmd_index: direction -> command code -> (section, name)
+        name_index: direction -> (section, name) -> command code
+        """
+        self._cmd_index = dict()
+        self._name_index = dict()
+        for direction in self.direction_types:
+            self._index_direction(direction)
+
+    def _index_direction(self, direction):
+        self._invalidate()
+        cmd_index = self._cmd_index[direction] = dict()
+        name_index = self._name_index[direction] = dict()
+        for section, elements in self.root[direction]['categories'].items():
+            for name, element in elements.items():
+                name_index[(section, name)] = element['command']
+                cmd_index.setdefault(element['command'], (section, name))
+
+    def _invalidate(self):
+        self._encoders.clear()
+        self._decoders.clear()
+
+    def _index_add(self, direction, section, name, element):
+        self._invalidate()
+        if (section, name) in self._name_index[direction]:
+            self._index_remove(direction, section, name)
+        self._name_index[direction][(section, name)] = element['command']
+        self._cmd_index[direction].setdefault(element['command'], (section, name))
+
+    def _index_remove(self, direction, section, name):
+        self._invalidate()
+        cmd = self._name_index[direction].pop((section, name), None)
+        if cmd is None or self._cmd_index[direction].get(cmd) != (section, name):
+            return
+        # fall back to the next element with the same command in document order
+        self._cmd_index[direction].pop(cmd)
+        for key, c in self._name_index[direction].items():
+            if c == cmd:
+                self._cmd_index[direction][cmd] = key
+                break
+
+    def _build_param_index(self):
+        """
+        param_idx: idx -> parameter list entry
+        param_name: name -> parameter list entry
+        """
+        self._param_idx = dict()
+        self._param_name = dict()
+        for param in self.param_list:
+            self._param_index_add(param)
+
+    def _param_index_add(self, param):
+        if 'idx' in param:
+            self._param_idx.setdefault(param['idx'], param)
+        self._param_name.setdefault(param['name'], param)
+
+    def _element(self, direction, section, name):
+        return self.root[direction]['categories'][section][name]
+
+    @staticmethod
+    def _element_view(element, attr=None):
+        if attr is None:
+            return element
+        return {key: element[key] for key in element if key in attr}
 
     def dump_json(self, file=None):
         if file is None:
             file = self.file
 
+        root = dict(self.root)
+        for direction in self.direction_types:
+            root[direction] = dict(root[direction])
+            root[direction]['categories'] = dict(root[direction]['categories'].items())
+
         with open(file, 'w', newline='\n') as fp:
-            json.dump(self.root, fp, indent=2)
+            json.dump(root, fp, indent=2)
 
     def get_window_types(self):
         return self.get_param_list('Window type')
 
-    def generate_get_request(self, section: str, name: str, variant: int = 0, req_param=None, direction: str = 'GET'):
-        c = self.get_element_by_name(direction, section, name, {'command', 'variations'})
-        cmd = c[section][name]['command']
-        var = c[section][name]['variations']
-
-        if len(var) <= variant:
+    def _variation_of(self, section, name, variant, direction):
+        c = self.get_element_by_name(direction, section, name)
+        if c is None:
+            raise KeyError(f'{direction} {section} {name} not found')
+        element = c[section][name]
+        if len(element['variations']) <= variant:
             raise ValueError('variant out of range')
-
-        i = var[variant]
-        ext_len = None
-        ext_hdr = None
-        req = i['request']
-        paramlenlen = req['parameterLengthLength']
-        if paramlenlen == 2:
-            ext_len = 1
-        elif paramlenlen == 4:
-            ext_hdr = 1
-
-        param = req['parameters']
-        if len(param) == 0:
-            data = None
-        else:
-            data = bytes()
-            for i in param:
-                val = None
-                param_id = i.get('parameterID', None)
-                if param_id:
-                    i = self.get_param_list(param_id)
-                param_len = i['length']
-                comment = i['comment']
-                try:
-                    value = req_param[comment]
-                except KeyError:
-                    print(req_param)
-                    print(param)
-                    raise
-
-                if type(value) == int:
-                    if param_len == 2:
-                        val = bytes.fromhex('{:04x}'.format(value))
-                    elif param_len == 1:
-                        val = bytes.fromhex('{:02x}'.format(value))
-                    elif param_len == 4:
-                        val = bytes.fromhex('{:08x}'.format(value))
-                    elif param_len == 0:
-                        val = bytes(str(value).encode('utf-8'))
-                elif type(value) == str:
-                    val = bytes(value.encode('utf-8'))
-                #                    if len(value) < 0xFF:
-                #                         val_len = bytes.fromhex('{:02x}'.format(len(value)))
-                #                    else:
-                #                         val_len = bytes.fromhex('{:04x}'.format(len(value)))
-                elif type(value) == bytes:
-                    val = value
-                else:
-                    val = None
-                if val:
-                    data += val
-        p = wp_parser.Parser()
-        return p.generate_package(direction, cmd, data, ext_hdr, ext_len)
+        return element['command'], element['variations'][variant]
 
     def generate_get_response(self, raw_package: bytearray, variant: int = 0):
-        c = self.get_element_by_cmd(raw_package['type'], raw_package['cmd'].hex().upper())
-        if c is None:
+        entry = self._cmd_index[raw_package['type']].get(raw_package['cmd'].hex().upper())
+        if entry is None:
             return None
 
-        res = [(i, j, c[i][j]) for i in c for j in c[i]]
-        category = res[0][0]
-        sub = res[0][1]
-        c = res[0][2]
-
-        var = c['variations']
-        cmd = c['command']
-
-        raw = raw_package['data']
-        pkg = list()
-#        print(f'resp raw: {raw}')
-        blk_len_check = None
-        optional_param = None
-
-        if len(var) <= variant:
-            raise ValueError('variant out of range')
-
-        req = var[variant]['reply']
-        param = req['parameters']
-
-        if len(param) != 0:
-            start = 0
-            end = 0
-
-            rm_param = list()
-            data_common = dict()
-            if cmd == 'CBBA':  # Window 2 command
-                f = ('Window reference width', 'Window reference height')
-                rm_param = [i for i in param if i['comment'] in f]
-#                print(raw[start:])
-            elif cmd == 'CB90':  # Content Sources
-                f = ('Number of sources')
-                rm_param = [i for i in param if i['comment'] in f]
-                blk_len_check = ('Source block length')
-                optional_param = ('Type specific source block')
-#                print(raw[start:].hex())
-
-            for i in rm_param:
-                param_len = i['length']
-                comment = i['comment']
-                if param_len:
-                    end = start + param_len
-                    data_common[comment] = int(raw[start:end].hex(), 16)
-#                    print(f'{comment}: {data_common[comment]}')
-                    prev_val = data_common[comment]
-                    start = end
-
-            if len(data_common):
-                pkg.append(data_common)
-
-            # I expect it is a repeating block when the raw package
-            # size is not finish after first iteration over the parameters
-            while end < len(raw):
-#                print(f'end: {end}, rawlen: {len(raw)}')
-                prev = None
-                data = dict()
-                blk_len = 0
-                for i in param:
-                    if i in rm_param:
-                        continue
-                    if start >= len(raw):
-                        # add string value when previous value was the length value with data value zero
-                        if prev and prev['comment'].find(comment) != -1 and prev_val == 0:
-                            comment = i['comment']
-                            data[comment] = bytearray()
-                        break
-                    param_id = i.get('parameterID', None)
-                    if param_id:
-                        i = self.get_param_list(param_id)
-                    param_len = i['length']
-                    comment = i['comment']
-                    if param_len:
-                        end = start + param_len
-                        data[comment] = int(raw[start:end].hex(), 16)
-                        prev_val = data[comment]
-#                        print(f'1:{comment}: {prev_val} len: {param_len}')
-                        if blk_len_check and comment in blk_len_check:
-                            blk_len = 0
-                    else:
-                        # str_len + str
-                        if prev and prev['comment'].find(comment) != -1:
-                            # prev_val = string length
-                            end = start + prev_val
-#                            print(f'start: {start}, end: {end}')
-                            data[comment] = raw[start:end]
-#                            print(f'prev: {prev["comment"]}: {prev_val}')
-#                            print(f'2:{comment}: {data[comment]} len: {param_len}')
-                        else:
-                            if optional_param and optional_param == comment:
-                                end += (data[blk_len_check] - blk_len + 1)
-                                data[comment] = raw[start:end]
-#                                print(f' start {start} end: {end}')
-                            else:
-                                data[comment] = raw
-#                                print(f'3:{comment}: {data[comment]} len: {param_len}')
-                                end = len(raw)
-                    prev = i
-                    blk_len += end - start
-                    start = end
-#                    print(data)
-                pkg.append(data)
-        return category, sub, pkg
+        decoder = self.compile_reply(entry[0], entry[1], variant, raw_package['type'])
+        return decoder.decode(raw_package['data'])
 
     def supported_device_idx_list(self, device_names: list):
         dev_list = list()
@@ -218,12 +288,13 @@ class Wolfdoc():
         if self.parameter is None:
             raise GeneratorExit('no template parameter generated')
 
-        for param in self.param_list:
-            if param['name'] == self.parameter['name']:
-                raise IndexError(f'{self.parameter["name"]} already exists')
+        if self.parameter['name'] in self._param_name:
+            raise IndexError(f'{self.parameter["name"]} already exists')
 
         self.param_list.append(self.parameter)
+        self._param_index_add(self.parameter)
         self.parameter = None
+        self._invalidate()
 
     def add_value_to_template_parameter(self, comment: str, value: str, pub_comment: str = '', sup_dev=None):
         dev_list = self.supported_device_idx_list(sup_dev)
@@ -292,6 +363,7 @@ class Wolfdoc():
 
         if action == 'remove':
             self.root[direction]['categories'].pop(section)
+            self._index_direction(direction)
         elif action == 'add':
             try:
                 origin = self.root[direction]['categories'][section]
@@ -306,6 +378,7 @@ class Wolfdoc():
             if new_section is None:
                 raise KeyError('no new section name defined')
             self.root[direction]['categories'][new_section] = self.root[direction]['categories'].pop(section)
+            self._index_direction(direction)
         else:
             raise KeyError(f'action: {action} unknown - {self.edit_actions}')
 
@@ -416,14 +489,7 @@ class Wolfdoc():
         result = dict()
         for i in sections:
             elements = self.root[direction]['categories'][i]
-            element = dict()
-            for key in elements:
-                values = [(j, elements[key][j]) for j in elements[key] if attr is None or j in attr]
-                val = dict()
-                for j in values:
-                    val[j[0]] = j[1]
-                element[key] = val
-            result[i] = element
+            result[i] = {key: self._element_view(elements[key], attr) for key in elements}
 
         return result
 
@@ -432,44 +498,43 @@ class Wolfdoc():
         if direction not in self.direction_types:
             raise KeyError(f'{direction} - expect {self.direction_types}')
 
-        elements = self.get_elements(direction, section, attr)
         if name is None:
-            return elements
+            return self.get_elements(direction, section, attr)
 
-        result = dict()
-        for i in elements:
-            result[i] = dict()
-            for j in elements[i]:
-                if name == j:
-                    result[i][j] = elements[i][j]
-            if len(result[i]) == 0:
-                result.pop(i)
-
-        if len(result) == 0:
+        if section is None:
+            result = {i: {name: self._element_view(self._element(direction, i, n), attr)}
+                      for i, n in self._name_index[direction] if n == name}
+            return result if len(result) else None
+
+        if (section, name) not in self._name_index[direction]:
+            # keep the KeyError for unknown sections
+            self.root[direction]['categories'][section]
             return None
-        else:
-            return result
+        return {section: {name: self._element_view(self._element(direction, section, name), attr)}}
 
     def get_element_by_cmd(self, direction, cmd, attr=None) -> dict:
         if direction not in self.direction_types:
             raise KeyError(f'{direction} - expect {self.direction_types}')
 
-        if attr:
-            attr.append('command')
-        elements = self.get_elements(direction, None, attr)
-        res = [{i: {j: elements[i][j]}} for i in elements for j in elements[i]
-               if elements[i][j]['command'] == cmd.upper()]
-        if len(res) == 0:
+        entry = self._cmd_index[direction].get(cmd.upper())
+        if entry is None:
             return None
-        return res[0]
+
+        section, name = entry
+        if attr is not None:
+            attr = set(attr) | {'command'}
+        return {section: {name: self._element_view(self._element(direction, section, name), attr)}}
 
     def get_param_list(self, value=None):
-        attr = 'idx' if type(value) is int else 'name'
-        for i in self.param_list:
-            if i[attr] == value:
-                i['comment'] = i['name']
-                return i
-        return None
+        """
+        return a copy of the parameter list entry with idx or name value, comment is set to the name
+        """
+        param = self._param_idx.get(value) if type(value) is int else self._param_name.get(value)
+        if param is None:
+            return None
+        param = dict(param)
+        param['comment'] = param['name']
+        return param
 
     def copy_element(self, direction, from_section, from_name, to_section, to_name, to_cmd, dump_file=False,
                      file_name=None):
@@ -483,6 +548,7 @@ class Wolfdoc():
             new = original.copy()
             new['command'] = to_cmd
             self.root[direction]['categories'][to_section][to_name] = new
+            self._index_add(direction, to_section, to_name, new)
             if dump_file:
                 self.dump_json(file_name)
         return new
@@ -501,10 +567,13 @@ class Wolfdoc():
 
         self.root[self.element['direction']]['categories'][self.element['section']][self.element['name']] = \
             self.element['param']
+        self._index_add(self.element['direction'], self.element['section'], self.element['name'],
+                        self.element['param'])
         self.element = None
 
     def remove_element(self, direction, section, name):
         self.root[direction]['categories'][section].pop(name)
+        self._index_remove(direction, section, name)
 
 
 if __name__ == '__main__':